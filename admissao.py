@@ -0,0 +1,132 @@
+import time
+import random
+import threading
+
+from db import transacao
+
+# Controle de admissão do checkout (/create_preference).
+#
+# Limites de taxa por chave (IP, CPF, ...) no modelo de balde de fichas, implementado como
+# GCRA: para cada chave guardamos só o "instante teórico de chegada" (TAT) da próxima
+# requisição. Uma requisição é aceita se, somando o seu custo ao TAT, ele não passar de
+# agora + rajada x intervalo; caso contrário é recusada sem alterar nada, e o cliente deve
+# esperar a diferença. Com várias chaves (IP e CPF) a requisição só consome as fichas se todas
+# a aceitarem. O estado fica em memória (um por processo: o limite efetivo é o
+# configurado vezes o número de workers) ou, com ADMISSAO_BACKEND=postgres, numa tabela
+# UNLOGGED compartilhada por todos os processos, atualizada numa transação que trava as chaves.
+#
+# Além disso há um teto de checkouts em andamento por processo: acima dele a requisição é
+# recusada na hora (429) em vez de esperar por uma conexão do banco e travar tokens.
+
+
+class LimiteTaxa:
+    def __init__(self, nome, por_minuto, rajada):
+        self.nome = nome
+        self.intervalo = 60.0 / por_minuto  # Segundos "gastos" por requisição
+        self.tolerancia = self.intervalo * max(rajada, 1)
+
+
+class BackendMemoria:
+    MAX_CHAVES = 100000
+
+    def __init__(self):
+        self._tat = {}
+        self._lock = threading.Lock()
+
+    def consumir(self, pedidos):
+        """Consome uma ficha de cada (chave, intervalo, tolerancia) de `pedidos`, tudo ou nada.
+
+        Retorna (None, 0) se todas foram aceitas, ou (índice do primeiro pedido recusado,
+        segundos a esperar); nesse caso nenhum TAT é alterado.
+        """
+        agora = time.monotonic()
+        with self._lock:
+            novos = []
+            for i, (chave, intervalo, tolerancia) in enumerate(pedidos):
+                # Medido a partir de agora, e não pelo TAT absoluto: com rajada 1 (tolerância =
+                # intervalo) a primeira requisição dá exatamente 0, sem erro de arredondamento
+                atraso = max(self._tat.get(chave, agora) - agora, 0.0) + intervalo
+                if atraso > tolerancia:
+                    return i, atraso - tolerancia
+                novos.append((chave, agora + atraso))
+            self._tat.update(novos)
+            if len(self._tat) > self.MAX_CHAVES:
+                # Chaves cujo TAT já passou equivalem a baldes cheios: podem ser esquecidas
+                for antiga in [c for c, tat in self._tat.items() if tat <= agora]:
+                    del self._tat[antiga]
+        return None, 0.0
+
+
+class BackendPostgres:
+    """Estado compartilhado na tabela LimitesTaxa (UNLOGGED, ver migracoes.py)."""
+
+    def consumir(self, pedidos):
+        """Como BackendMemoria.consumir(), numa transação que trava as linhas das chaves."""
+        chaves = [chave for chave, _, _ in pedidos]
+        parametros = {
+            'chaves': chaves,
+            'intervalos': [intervalo for _, intervalo, _ in pedidos],
+            'tolerancias': [tolerancia for _, _, tolerancia in pedidos],
+        }
+        with transacao(cursor_factory=None) as cur:
+            # Chave nova equivale a balde cheio (TAT = agora); a ordem fixa evita deadlock entre processos
+            cur.execute("""
+                INSERT INTO LimitesTaxa (chave, tat)
+                SELECT chave, clock_timestamp() FROM unnest(%(chaves)s::text[]) AS chave ORDER BY chave
+                ON CONFLICT (chave) DO NOTHING;
+            """, parametros)
+            cur.execute("""
+                SELECT v.chave,
+                       EXTRACT(EPOCH FROM GREATEST(l.tat, clock_timestamp()) + make_interval(secs => v.intervalo)
+                                          - clock_timestamp() - make_interval(secs => v.tolerancia))
+                FROM LimitesTaxa l
+                JOIN unnest(%(chaves)s::text[], %(intervalos)s::float8[], %(tolerancias)s::float8[])
+                     AS v(chave, intervalo, tolerancia) ON v.chave = l.chave
+                ORDER BY l.chave
+                FOR UPDATE OF l;
+            """, parametros)
+            excessos = dict(cur.fetchall())
+            for i, chave in enumerate(chaves):
+                if float(excessos[chave]) > 0:
+                    return i, float(excessos[chave])
+            cur.execute("""
+                UPDATE LimitesTaxa l
+                SET tat = GREATEST(l.tat, clock_timestamp()) + make_interval(secs => v.intervalo)
+                FROM unnest(%(chaves)s::text[], %(intervalos)s::float8[]) AS v(chave, intervalo)
+                WHERE l.chave = v.chave;
+            """, parametros)
+            if random.random() < 0.001:
+                cur.execute("DELETE FROM LimitesTaxa WHERE tat < clock_timestamp() - interval '1 hour';")
+        return None, 0.0
+
+
+class ControleAdmissao:
+    def __init__(self, limites, backend=None, max_simultaneos=8):
+        self.limites = {limite.nome: limite for limite in limites}
+        self.backend = backend or BackendMemoria()
+        self.max_simultaneos = max_simultaneos
+        self._vagas = threading.BoundedSemaphore(max_simultaneos)
+
+    def verificar(self, **chaves):
+        """Consome uma ficha de cada limite cuja chave foi informada, só se todos aceitarem.
+
+        Uma requisição recusada pelo limite do CPF não gasta a ficha do IP, e vice-versa.
+        Retorna (None, 0) se aceita, ou (nome do limite excedido, segundos a esperar).
+        """
+        nomes = [nome for nome, valor in chaves.items() if valor and nome in self.limites]
+        if not nomes:
+            return None, 0.0
+        recusado, espera = self.backend.consumir([
+            (f"{nome}:{chaves[nome]}", self.limites[nome].intervalo, self.limites[nome].tolerancia)
+            for nome in nomes
+        ])
+        if recusado is not None:
+            return nomes[recusado], espera
+        return None, 0.0
+
+    def ocupar(self):
+        """Tenta ocupar uma vaga de checkout em andamento, sem esperar."""
+        return self._vagas.acquire(blocking=False)
+
+    def liberar(self):
+        self._vagas.release()
@@ -1,30 +1,99 @@
 import os
+import sys
+
+# Com WEB_PRELOAD=true o gunicorn importa este módulo no master, antes do fork. O worker gevent
+# só faz o monkey patch ao iniciar, quando ssl, requests e os locks criados na importação
+# (db.py, reservas.py, ...) já estariam na versão bloqueante; por isso, nesse caso, o patch vem
+# antes de qualquer outro import. Sem preload ele fica a cargo do próprio worker gevent.
+if ('gunicorn' in sys.modules and os.getenv('WEB_PRELOAD', 'false').lower() == 'true'
+        and os.getenv('WEB_WORKER_CLASS', 'gevent') == 'gevent'):
+    from gevent import monkey
+    monkey.patch_all()
+
+import time
+INICIO_IMPORTACAO = time.perf_counter()  # Duração da importação do app, exposta em /metrics
+
 import logging
+import click
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, Response, g, abort, render_template, request, jsonify, redirect, url_for, stream_with_context
 from flask_mail import Mail, Message
-import random
+import queue
+from datetime import datetime, timedelta, timezone
 import requests
 import json
-import mercadopago
+import hmac
+import uuid
 import psycopg2
 import psycopg2.extras # <--- ADICIONE ESTA LINHA
+from functools import wraps
+from werkzeug.middleware.proxy_fix import ProxyFix
+from db import transacao, conexao, estatisticas_pool
+from reservas import reservar_tokens, amostrar_tokens_disponiveis, ler_contador, contador_em_cache
+from pedidos import vincular_tokens, tokens_do_pedido, VarredorReservas
+from notificacoes import (ConsumidorNotificacoes, ConexaoSMTPPersistente, CANAL_EMAIL, CANAL_DISCORD, CANAL_RESUMO_ADMIN,
+                          CANAL_ESTORNO)
+from processamento_webhook import ConsumidorWebhooks, registrar_notificacao
+from eventos_pedidos import assinaturas_status
+from cache_pedidos import cache_pedidos, STATUS_FINAIS
+from metricas import medir, registro as registro_metricas, REQUISICAO_SEGUNDOS, ADMISSAO_RECUSAS
+from admissao import ControleAdmissao, LimiteTaxa, BackendMemoria, BackendPostgres
+from estaticos import AtivosEstaticos, PaginasEmCache, CACHE_SEMPRE_REVALIDAR
+from rifas import carregar_rifa, rifa_em_cache, novo_order_id, rifa_do_pedido
+from logs import configurar_logs, resumir_lista, estatisticas_logs
+from pagamentos import get_mp_sdk, aplicar_pagamento, despachar_estornos, intervalo_resumo_admin
+from relatorios import exportar, resumo_vendas, AtualizadorRelatorios, EXPORTACOES, FORMATOS
 
 # Carrega as variáveis do ambiente do arquivo .env
 load_dotenv()
 
-app = Flask(__name__)
-
-# Configuração do Logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# A pasta static/ é servida por AtivosEstaticos (da memória, com URLs versionadas e compressão)
+app = Flask(__name__, static_folder=None)
+ativos_estaticos = AtivosEstaticos(os.path.join(app.root_path, 'static'))
+paginas_em_cache = PaginasEmCache(maximo=int(os.getenv('PAGINAS_CACHE_MAX', '64')))
+app.add_url_rule('/static/<path:filename>', endpoint='static', view_func=ativos_estaticos.servir)
+
+@app.url_defaults
+def versionar_estaticos(endpoint, values):
+    # url_for('static', ...) passa a gerar /static/...?v=<hash do conteúdo>
+    if endpoint == 'static' and 'v' not in values:
+        versao = ativos_estaticos.versao(values.get('filename'))
+        if versao:
+            values['v'] = versao
+
+# Atrás de proxies (ex.: o roteador do Heroku), o IP do cliente vem em X-Forwarded-For.
+# PROXY_SALTOS = quantos proxies confiáveis ficam na frente do app. O padrão, 1, é o roteador
+# do Heroku da implantação do Procfile; use 0 só com conexão direta, sem proxy. O limite de
+# checkouts por IP (ver controle_admissao) usa esse IP: com menos saltos que o real ele vale
+# para o IP do proxy, isto é, para todos os clientes juntos; com mais, aceita IPs forjados.
+PROXY_SALTOS = int(os.getenv('PROXY_SALTOS', '1'))
+if PROXY_SALTOS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_SALTOS, x_proto=PROXY_SALTOS)
+
+# Configuração do Logging: JSON por uma fila com escritor em segundo plano (ver logs.py)
+configurar_logs()
+
+# Configuração lida e validada uma vez, na importação. Nada aqui abre conexões: o pool do banco,
+# as conexões SMTP e o SDK do Mercado Pago são criados no processo que os usa, depois do fork,
+# então o app pode ser importado pelo master do gunicorn com --preload (ver gunicorn.conf.py).
+# Variáveis ausentes desativam a parte do app que depende delas, com um aviso no log.
+
+def _inteiro_opcional(nome):
+    valor = os.getenv(nome)
+    try:
+        return int(valor) if valor else None
+    except ValueError:
+        logging.error(f"❌ {nome} inválida: {valor!r}")
+        return None
 
-# Variável de controle para o e-mail de teste
-email_test_sent = False
+def _booleano_opcional(nome):
+    valor = os.getenv(nome)
+    return valor.lower() == 'true' if valor else None
 
 # Configuração do Flask-Mail usando variáveis de ambiente
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
-app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT'))
-app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS').lower() == 'true'
+app.config['MAIL_PORT'] = _inteiro_opcional('MAIL_PORT')
+app.config['MAIL_USE_TLS'] = _booleano_opcional('MAIL_USE_TLS')
 app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
@@ -37,41 +106,34 @@ DISCORD_WEBHOOK_URL = os.getenv('DISCORD_WEBHOOK_URL')
 # https://www.mercadopago.com.br/developers/panel/credentials
 app.config['MP_ACCESS_TOKEN'] = os.getenv('MP_ACCESS_TOKEN') # Seu Access Token do Mercado Pago
 
-# Configuração do banco de dados PostgreSQL
-DATABASE_URL = os.getenv('POSTGRES_URL')
+# Tempo (minutos) que os números ficam reservados para um pedido pendente; depois disso o
+# pedido expira, os números voltam à venda e o link de pagamento deixa de valer
+RESERVA_MINUTOS = int(os.getenv('RESERVA_MINUTOS', '30'))
 
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        logging.error(f"❌ Erro ao conectar ao banco de dados: {e}")
-        raise
+# Rifa exibida na página inicial e usada quando o checkout não informa rifa_id (ver rifas.py)
+RIFA_PADRAO = int(os.getenv('RIFA_PADRAO', '1'))
 
-def contar_tokens_disponiveis_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT COUNT(id) FROM Tokens WHERE disponivel = TRUE;")
-        count = cur.fetchone()[0]
+# Rotas /admin/* e de monitoramento (/metrics, /db_pool_stats, ...): exigem o cabeçalho "Authorization: Bearer <ADMIN_TOKEN>"; sem ADMIN_TOKEN elas não existem
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Configuração do banco de dados PostgreSQL
+# As conexões vêm de um pool por worker (ver db.py), configurado por POSTGRES_URL,
+# DB_POOL_MIN, DB_POOL_MAX e DB_POOL_TIMEOUT
+
+def contar_tokens_disponiveis_db(rifa_id):
+    # Lê o contador incremental (ContadorTokens) em vez de contar a tabela Tokens
+    with transacao(cursor_factory=None) as cur:
+        count = ler_contador(cur, rifa_id)
         return count
-    finally:
-        cur.close()
-        conn.close()
 
-def selecionar_tokens_aleatorios_db(quantidade):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    try:
-        cur.execute(
-            "SELECT id, numero_token FROM Tokens WHERE disponivel = TRUE ORDER BY RANDOM() LIMIT %s;",
-            (quantidade,)
-        )
-        tokens_selecionados = cur.fetchall()
+def selecionar_tokens_aleatorios_db(rifa_id, quantidade):
+    with transacao() as cur:
+        tokens_selecionados = amostrar_tokens_disponiveis(cur, rifa_id, quantidade)
         return tokens_selecionados
-    finally:
-        cur.close()
-        conn.close()
+
+def carregar_rifa_db(rifa_id):
+    with transacao(cursor_factory=None) as cur:
+        return carregar_rifa(cur, rifa_id)
 
 # Função robusta para configurar Flask-Mail
 mail = None
@@ -79,7 +141,7 @@ def configure_mail(app):
     try:
         required = ['MAIL_SERVER', 'MAIL_PORT', 'MAIL_USE_TLS', 'MAIL_USERNAME', 'MAIL_PASSWORD', 'MAIL_DEFAULT_SENDER']
         for key in required:
-            if not app.config.get(key):
+            if app.config.get(key) in (None, ''):  # MAIL_USE_TLS=false é um valor válido
                 raise ValueError(f"Variável de ambiente obrigatória ausente: {key}")
         return Mail(app)
     except Exception as e:
@@ -88,44 +150,56 @@ def configure_mail(app):
 
 mail = configure_mail(app)
 
-# Função robusta para verificar serviço de e-mail
+# Conexão SMTP reaproveitada pelos envios em lote da fila de notificações; cada thread abre
+# a sua no primeiro envio
+smtp_persistente = ConexaoSMTPPersistente(mail) if mail else None
+
+# Com um intervalo (em segundos) definido, as confirmações para o admin são agrupadas
+# em um único e-mail por intervalo, em vez de um e-mail por pedido
+EMAIL_ADMIN_RESUMO_INTERVALO = intervalo_resumo_admin()
+
+def validar_configuracao():
+    """Lista as partes do app desativadas pela configuração atual (sem abrir conexões)."""
+    problemas = []
+    if not os.getenv('POSTGRES_URL'):
+        problemas.append("POSTGRES_URL não definida: o banco de dados fica indisponível.")
+    if not app.config.get('MP_ACCESS_TOKEN'):
+        problemas.append("MP_ACCESS_TOKEN não definido: os pagamentos ficam indisponíveis.")
+    if not mail:
+        problemas.append("Flask-Mail não configurado: os e-mails ficam na fila sem envio.")
+    if not DISCORD_WEBHOOK_URL:
+        problemas.append("DISCORD_WEBHOOK_URL não definida: os avisos no Discord são ignorados.")
+    return problemas
 
-def check_email_service():
-    global email_test_sent
-    if email_test_sent:
-        logging.info("📧 E-mail de verificação já foi enviado.")
-        return True
+PROBLEMAS_CONFIGURACAO = validar_configuracao()
+for problema in PROBLEMAS_CONFIGURACAO:
+    logging.warning(f"⚠️ {problema}")
+
+# Verificação do serviço de e-mail, sob demanda: flask --app app verificar-email [--enviar-teste]
+def check_email_service(enviar_teste=False):
+    """Abre (e fecha) uma conexão SMTP autenticada; com `enviar_teste`, envia um e-mail para MAIL_DEFAULT_SENDER."""
     if not mail:
         logging.error("❌ Serviço de e-mail não configurado corretamente.")
         return False
     sender_email = app.config.get('MAIL_DEFAULT_SENDER')
-    if not sender_email:
-        logging.error("❌ MAIL_DEFAULT_SENDER não configurado.")
-        return False
     try:
         with app.app_context():
-            msg = Message(subject="Verificação de E-mail - Sorteio do Carro",
-                          recipients=[sender_email],
-                          body="Este é um e-mail de teste para verificar a configuração do seu serviço de e-mail para o Sorteio do Carro.")
-            mail.send(msg)
-        logging.info(f"✅ E-mail de verificação enviado com sucesso para: {sender_email}.")
-        email_test_sent = True
+            with mail.connect() as conexao_smtp:
+                if enviar_teste:
+                    conexao_smtp.send(Message(subject="Verificação de E-mail - Sorteio",
+                                              recipients=[sender_email],
+                                              body="Este é um e-mail de teste para verificar a configuração do serviço de e-mail do sorteio."))
+        logging.info(f"✅ Serviço de e-mail verificado{f' (teste enviado para {sender_email})' if enviar_teste else ''}.")
         return True
     except Exception as e:
         logging.error(f"❌ Falha na verificação do serviço de e-mail. Erro: {e}")
         return False
 
-# Inicialização do Mercado Pago SDK de forma segura
-def get_mp_sdk():
-    access_token = app.config.get('MP_ACCESS_TOKEN')
-    if not access_token:
-        logging.error('❌ MP_ACCESS_TOKEN não configurado!')
-        return None
-    try:
-        return mercadopago.SDK(access_token)
-    except Exception as e:
-        logging.error(f'❌ Erro ao inicializar Mercado Pago SDK: {e}')
-        return None
+@app.cli.command('verificar-email')
+@click.option('--enviar-teste', is_flag=True, help="Também envia um e-mail para MAIL_DEFAULT_SENDER.")
+def verificar_email(enviar_teste):
+    if not check_email_service(enviar_teste):
+        raise SystemExit(1)
 
 # Função para enviar mensagem para o Discord Webhook
 def send_discord_notification(message, color=None):
@@ -143,22 +217,202 @@ def send_discord_notification(message, color=None):
             }
         ]
     }
-    try:
-        response = requests.post(DISCORD_WEBHOOK_URL, data=json.dumps(payload), headers=headers)
+    # Sem tratamento de exceção aqui: quem chama (o consumidor da fila) reagenda em caso de falha
+    with medir('envio_discord'):
+        response = requests.post(DISCORD_WEBHOOK_URL, data=json.dumps(payload), headers=headers, timeout=(3.05, 10))
         response.raise_for_status()
-        logging.info("🔔 Mensagem de status enviada para o Discord com sucesso.")
-    except requests.exceptions.RequestException as e:
-        logging.error(f"❌ Erro ao enviar mensagem para o Discord Webhook: {e}")
-    except json.JSONDecodeError as e:
-        logging.error(f"❌ Erro de codificação JSON para o Discord Webhook: {e}")
+    logging.info("🔔 Mensagem de status enviada para o Discord com sucesso.")
+
+
+# Despachantes da fila de notificações (ver notificacoes.py): recebem um lote de payloads
+# e retornam, para cada um, None em caso de sucesso ou o erro ocorrido
+def despachar_emails(payloads):
+    if not smtp_persistente:
+        return [RuntimeError("Serviço de e-mail não configurado.")] * len(payloads)
+    with app.app_context():
+        mensagens = [Message(p['assunto'], recipients=p['destinatarios'], body=p['corpo']) for p in payloads]
+        with medir('envio_email'):
+            return smtp_persistente.enviar_lote(mensagens)
+
+def despachar_resumo_admin(payloads):
+    # Um único e-mail com todas as confirmações da janela
+    if not smtp_persistente:
+        return [RuntimeError("Serviço de e-mail não configurado.")] * len(payloads)
+    with app.app_context():
+        msg_resumo = Message(
+            f"✅ Resumo de Compras Confirmadas ({len(payloads)})",
+            recipients=[app.config['MAIL_DEFAULT_SENDER']],
+            body=f"{len(payloads)} COMPRA(S) CONFIRMADA(S):\n\n" + "\n\n".join(p['linha'] for p in payloads)
+        )
+        with medir('envio_email_resumo'):
+            erro = smtp_persistente.enviar_lote([msg_resumo])[0]
+    return [erro] * len(payloads)
+
+def despachar_discord(payloads):
+    resultados = []
+    for payload in payloads:
+        try:
+            send_discord_notification(payload['mensagem'], color=payload.get('cor'))
+            resultados.append(None)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"❌ Erro ao enviar mensagem para o Discord Webhook: {e}")
+            resultados.append(e)
+    return resultados
+
+def criar_consumidor_notificacoes():
+    limites = {
+        CANAL_EMAIL: int(os.getenv('NOTIFICACOES_CONCORRENCIA_EMAIL', '2')),
+        CANAL_DISCORD: int(os.getenv('NOTIFICACOES_CONCORRENCIA_DISCORD', '1')),
+        CANAL_ESTORNO: 1,
+    }
+    despachantes = {CANAL_EMAIL: despachar_emails, CANAL_DISCORD: despachar_discord, CANAL_ESTORNO: despachar_estornos}
+    if EMAIL_ADMIN_RESUMO_INTERVALO:
+        despachantes[CANAL_RESUMO_ADMIN] = despachar_resumo_admin
+    return ConsumidorNotificacoes(despachantes, limites=limites, lotes={CANAL_RESUMO_ADMIN: 500})
+
+def criar_consumidor_webhooks():
+    return ConsumidorWebhooks(processar_notificacao_pagamento, threads=int(os.getenv('WEBHOOKS_THREADS', '2')))
+
+# Tarefas em segundo plano: por padrão ficam só no processo dedicado `python worker.py` (o
+# `worker` do Procfile), e os workers web apenas enfileiram. Com TAREFAS_EMBUTIDAS=true (deploy
+# sem o processo worker, ou `python app.py` em desenvolvimento) cada worker web drena as filas
+# de notificações e de webhooks em threads próprias, iniciadas no primeiro request (depois do
+# fork do gunicorn); isso multiplica as conexões e as consultas de polling pelo número de workers.
+consumidor_notificacoes = None
+consumidor_webhooks = None
+varredor_reservas = None
+atualizador_relatorios = None
+consumidores_pid = None
+
+def iniciar_consumidores():
+    global consumidor_notificacoes, consumidor_webhooks, varredor_reservas, atualizador_relatorios, consumidores_pid
+    consumidores_pid = os.getpid()
+    consumidor_notificacoes = criar_consumidor_notificacoes()
+    consumidor_webhooks = criar_consumidor_webhooks()
+    varredor_reservas = VarredorReservas(intervalo=float(os.getenv('VARREDURA_RESERVAS_INTERVALO', '60')))
+    consumidor_notificacoes.iniciar()
+    consumidor_webhooks.iniciar()
+    varredor_reservas.iniciar()
+    consumidores = [consumidor_notificacoes, consumidor_webhooks, varredor_reservas]
+    intervalo_relatorios = float(os.getenv('RELATORIOS_INTERVALO', '60'))
+    if intervalo_relatorios:
+        atualizador_relatorios = AtualizadorRelatorios(intervalo=intervalo_relatorios)
+        atualizador_relatorios.iniciar()
+        consumidores.append(atualizador_relatorios)
+    return consumidores
+
+def aquecer_processo():
+    """Cria os recursos do processo antes do primeiro request (chamada pelo gunicorn após o fork).
+
+    Carrega os arquivos estáticos na memória, abre o pool do banco (DB_POOL_MIN conexões) e cria
+    o SDK do Mercado Pago, tirando esse custo da primeira requisição de cada worker.
+    """
+    inicio = time.perf_counter()
+    with app.app_context():
+        ativos_estaticos.recursos()
+    try:
+        with conexao():
+            pass
+    except Exception as e:
+        logging.warning(f"⚠️ Pool do banco não aquecido: {e}")
+    if app.config.get('MP_ACCESS_TOKEN'):
+        get_mp_sdk()
+    logging.info(f"🔥 Processo {os.getpid()} aquecido em {(time.perf_counter() - inicio) * 1000:.0f} ms.")
+
+@app.before_request
+def garantir_consumidores():
+    global consumidores_pid
+    if consumidores_pid == os.getpid():
+        return
+    if os.getenv('TAREFAS_EMBUTIDAS', 'false').lower() == 'true':
+        iniciar_consumidores()
+    else:
+        consumidores_pid = os.getpid()
+
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+    # Vem do roteador (ex.: Heroku) quando existe; vai em todos os logs da requisição e na resposta
+    g.request_id = (request.headers.get('X-Request-ID') or uuid.uuid4().hex)[:64]
+
+@app.after_request
+def registrar_duracao(response):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        # Rótulo pelo padrão da rota (não pela URL), para não criar uma série por pedido
+        rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+        REQUISICAO_SEGUNDOS.observar(time.perf_counter() - inicio, rota=rota, metodo=request.method, status=response.status_code)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
 
 
 @app.route('/')
-def index():
-    logging.info("🌐 Requisição recebida para a página inicial ('/').")
-    return render_template('index.html')
+@app.route('/rifa/<int:rifa_id>')
+def index(rifa_id=None):
+    logging.info("🌐 Requisição recebida para a página inicial ('%s').", request.path)
+    rifa = rifa_em_cache(rifa_id or RIFA_PADRAO, carregar_rifa_db)
+    if not rifa or rifa['status'] == 'arquivada':
+        abort(404)
+    return paginas_em_cache.servir('index.html', rifa_id=rifa['id'], nome_rifa=rifa['nome'],
+                                   valor_unitario=f"{rifa['valor_unitario']:.2f}", vendas_abertas=rifa['status'] == 'ativa')
+
+@app.route('/tokens_disponiveis')
+def tokens_disponiveis():
+    # Consultado periodicamente pela página inicial; servido do cache em memória na maior parte das vezes
+    rifa_id = request.args.get('rifa_id', RIFA_PADRAO, type=int)
+    try:
+        disponiveis = contador_em_cache(rifa_id, contar_tokens_disponiveis_db)
+    except Exception as e:
+        logging.error(f"❌ Erro ao ler contador de tokens disponíveis: {e}")
+        return jsonify({'success': False}), 503
+    response = jsonify({'success': True, 'disponiveis': disponiveis})
+    response.headers['Cache-Control'] = 'public, max-age=5'
+    return response
+
+# Controle de admissão do checkout (ver admissao.py): limites por IP e por CPF e um teto de
+# checkouts simultâneos por processo, recusados com 429 antes de tocar no banco.
+# O IP é o do cliente só com PROXY_SALTOS correto (ver acima)
+controle_admissao = ControleAdmissao(
+    [
+        LimiteTaxa('ip', float(os.getenv('ADMISSAO_IP_POR_MINUTO', '10')), int(os.getenv('ADMISSAO_IP_RAJADA', '5'))),
+        LimiteTaxa('cpf', float(os.getenv('ADMISSAO_CPF_POR_MINUTO', '5')), int(os.getenv('ADMISSAO_CPF_RAJADA', '3'))),
+    ],
+    backend=BackendPostgres() if os.getenv('ADMISSAO_BACKEND', 'memoria') == 'postgres' else BackendMemoria(),
+    max_simultaneos=int(os.getenv('ADMISSAO_CHECKOUTS_SIMULTANEOS', '8')),
+)
+
+def recusar_checkout(motivo, espera):
+    ADMISSAO_RECUSAS.incrementar(motivo=motivo)
+    logging.warning(f"🚦 Checkout recusado pelo controle de admissão ({motivo}); tentar novamente em {espera:.0f}s.")
+    response = jsonify({'success': False, 'message': 'Muitas tentativas de compra. Aguarde alguns segundos e tente novamente.'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(espera + 0.999)))
+    return response
+
+def admitir_checkout(view):
+    @wraps(view)
+    def envolvida(*args, **kwargs):
+        data = request.get_json(silent=True) or {}
+        cpf = ''.join(c for c in str(data.get('cpf') or '') if c.isdigit())
+        try:
+            motivo, espera = controle_admissao.verificar(ip=request.remote_addr, cpf=cpf)
+        except Exception as e:
+            # Sem o backend compartilhado o checkout segue; o teto de simultâneos continua valendo
+            logging.error(f"❌ Erro no controle de admissão: {e}")
+            motivo, espera = None, 0.0
+        if motivo:
+            return recusar_checkout(motivo, espera)
+        if not controle_admissao.ocupar():
+            return recusar_checkout('simultaneos', 1)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            controle_admissao.liberar()
+    return envolvida
 
 @app.route('/create_preference', methods=['POST'])
+@admitir_checkout
 def create_preference():
     logging.info("🛒 Requisição POST recebida para '/create_preference'.")
     data = request.get_json()
@@ -167,7 +421,7 @@ def create_preference():
     cpf = data.get('cpf')
     phone = data.get('phone')
     quantity = data.get('quantity')
-    valor_unitario = 10.00
+    rifa_id = data.get('rifa_id', RIFA_PADRAO)
 
     if not all([nome, email, cpf, phone, quantity]):
         logging.warning("⚠️ Validação falhou: Campos obrigatórios ausentes.")
@@ -177,70 +431,70 @@ def create_preference():
         logging.warning(f"⚠️ Validação falhou: Quantidade inválida: {quantity}")
         return jsonify({'success': False, 'message': 'Quantidade inválida!'}), 400
 
-    conn = None
-    cur = None
+    # Recusa sem abrir transação quando o contador em cache já mostra que não há tokens
+    # suficientes; o valor exato volta a ser conferido dentro da transação
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        conn.autocommit = False
-
-        cur.execute("SELECT COUNT(id) FROM Tokens WHERE disponivel = TRUE;")
-        tokens_disponiveis_count = cur.fetchone()['count']
-        if tokens_disponiveis_count < quantity:
-            conn.rollback()
-            logging.warning(f"⚠️ Tokens insuficientes. Solicitados: {quantity}, Disponíveis: {tokens_disponiveis_count}")
+        rifa = rifa_em_cache(rifa_id, carregar_rifa_db) if isinstance(rifa_id, int) else None
+        if not rifa or rifa['status'] != 'ativa':
+            logging.warning(f"⚠️ Validação falhou: Rifa inválida ou com vendas encerradas: {rifa_id}")
+            return jsonify({'success': False, 'message': 'As vendas deste sorteio não estão abertas.'}), 400
+        valor_unitario = rifa['valor_unitario']
+        if contador_em_cache(rifa_id, contar_tokens_disponiveis_db) < quantity:
+            logging.warning(f"⚠️ Tokens insuficientes (contador em cache). Solicitados: {quantity}")
             return jsonify({'success': False, 'message': 'Não há tokens suficientes disponíveis no momento.'}), 400
+    except psycopg2.Error as db_err:
+        logging.error(f"❌ Erro de Banco de Dados em /create_preference: {db_err}")
+        return jsonify({'success': False, 'message': 'Erro ao processar seu pedido. Tente novamente mais tarde.'}), 500
 
-        cur.execute(
-            "SELECT id, numero_token FROM Tokens WHERE disponivel = TRUE ORDER BY RANDOM() LIMIT %s FOR UPDATE;",
-            (quantity,)
-        )
-        tokens_selecionados_rows = cur.fetchall()
-        if len(tokens_selecionados_rows) < quantity:
-            conn.rollback()
-            logging.warning(f"⚠️ Não foi possível selecionar/reservar tokens suficientes. Solicitados: {quantity}, Selecionados: {len(tokens_selecionados_rows)}")
-            return jsonify({'success': False, 'message': 'Não foi possível reservar os tokens necessários. Tente novamente.'}), 500
-
-        assigned_token_ids = [str(row['id']) for row in tokens_selecionados_rows]
-        assigned_token_numeros = [row['numero_token'] for row in tokens_selecionados_rows]
-        order_id_interno = f"SORTEIO-{random.randint(1000000, 9999999)}"
-        total_amount = float(quantity * valor_unitario)
-
-        cur.execute("""
-            INSERT INTO Adquiridos (
-                order_id_interno, nome_cliente, email_cliente, cpf_cliente, telefone_cliente,
-                quantidade, tokens_ids_db, tokens_numeros_db, status_compra, total_pago, data_criacao_pedido, data_ultima_atualizacao
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            RETURNING id;
-        """,
-        (
-            order_id_interno, nome, email, cpf, phone, quantity,
-            ','.join(assigned_token_ids), ','.join(assigned_token_numeros),
-            'pending', total_amount
-        ))
-        adquiridos_id = cur.fetchone()['id']
-        logging.info(f"Pedido pendente ID {adquiridos_id} (Order: {order_id_interno}) inserido no banco com {quantity} tokens: {', '.join(assigned_token_numeros)}")
-        conn.commit()
+    try:
+        with medir('checkout_transacao'), transacao() as cur:
+            with medir('contagem_tokens'):
+                tokens_disponiveis_count = ler_contador(cur, rifa_id)
+            if tokens_disponiveis_count < quantity:
+                logging.warning(f"⚠️ Tokens insuficientes. Solicitados: {quantity}, Disponíveis: {tokens_disponiveis_count}")
+                return jsonify({'success': False, 'message': 'Não há tokens suficientes disponíveis no momento.'}), 400
+
+            # Reserva aleatória em O(quantidade), sem bloquear compras simultâneas (ver reservas.py)
+            with medir('reserva_tokens'):
+                tokens_selecionados_rows = reservar_tokens(cur, rifa_id, quantity)
+            if len(tokens_selecionados_rows) < quantity:
+                cur.connection.rollback()
+                logging.warning(f"⚠️ Não foi possível selecionar/reservar tokens suficientes. Solicitados: {quantity}, Selecionados: {len(tokens_selecionados_rows)}")
+                return jsonify({'success': False, 'message': 'Não foi possível reservar os tokens necessários. Tente novamente.'}), 500
+
+            assigned_token_ids = [str(row['id']) for row in tokens_selecionados_rows]
+            assigned_token_numeros = [row['numero_token'] for row in tokens_selecionados_rows]
+            order_id_interno = novo_order_id(rifa_id)
+            total_amount = float(quantity * valor_unitario)
+
+            with medir('insercao_pedido'):
+                cur.execute("""
+                    INSERT INTO Adquiridos (
+                        rifa_id, order_id_interno, nome_cliente, email_cliente, cpf_cliente, telefone_cliente,
+                        quantidade, status_compra, total_pago, data_criacao_pedido, data_ultima_atualizacao, reservado_ate
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP,
+                              CURRENT_TIMESTAMP + make_interval(mins => %s))
+                    RETURNING id;
+                """,
+                (
+                    rifa_id, order_id_interno, nome, email, cpf, phone, quantity,
+                    'pending', total_amount, RESERVA_MINUTOS
+                ))
+                adquiridos_id = cur.fetchone()['id']
+                vincular_tokens(cur, rifa_id, adquiridos_id, assigned_token_ids)
+            logging.info("Pedido pendente ID %s (Order: %s) inserido no banco com %s tokens: %s",
+                         adquiridos_id, order_id_interno, quantity, resumir_lista(assigned_token_numeros),
+                         extra={'order_id': order_id_interno})
 
     except psycopg2.Error as db_err:
-        if conn:
-            conn.rollback()
         logging.error(f"❌ Erro de Banco de Dados em /create_preference: {db_err}")
         return jsonify({'success': False, 'message': 'Erro ao processar seu pedido. Tente novamente mais tarde.'}), 500
     except Exception as e:
-        if conn:
-            conn.rollback()
         logging.error(f"❌ Erro Geral em /create_preference: {e}")
         return jsonify({'success': False, 'message': 'Ocorreu um erro inesperado. Tente novamente.'}), 500
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.autocommit = True
-            conn.close()
 
     item = {
-        "title": f"Números da Sorte ({quantity} un.) - Pedido {order_id_interno}",
+        "title": f"{rifa['nome']} - Números da Sorte ({quantity} un.) - Pedido {order_id_interno}",
         "quantity": 1,
         "unit_price": total_amount,
         "currency_id": "BRL"
@@ -258,10 +512,15 @@ def create_preference():
     else:
         if not base_url.startswith('http://') and not base_url.startswith('https://'):
             base_url = f'https://{base_url}'
-        logging.info(f"Usando base_url: {base_url} para URLs do Mercado Pago.")
+        logging.info("Usando base_url: %s para URLs do Mercado Pago.", base_url)
 
+    # O pagamento só pode ser feito enquanto a reserva dos números estiver valendo
+    expiracao = (datetime.now(timezone.utc) + timedelta(minutes=RESERVA_MINUTOS)).isoformat(timespec='milliseconds')
     preference_data = {
         "items": [item],
+        "expires": True,
+        "expiration_date_to": expiracao,
+        "date_of_expiration": expiracao,
         "payer": payer,
         "external_reference": order_id_interno,
         "notification_url": f"{base_url}/mercadopago_webhook",
@@ -277,7 +536,8 @@ def create_preference():
         sdk = get_mp_sdk()
         if not sdk:
             return jsonify({'success': False, 'message': 'Erro na configuração do sistema de pagamento.'}), 500
-        preference_response = sdk.preference().create(preference_data)
+        with medir('mp_criar_preferencia'):
+            preference_response = sdk.preference().create(preference_data)
         preference = preference_response["response"]
         payment_link = preference["init_point"]
         logging.info(f"Preferência MP criada para Order ID {order_id_interno}. Link: {payment_link}")
@@ -287,158 +547,150 @@ def create_preference():
         logging.error(f"❌ Erro ao criar preferência no Mercado Pago para {order_id_interno}: {e_mp}")
         return jsonify({'success': False, 'message': f'Erro ao iniciar pagamento com Mercado Pago. Tente mais tarde.'}), 500
 
+def processar_notificacao_pagamento(topic, resource_id):
+    """Consulta o pagamento no Mercado Pago e aplica o novo status ao pedido.
+
+    Executada em segundo plano pelo consumidor de webhooks (ver processamento_webhook.py).
+    Retorna (order_id_interno, status do pagamento); exceções fazem a notificação ser reprocessada.
+    """
+    sdk = get_mp_sdk()
+    if not sdk:
+        raise RuntimeError("SDK Mercado Pago não configurado.")
+    with medir('mp_consultar_pagamento'):
+        payment_info = sdk.payment().get(resource_id)
+    if payment_info.get("status") != 200:
+        raise RuntimeError(f"Mercado Pago respondeu {payment_info.get('status')} ao consultar o pagamento {resource_id}")
+    logging.info("Notificação de Pagamento - ID: %s, Status: %s, External Ref: %s",
+                 resource_id, payment_info['response'].get('status'), payment_info['response'].get('external_reference'),
+                 extra={'order_id': payment_info['response'].get('external_reference')})
+    with medir('webhook_transacao'), transacao() as cur:
+        resultado = aplicar_pagamento(cur, payment_info["response"])
+    if consumidor_notificacoes:
+        consumidor_notificacoes.acordar()
+    return resultado
+
 # Endpoint para receber notificações do Mercado Pago (IPN - Instant Payment Notification)
 # ESTA É A PARTE CRÍTICA PARA CONFIRMAR O PAGAMENTO!
 @app.route('/mercadopago_webhook', methods=['GET', 'POST'])
 def mercadopago_webhook():
     logging.info("🔔 Notificação de Mercado Pago Webhook recebida!")
     if request.method == 'GET':
-        logging.info(f"Webhook GET request: {request.args}")
+        logging.info("Webhook GET request: %s", request.args)
         return "OK", 200
     elif request.method == 'POST':
         notification_data = request.args
         topic = notification_data.get('topic')
         resource_id = notification_data.get('id')
-        logging.info(f"Webhook POST request: Topic='{topic}', Resource ID='{resource_id}'")
+        logging.info("Webhook POST request: Topic='%s', Resource ID='%s'", topic, resource_id)
         if topic == 'payment':
-            sdk = get_mp_sdk()
-            if not sdk:
-                logging.error('❌ SDK Mercado Pago não configurado.')
-                return "OK", 200
+            # Só registra a entrega e responde na hora; o processamento acontece em segundo plano,
+            # uma única vez por pagamento mesmo que o Mercado Pago reenvie a notificação
             try:
-                payment_info = sdk.payment().get(resource_id)
-                payment_status = payment_info["response"].get("status")
-                external_reference = payment_info["response"].get("external_reference")
-                payment_id_mp = payment_info["response"].get("id")
-                logging.info(f"Notificação de Pagamento - ID: {resource_id}, Status: {payment_status}, External Ref: {external_reference}")
-                conn = get_db_connection()
-                cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-                cur.execute("SELECT * FROM Adquiridos WHERE order_id_interno = %s FOR UPDATE;", (external_reference,))
-                compra = cur.fetchone()
-                if not compra:
-                    logging.warning(f"⚠️ Pedido não encontrado para external_reference '{external_reference}' no banco.")
-                    cur.close()
-                    conn.close()
-                    return "OK", 200
-                if payment_status == 'approved':
-                    if compra['status_compra'] != 'approved':
-                        logging.info(f"✅ Pagamento APROVADO para Order ID: {external_reference}. Processando compra.")
-                        # Atualiza status e payment_id_mp
-                        cur.execute("""
-                            UPDATE Adquiridos SET status_compra = 'approved', payment_id_mp = %s, data_ultima_atualizacao = CURRENT_TIMESTAMP
-                            WHERE order_id_interno = %s;
-                        """, (str(payment_id_mp), external_reference))
-                        # Marca tokens como usados
-                        token_ids = compra['tokens_ids_db'].split(',')
-                        cur.execute(f"UPDATE Tokens SET disponivel = FALSE WHERE id IN ({','.join(['%s']*len(token_ids))});", token_ids)
-                        conn.commit()
-                        # Envia e-mails e Discord
-                        try:
-                            msg_customer = Message(
-                                "Detalhes da sua Compra Confirmada - Sorteio do Carro",
-                                recipients=[compra['email_cliente']],
-                                body=(
-                                    f"Prezado(a) {compra['nome_cliente']},\n\n"
-                                    f"Seu pagamento foi CONFIRMADO com sucesso!\nObrigado por participar do nosso sorteio!\n\n"
-                                    f"Aqui estão os detalhes da sua compra:\n"
-                                    f"Nome: {compra['nome_cliente']}\n"
-                                    f"Email: {compra['email_cliente']}\n"
-                                    f"CPF: {compra['cpf_cliente']}\n"
-                                    f"Telefone: {compra['telefone_cliente']}\n"
-                                    f"Quantidade de números da sorte: {compra['quantidade']}\n"
-                                    f"Seus números da sorte: {compra['tokens_numeros_db']}\n\n"
-                                    f"Boa sorte!\n"
-                                )
-                            )
-                            mail.send(msg_customer)
-                            msg_admin = Message(
-                                f"✅ Compra Confirmada - Sorteio do Carro - {compra['nome_cliente']}",
-                                recipients=[app.config['MAIL_DEFAULT_SENDER']],
-                                body=(
-                                    f"COMPRA CONFIRMADA!\n\n"
-                                    f"Cliente: {compra['nome_cliente']}\n"
-                                    f"Email do Cliente: {compra['email_cliente']}\n"
-                                    f"CPF: {compra['cpf_cliente']}\n"
-                                    f"Telefone: {compra['telefone_cliente']}\n"
-                                    f"Quantidade de números comprados: {compra['quantidade']}\n"
-                                    f"Tokens Atribuídos: {compra['tokens_numeros_db']}\n"
-                                    f"Status do Pagamento (MP): APROVADO\n"
-                                    f"ID do Pagamento (MP): {payment_id_mp}\n"
-                                )
-                            )
-                            mail.send(msg_admin)
-                            discord_message = (
-                                f"🎉 COMPRA CONFIRMADA! 🎉\nCliente: **{compra['nome_cliente']}** ({compra['email_cliente']})\nComprou: **{compra['quantidade']}** números\nTotal: **R${compra['total_pago']:.2f}**\nTokens: `{compra['tokens_numeros_db']}`\nStatus MP: APROVADO\nID Pagamento MP: `{payment_id_mp}`"
-                            )
-                            send_discord_notification(discord_message, color=3066993)
-                        except Exception as e:
-                            logging.error(f"❌ Erro ao enviar e-mails/Discord de confirmação de compra APROVADA: {e}")
-                    else:
-                        logging.info(f"ℹ️ Pagamento APROVADO para Order ID: {external_reference}, mas já processado anteriormente.")
-                elif payment_status == 'rejected':
-                    if compra['status_compra'] != 'rejected':
-                        logging.warning(f"❌ Pagamento REJEITADO para Order ID: {external_reference}.")
-                        cur.execute("""
-                            UPDATE Adquiridos SET status_compra = 'rejected', payment_id_mp = %s, data_ultima_atualizacao = CURRENT_TIMESTAMP
-                            WHERE order_id_interno = %s;
-                        """, (str(payment_id_mp), external_reference))
-                        conn.commit()
-                        discord_message = (
-                            f"💔 PAGAMENTO REJEITADO! 💔\nCliente: **{compra['nome_cliente']}** ({compra['email_cliente']})\nTentou comprar: **{compra['quantidade']}** números\nTotal: **R${compra['total_pago']:.2f}**\nStatus MP: REJEITADO\nID Pagamento MP: `{payment_id_mp}`"
-                        )
-                        send_discord_notification(discord_message, color=15158332)
-                    else:
-                        logging.info(f"ℹ️ Pagamento REJEITADO para Order ID: {external_reference}, mas já processado anteriormente.")
-                elif payment_status == 'pending':
-                    if compra['status_compra'] != 'pending':
-                        cur.execute("""
-                            UPDATE Adquiridos SET status_compra = 'pending', payment_id_mp = %s, data_ultima_atualizacao = CURRENT_TIMESTAMP
-                            WHERE order_id_interno = %s;
-                        """, (str(payment_id_mp), external_reference))
-                        conn.commit()
-                        logging.info(f"⏳ Pagamento PENDENTE para Order ID: {external_reference}. Status atualizado.")
-                cur.close()
-                conn.close()
+                with transacao() as cur:
+                    novo_trabalho = registrar_notificacao(cur, topic, resource_id)
+                if novo_trabalho and consumidor_webhooks:
+                    consumidor_webhooks.acordar()
             except Exception as e:
-                logging.error(f"❌ Erro ao processar webhook Mercado Pago: {e}")
-                if 'cur' in locals():
-                    cur.close()
-                if 'conn' in locals():
-                    conn.close()
+                logging.error(f"❌ Erro ao registrar notificação do Mercado Pago {topic}/{resource_id}: {e}")
+                return "Erro", 500
         return "OK", 200
     return "Method Not Allowed", 405
 
+def carregar_pedido_para_consulta(order_id):
+    """Dados do pedido usados por /payment_status e /success (ver cache_pedidos.py)."""
+    with transacao() as cur:
+        cur.execute(
+            "SELECT id, rifa_id, order_id_interno, status_compra, nome_cliente FROM Adquiridos WHERE order_id_interno = %s AND rifa_id = %s;",
+            (order_id, rifa_do_pedido(order_id))
+        )
+        compra = cur.fetchone()
+        if not compra:
+            return None
+        dados = {
+            'order_id_interno': compra['order_id_interno'],
+            'status_compra': compra['status_compra'],
+            'nome_cliente': compra['nome_cliente'],
+            'tokens': tokens_do_pedido(cur, compra['rifa_id'], compra['id']) if compra['status_compra'] == 'approved' else [],
+        }
+        return dados
+
+# Status que o Mercado Pago envia na volta do checkout. A página genérica fica no cache de
+# páginas por status: qualquer outro valor vira "desconhecido" em vez de uma entrada nova
+STATUS_RETORNO_MP = {'approved', 'pending', 'authorized', 'in_process', 'in_mediation',
+                     'rejected', 'cancelled', 'refunded', 'charged_back', 'null'}
+
 @app.route('/payment_status')
 def payment_status():
     status = request.args.get('status')
     order_id = request.args.get('order_id')
-    logging.info(f"🌐 Cliente retornou da página de pagamento. Status: {status}, Order ID: {order_id}")
+    logging.info("🌐 Cliente retornou da página de pagamento. Status: %s, Order ID: %s", status, order_id, extra={'order_id': order_id})
     if order_id:
-        conn = None
-        cur = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT * FROM Adquiridos WHERE order_id_interno = %s;", (order_id,))
-            compra = cur.fetchone()
+            compra = cache_pedidos.obter(order_id, carregar_pedido_para_consulta)
         except Exception as e:
             logging.error(f"❌ Erro ao buscar compra em /payment_status para order_id {order_id}: {e}")
             compra = None
-        finally:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
         if compra:
             if compra['status_compra'] == 'approved':
-                logging.info(f"Pagamento APROVADO para Order ID '{order_id}'. Redirecionando para /success.")
+                logging.info("Pagamento APROVADO para Order ID '%s'. Redirecionando para /success.", order_id)
                 return redirect(url_for('success', order_id=compra['order_id_interno']))
             elif compra['status_compra'] == 'pending':
-                return render_template('payment_pending.html')
+                return render_template('payment_pending.html', order_id=compra['order_id_interno'])
             elif compra['status_compra'] == 'rejected':
-                return render_template('payment_rejected.html')
+                return paginas_em_cache.servir('payment_rejected.html', cache_control=CACHE_SEMPRE_REVALIDAR)
     logging.warning(f"Retorno de pagamento para Order ID '{order_id}' não encontrado, inválido ou status desconhecido: {status}.")
-    return render_template('payment_generic_status.html', status=status)
+    status = status if status in STATUS_RETORNO_MP else 'desconhecido'
+    return paginas_em_cache.servir('payment_generic_status.html', cache_control=CACHE_SEMPRE_REVALIDAR, status=status)
+
+# Tempo máximo de cada conexão SSE; o EventSource do navegador reconecta sozinho depois disso
+SSE_DURACAO_MAX = float(os.getenv('SSE_DURACAO_MAX', '25'))
+SSE_MAX_CONEXOES = int(os.getenv('SSE_MAX_CONEXOES', '200'))
+
+@app.route('/payment_status/eventos')
+def payment_status_eventos():
+    # Server-sent events: a página de pagamento pendente fica conectada aqui e recebe o novo
+    # status assim que o webhook o grava (via LISTEN/NOTIFY), sem consultar o banco por cliente
+    order_id = request.args.get('order_id')
+    if not order_id:
+        return jsonify({'success': False, 'message': 'order_id obrigatório.'}), 400
+    if assinaturas_status.total() >= SSE_MAX_CONEXOES:
+        return Response("retry: 15000\n\n", status=503, mimetype='text/event-stream', headers={'Retry-After': '15'})
+
+    def evento(status):
+        return f"event: status\ndata: {json.dumps({'order_id': order_id, 'status': status})}\n\n"
+
+    def eventos():
+        # Assina antes de ler o estado atual para não perder uma mudança entre as duas coisas
+        with assinaturas_status.assinar(order_id) as fila:
+            compra = cache_pedidos.obter(order_id, carregar_pedido_para_consulta)
+            if not compra:
+                yield evento('not_found')
+                return
+            status = compra['status_compra']
+            yield "retry: 3000\n" + evento(status)
+            limite = time.monotonic() + SSE_DURACAO_MAX
+            while status not in STATUS_FINAIS:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return
+                try:
+                    novo_status = fila.get(timeout=min(restante, 15.0))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if novo_status is None:
+                    # A escuta foi reiniciada e pode ter perdido avisos: relê o status
+                    compra = cache_pedidos.obter(order_id, carregar_pedido_para_consulta)
+                    novo_status = compra['status_compra'] if compra else 'not_found'
+                if novo_status != status:
+                    status = novo_status
+                    yield evento(status)
+
+    return Response(
+        stream_with_context(eventos()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/success')
 def success():
@@ -446,34 +698,116 @@ def success():
     tokens_adquiridos = []
     nome_cliente = ""
     if order_id:
-        conn = None
-        cur = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT nome_cliente, tokens_numeros_db FROM Adquiridos WHERE order_id_interno = %s AND status_compra = 'approved';", (order_id,))
-            compra_aprovada = cur.fetchone()
+            compra = cache_pedidos.obter(order_id, carregar_pedido_para_consulta)
+            compra_aprovada = compra if compra and compra['status_compra'] == 'approved' else None
             if compra_aprovada:
                 nome_cliente = compra_aprovada['nome_cliente']
-                if compra_aprovada['tokens_numeros_db']:
-                    tokens_adquiridos = compra_aprovada['tokens_numeros_db'].split(',')
-                logging.info(f"✔️ Página de sucesso carregada para Order ID: {order_id}. Tokens: {tokens_adquiridos}")
+                tokens_adquiridos = compra_aprovada['tokens']
+                logging.info("✔️ Página de sucesso carregada para Order ID: %s (%s tokens).", order_id, len(tokens_adquiridos),
+                             extra={'order_id': order_id})
             else:
                 logging.warning(f"⚠️ Tentativa de acesso à página de sucesso para Order ID: {order_id} não encontrado como 'approved' ou sem tokens.")
         except Exception as e:
             logging.error(f"❌ Erro ao buscar dados para página de sucesso (Order ID: {order_id}): {e}")
-        finally:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
     else:
         logging.warning("⚠️ Página de sucesso acessada sem Order ID.")
     return render_template('success.html', tokens=tokens_adquiridos, nome_cliente=nome_cliente)
 
+def exigir_admin(view):
+    @wraps(view)
+    def envolvida(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            abort(404)
+        autorizacao = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(autorizacao.encode('utf-8'), f"Bearer {ADMIN_TOKEN}".encode('utf-8')):
+            return jsonify({'success': False, 'message': 'Não autorizado.'}), 401
+        return view(*args, **kwargs)
+    return envolvida
+
+@app.route('/db_pool_stats')
+@exigir_admin
+def db_pool_stats():
+    # Estado do pool de conexões deste worker, para monitoramento
+    return jsonify(estatisticas_pool())
+
+@app.route('/cache_pedidos_stats')
+@exigir_admin
+def cache_pedidos_stats():
+    return jsonify(cache_pedidos.estatisticas())
+
+@app.route('/metrics')
+@exigir_admin
+def metrics():
+    # Métricas deste processo no formato do Prometheus (ver metricas.py)
+    return Response(registro_metricas.exportar({'pid': os.getpid()}), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def coletar_metricas_processo():
+    pool = estatisticas_pool()
+    cache = cache_pedidos.estatisticas()
+    logs = estatisticas_logs()
+    return {
+        'sorteio_db_pool_em_uso': ('Conexões do pool emprestadas no momento.', pool['em_uso']),
+        'sorteio_db_pool_ociosas': ('Conexões do pool livres no momento.', pool['ociosas']),
+        'sorteio_db_pool_timeouts': ('Esperas por conexão que esgotaram DB_POOL_TIMEOUT desde o início do processo.', pool['timeouts']),
+        'sorteio_cache_pedidos_entradas': ('Pedidos no cache de consultas de status.', cache['entradas']),
+        'sorteio_cache_pedidos_acertos': ('Consultas de status atendidas pelo cache desde o início do processo.', cache['acertos']),
+        'sorteio_cache_pedidos_falhas': ('Consultas de status que foram ao banco desde o início do processo.', cache['falhas']),
+        'sorteio_sse_conexoes': ('Clientes conectados em /payment_status/eventos.', assinaturas_status.total()),
+        'sorteio_logs_fila': ('Registros de log aguardando escrita.', logs['fila']),
+        'sorteio_logs_descartados': ('Registros de log descartados com a fila cheia desde o início do processo.', logs['descartados']),
+        'sorteio_importacao_app_segundos': ('Duração da importação do app.py neste processo (ou no master, com --preload).', TEMPO_IMPORTACAO),
+    }
+
+registro_metricas.registrar_coletor(coletar_metricas_processo)
+
+@app.route('/reservas_stats')
+@exigir_admin
+def reservas_stats():
+    # Resultado das varreduras de reservas vencidas feitas por este processo
+    if not varredor_reservas:
+        return jsonify({'ativo': False})
+    return jsonify({'ativo': True, 'ultima_execucao': varredor_reservas.ultima_execucao, 'total': varredor_reservas.total})
+
+@app.route('/admin/vendas')
+@exigir_admin
+def admin_vendas():
+    # Painel: lê os agregados de VendasPorHora (ver relatorios.py), não a tabela de pedidos
+    rifa_id = request.args.get('rifa_id', RIFA_PADRAO, type=int)
+    horas = min(request.args.get('horas', 48, type=int), 24 * 90)
+    with transacao() as cur:
+        return jsonify(resumo_vendas(cur, rifa_id, horas))
+
+@app.route('/admin/exportar')
+@exigir_admin
+def admin_exportar():
+    # Exportação em streaming: um cursor do lado do servidor, entregue em pedaços (ver relatorios.py)
+    rifa_id = request.args.get('rifa_id', RIFA_PADRAO, type=int)
+    tipo = request.args.get('tipo', 'pedidos')
+    formato = request.args.get('formato', 'csv')
+    status = request.args.get('status') or None
+    if tipo not in EXPORTACOES or formato not in FORMATOS:
+        return jsonify({'success': False, 'message': f"Use tipo={'|'.join(EXPORTACOES)} e formato={'|'.join(FORMATOS)}."}), 400
+
+    def gerar():
+        with conexao() as conn:
+            try:
+                yield from exportar(conn, rifa_id, tipo, formato, status)
+            finally:
+                conn.rollback()
+
+    return Response(stream_with_context(gerar()), content_type=FORMATOS[formato], headers={
+        'Content-Disposition': f'attachment; filename="rifa-{rifa_id}-{tipo}.{formato}"',
+        'Cache-Control': 'no-store',
+    })
+
+
+TEMPO_IMPORTACAO = time.perf_counter() - INICIO_IMPORTACAO
+logging.info(f"🚀 App importado em {TEMPO_IMPORTACAO * 1000:.0f} ms (pid {os.getpid()}).")
 
 if __name__ == '__main__':
-    # ... (suas verificações e logs)
+    # Servidor de desenvolvimento: um processo só, que também cuida das tarefas em segundo plano
+    os.environ.setdefault('TAREFAS_EMBUTIDAS', 'true')
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
 
@@ -0,0 +1,127 @@
+"""Teste de carga do checkout (/create_preference) com compradores simultâneos.
+
+Mede quantos checkouts por segundo cada worker do gunicorn sustenta quando a API do
+Mercado Pago é lenta, para comparar o modo sync com o modo gevent (ver gunicorn.conf.py).
+
+Uso:
+    python benchmark/stub_mercadopago.py --porta 8081 --latencia 300 &
+    MP_API_BASE_URL=http://127.0.0.1:8081 MP_ACCESS_TOKEN=TEST-stub ADMISSAO_IP_POR_MINUTO=1000000 ADMISSAO_IP_RAJADA=1000000 \\
+        WEB_WORKER_CLASS=gevent WEB_CONCURRENCY=2 gunicorn -c gunicorn.conf.py app:app &
+    python benchmark/carga_checkout.py --url http://127.0.0.1:5000 --compradores 100 --pedidos 1000 --workers 2
+
+Repita com WEB_WORKER_CLASS=sync para comparar. Todos os compradores saem do mesmo IP, por isso
+o limite por IP do controle de admissão (admissao.py) é desligado acima; respostas 429 indicam
+o teto de checkouts simultâneos (ADMISSAO_CHECKOUTS_SIMULTANEOS). Cada pedido reserva números de verdade no
+banco apontado por POSTGRES_URL: use um banco de teste.
+"""
+import math
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentil(valores, p):
+    """Percentil `p` (0-100) de uma lista de valores, pelo método do vizinho mais próximo."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, math.ceil(p / 100.0 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def resumir(latencias):
+    """Resumo em milissegundos de uma lista de latências em segundos."""
+    return {
+        'n': len(latencias),
+        'p50_ms': percentil(latencias, 50) * 1000,
+        'p90_ms': percentil(latencias, 90) * 1000,
+        'p99_ms': percentil(latencias, 99) * 1000,
+        'max_ms': max(latencias) * 1000 if latencias else 0.0,
+    }
+
+
+def dados_comprador(indice, quantidade):
+    return {
+        'name': f"Comprador Carga {indice}",
+        'email': f"carga{indice}@example.com",
+        'cpf': f"{indice % 100000000000:011d}",
+        'phone': f"11{900000000 + indice % 100000000}",
+        'quantity': quantidade,
+    }
+
+
+def comprar(sessao, url, indice, quantidade, timeout=30.0):
+    """Faz um checkout. Retorna (latência em s, status HTTP ou nome da exceção, corpo JSON ou None)."""
+    inicio = time.perf_counter()
+    try:
+        resposta = sessao.post(f"{url}/create_preference", json=dados_comprador(indice, quantidade), timeout=timeout)
+        status = resposta.status_code
+        try:
+            corpo = resposta.json()
+        except ValueError:
+            corpo = None
+    except requests.RequestException as e:
+        status, corpo = type(e).__name__, None
+    return time.perf_counter() - inicio, status, corpo
+
+
+def executar_carga(url, compradores, pedidos, quantidade_max=5, semente=None):
+    """Dispara `pedidos` checkouts com `compradores` clientes simultâneos.
+
+    Retorna um dicionário com duração, vazão, latências e contagem por status.
+    """
+    rng = random.Random(semente)
+    quantidades = [rng.randint(1, quantidade_max) for _ in range(pedidos)]
+    local = threading.local()
+
+    def sessao():
+        if not hasattr(local, 'sessao'):
+            local.sessao = requests.Session()
+        return local.sessao
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=compradores) as executor:
+        resultados = list(executor.map(
+            lambda i: comprar(sessao(), url, i, quantidades[i]), range(pedidos)
+        ))
+    duracao = time.perf_counter() - inicio
+
+    status = Counter(r[1] for r in resultados)
+    latencias_ok = [r[0] for r in resultados if r[1] == 200]
+    return {
+        'duracao_s': duracao,
+        'checkouts_ok': len(latencias_ok),
+        'checkouts_por_s': len(latencias_ok) / duracao if duracao else 0.0,
+        'latencia': resumir(latencias_ok),
+        'status': dict(status),
+        'numeros_reservados': sum(q for q, r in zip(quantidades, resultados) if r[1] == 200),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga do /create_preference.")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--compradores', type=int, default=50, help="Clientes simultâneos")
+    parser.add_argument('--pedidos', type=int, default=500, help="Total de checkouts")
+    parser.add_argument('--quantidade-max', type=int, default=5, help="Números por pedido: sorteado de 1 a este valor")
+    parser.add_argument('--workers', type=int, default=1, help="Workers do gunicorn, para a vazão por worker")
+    parser.add_argument('--semente', default=None)
+    args = parser.parse_args(argv)
+
+    print(f"Disparando {args.pedidos} checkouts com {args.compradores} compradores simultâneos contra {args.url}...")
+    r = executar_carga(args.url, args.compradores, args.pedidos, args.quantidade_max, args.semente)
+    lat = r['latencia']
+    print(f"Duração: {r['duracao_s']:.1f}s | status: {r['status']}")
+    print(f"Checkouts/s: {r['checkouts_por_s']:.1f} total, {r['checkouts_por_s'] / max(args.workers, 1):.1f} por worker")
+    print(f"Latência (ms): p50={lat['p50_ms']:.0f} p90={lat['p90_ms']:.0f} p99={lat['p99_ms']:.0f} max={lat['max_ms']:.0f}")
+    print(f"Números reservados: {r['numeros_reservados']}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,380 @@
+"""Benchmark de ponta a ponta do sorteio, contra um PostgreSQL local e stubs dos serviços externos.
+
+Sobe os stubs do Mercado Pago, do SMTP e do Discord neste processo, inicia o app com o
+gunicorn (gunicorn.conf.py) apontando para eles e executa três fases:
+
+    1. checkout: compradores simultâneos com quantidades variadas em /create_preference
+    2. webhooks: cada pedido recebe um pagamento (aprovado ou rejeitado) e o Mercado Pago
+       "reenvia" a notificação várias vezes, enquanto outros clientes consultam
+       /payment_status dos mesmos pedidos
+    3. drenagem: espera o processamento dos webhooks e o envio das notificações
+
+Ao final imprime p50/p99 de cada rota, checkouts/s, tempo de espera por locks no banco
+(amostrado em pg_stat_activity) e o resultado das verificações de consistência (token
+atribuído a dois pedidos, pedido com tokens a mais ou a menos, contador divergente, ...).
+Sai com código 1 se alguma verificação falhar.
+
+Uso (o banco é APAGADO e recriado: use um banco só para isso):
+    createdb sorteio_benchmark
+    python benchmark/executar.py --postgres-url postgresql://localhost/sorteio_benchmark \\
+        --tokens 100000 --compradores 50 --pedidos 1000 --reenvios 3
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from carga_checkout import executar_carga, resumir  # noqa: E402
+from stub_mercadopago import criar_servidor as criar_stub_mercadopago  # noqa: E402
+from stub_notificacoes import criar_servidores as criar_stubs_notificacoes  # noqa: E402
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_em_thread(servidor):
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor.server_address[1]
+
+
+def preparar_banco(postgres_url, quantidade_tokens, formato):
+    """Cria as tabelas, apaga pedidos e tokens de execuções anteriores e carrega tokens novos."""
+    os.environ['POSTGRES_URL'] = postgres_url
+    import create_tables
+    from tokens import gerar_tokens_stream, carregar_tokens_no_banco
+    from reservas import recalcular_contador
+
+    create_tables.DATABASE_URL = postgres_url
+    create_tables.create_tables()
+    conn = psycopg2.connect(postgres_url)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE PedidoTokens, Adquiridos, Tokens, NotificacoesPendentes, WebhooksRecebidos RESTART IDENTITY CASCADE;")
+        conn.commit()
+        inicio = time.monotonic()
+        enviados, _ = carregar_tokens_no_banco(conn, gerar_tokens_stream(quantidade_tokens, formato))
+        with conn.cursor() as cur:
+            recalcular_contador(cur, 1)
+        conn.commit()
+        print(f"Banco preparado: {enviados} tokens carregados em {time.monotonic() - inicio:.1f}s.")
+    finally:
+        conn.close()
+
+
+def iniciar_app(ambiente, porta, log):
+    """Inicia o gunicorn com o ambiente dos stubs e espera até ele responder."""
+    processo = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        cwd=RAIZ, env=ambiente, stdout=log, stderr=subprocess.STDOUT
+    )
+    url = f"http://127.0.0.1:{porta}"
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f"O gunicorn terminou com código {processo.returncode}; veja {log.name}")
+        try:
+            requests.get(f"{url}/tokens_disponiveis", timeout=1)
+            return processo, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    processo.terminate()
+    raise RuntimeError(f"O app não respondeu em 30s; veja {log.name}")
+
+
+class AmostradorLocks(threading.Thread):
+    """Amostra, em intervalos fixos, quantas sessões do banco estão esperando por um lock."""
+
+    def __init__(self, postgres_url, intervalo=0.05):
+        super().__init__(daemon=True)
+        self.postgres_url = postgres_url
+        self.intervalo = intervalo
+        self.espera_total_s = 0.0
+        self.maximo_simultaneo = 0
+        self.amostras = 0
+        self._parar = threading.Event()
+
+    def run(self):
+        conn = psycopg2.connect(self.postgres_url)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                while not self._parar.wait(self.intervalo):
+                    cur.execute("""
+                        SELECT count(*) FROM pg_stat_activity
+                        WHERE datname = current_database() AND wait_event_type = 'Lock';
+                    """)
+                    esperando = cur.fetchone()[0]
+                    self.amostras += 1
+                    self.espera_total_s += esperando * self.intervalo
+                    self.maximo_simultaneo = max(self.maximo_simultaneo, esperando)
+        finally:
+            conn.close()
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+def disparar(requisicoes, concorrencia, fazer):
+    """Executa `fazer(item)` para cada item com `concorrencia` threads. Retorna [(latência, status)]."""
+    local = threading.local()
+
+    def executar(item):
+        if not hasattr(local, 'sessao'):
+            local.sessao = requests.Session()
+        inicio = time.perf_counter()
+        try:
+            status = fazer(local.sessao, item).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return time.perf_counter() - inicio, status
+
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        return list(executor.map(executar, requisicoes))
+
+
+def resumo_requisicoes(resultados, status_ok=(200,)):
+    status = {}
+    for _, s in resultados:
+        status[s] = status.get(s, 0) + 1
+    return {'latencia': resumir([lat for lat, s in resultados if s in status_ok]), 'status': status}
+
+
+def aguardar(postgres_url, consulta, timeout):
+    """Espera até `consulta` (um SELECT count) retornar 0. Retorna o tempo decorrido ou None se esgotar."""
+    inicio = time.monotonic()
+    conn = psycopg2.connect(postgres_url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            while time.monotonic() - inicio < timeout:
+                cur.execute(consulta)
+                if cur.fetchone()[0] == 0:
+                    return time.monotonic() - inicio
+                time.sleep(0.2)
+    finally:
+        conn.close()
+    return None
+
+
+VERIFICACOES = {
+    'tokens_em_mais_de_um_pedido': """
+        SELECT count(*) FROM (SELECT token_id FROM PedidoTokens GROUP BY token_id HAVING count(*) > 1) d;
+    """,
+    'tokens_vinculados_marcados_disponiveis': """
+        SELECT count(*) FROM PedidoTokens pt JOIN Tokens t ON t.id = pt.token_id WHERE t.disponivel;
+    """,
+    'tokens_indisponiveis_sem_pedido': """
+        SELECT count(*) FROM Tokens t
+        WHERE NOT t.disponivel AND NOT EXISTS (SELECT 1 FROM PedidoTokens pt WHERE pt.token_id = t.id);
+    """,
+    'pedidos_ativos_com_tokens_errados': """
+        SELECT count(*) FROM Adquiridos a
+        LEFT JOIN (SELECT adquirido_id, count(*) AS n FROM PedidoTokens GROUP BY adquirido_id) pt ON pt.adquirido_id = a.id
+        WHERE a.status_compra IN ('approved', 'pending') AND COALESCE(pt.n, 0) <> a.quantidade;
+    """,
+    'pedidos_encerrados_segurando_tokens': """
+        SELECT count(*) FROM Adquiridos a
+        WHERE a.status_compra IN ('rejected', 'expired')
+          AND EXISTS (SELECT 1 FROM PedidoTokens pt WHERE pt.adquirido_id = a.id);
+    """,
+    'divergencia_contador_disponiveis': """
+        SELECT abs((SELECT COALESCE(SUM(disponiveis), 0) FROM ContadorTokens)
+                   - (SELECT count(*) FROM Tokens WHERE disponivel));
+    """,
+}
+
+
+def verificar_consistencia(postgres_url):
+    """Executa as VERIFICACOES. Retorna {nome: quantidade de problemas}."""
+    conn = psycopg2.connect(postgres_url)
+    try:
+        with conn.cursor() as cur:
+            resultado = {}
+            for nome, consulta in VERIFICACOES.items():
+                cur.execute(consulta)
+                resultado[nome] = int(cur.fetchone()[0])
+            cur.execute("SELECT status_compra, count(*) FROM Adquiridos GROUP BY status_compra;")
+            pedidos = dict(cur.fetchall())
+        return resultado, pedidos
+    finally:
+        conn.close()
+
+
+def imprimir_latencia(nome, resumo):
+    lat = resumo['latencia']
+    print(f"  {nome:<22} n={lat['n']:<6} p50={lat['p50_ms']:7.1f}ms  p99={lat['p99_ms']:7.1f}ms  "
+          f"max={lat['max_ms']:7.1f}ms  status={resumo['status']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do sorteio com PostgreSQL local e stubs dos serviços externos.")
+    parser.add_argument('--postgres-url', default=os.getenv('BENCHMARK_POSTGRES_URL'),
+                        help="Banco descartável (padrão: BENCHMARK_POSTGRES_URL)")
+    parser.add_argument('--tokens', type=int, default=100000)
+    parser.add_argument('--formato', default='LL999', help="Formato dos tokens gerados (ver tokens.py)")
+    parser.add_argument('--compradores', type=int, default=50, help="Checkouts simultâneos")
+    parser.add_argument('--pedidos', type=int, default=1000)
+    parser.add_argument('--quantidade-max', type=int, default=10)
+    parser.add_argument('--aprovados', type=float, default=0.8, help="Fração dos pedidos com pagamento aprovado")
+    parser.add_argument('--reenvios', type=int, default=3, help="Entregas de cada notificação de pagamento")
+    parser.add_argument('--webhooks-concorrencia', type=int, default=30)
+    parser.add_argument('--consultas', type=int, default=2000, help="Consultas a /payment_status durante os webhooks")
+    parser.add_argument('--consultas-concorrencia', type=int, default=30)
+    parser.add_argument('--latencia-mp', type=float, default=100, help="ms por chamada ao stub do Mercado Pago")
+    parser.add_argument('--latencia-smtp', type=float, default=20)
+    parser.add_argument('--latencia-discord', type=float, default=50)
+    parser.add_argument('--workers', type=int, default=2, help="WEB_CONCURRENCY do gunicorn")
+    parser.add_argument('--worker-class', default='gevent', help="WEB_WORKER_CLASS do gunicorn")
+    parser.add_argument('--timeout-drenagem', type=float, default=120)
+    parser.add_argument('--semente', default='benchmark')
+    parser.add_argument('--json', help="Grava o relatório completo neste arquivo")
+    args = parser.parse_args(argv)
+
+    if not args.postgres_url:
+        parser.error("informe --postgres-url ou BENCHMARK_POSTGRES_URL")
+    rng = random.Random(args.semente)
+
+    preparar_banco(args.postgres_url, args.tokens, args.formato)
+
+    stub_mp, estado_mp = criar_stub_mercadopago(porta=0, latencia_ms=args.latencia_mp)
+    stub_smtp, stub_discord, estado_notificacoes = criar_stubs_notificacoes(
+        porta_smtp=0, porta_discord=0, latencia_smtp_ms=args.latencia_smtp, latencia_discord_ms=args.latencia_discord
+    )
+    porta_mp, porta_smtp, porta_discord = (iniciar_em_thread(s) for s in (stub_mp, stub_smtp, stub_discord))
+    porta_app = porta_livre()
+
+    ambiente = dict(os.environ)
+    ambiente.update({
+        'POSTGRES_URL': args.postgres_url,
+        'PORT': str(porta_app),
+        'APP_BASE_URL': f"http://127.0.0.1:{porta_app}",
+        'WEB_CONCURRENCY': str(args.workers),
+        'WEB_WORKER_CLASS': args.worker_class,
+        'TAREFAS_EMBUTIDAS': 'true',
+        'MP_ACCESS_TOKEN': 'TEST-benchmark',
+        'MP_API_BASE_URL': f"http://127.0.0.1:{porta_mp}",
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': str(porta_smtp),
+        'MAIL_USE_TLS': 'false',
+        'MAIL_USERNAME': 'benchmark',
+        'MAIL_PASSWORD': 'benchmark',
+        'MAIL_DEFAULT_SENDER': 'sorteio@example.com',
+        'DISCORD_WEBHOOK_URL': f"http://127.0.0.1:{porta_discord}/webhook",
+        # Todos os compradores simulados vêm do mesmo IP: o limite por IP não se aplica aqui
+        'ADMISSAO_IP_POR_MINUTO': '1000000',
+        'ADMISSAO_IP_RAJADA': '1000000',
+        'ADMISSAO_CHECKOUTS_SIMULTANEOS': os.getenv('ADMISSAO_CHECKOUTS_SIMULTANEOS', '50'),
+    })
+    log = tempfile.NamedTemporaryFile('w', prefix='benchmark-app-', suffix='.log', delete=False)
+    processo, url = iniciar_app(ambiente, porta_app, log)
+    print(f"App em {url} ({args.workers} workers {args.worker_class}); log em {log.name}")
+
+    amostrador = AmostradorLocks(args.postgres_url)
+    amostrador.start()
+    relatorio = {'parametros': vars(args)}
+    try:
+        # Fase 1: checkouts simultâneos
+        checkout = executar_carga(url, args.compradores, args.pedidos, args.quantidade_max, args.semente)
+        relatorio['checkout'] = checkout
+        with estado_mp.lock:
+            pedidos = [p['external_reference'] for p in estado_mp.preferencias.values()]
+        print(f"Fase 1: {checkout['checkouts_ok']} checkouts em {checkout['duracao_s']:.1f}s "
+              f"({checkout['checkouts_por_s']:.1f}/s)")
+
+        # Fase 2: tempestade de webhooks (com reenvios) e consultas de status ao mesmo tempo
+        pagamentos = [
+            estado_mp.registrar_pagamento(ref, 'approved' if rng.random() < args.aprovados else 'rejected')['id']
+            for ref in pedidos
+        ]
+        entregas = [pid for pid in pagamentos for _ in range(args.reenvios)]
+        rng.shuffle(entregas)
+        consultas = [rng.choice(pedidos) for _ in range(args.consultas)] if pedidos else []
+        resultado_consultas = []
+        fase_consultas = threading.Thread(target=lambda: resultado_consultas.extend(disparar(
+            consultas, args.consultas_concorrencia,
+            lambda s, ref: s.get(f"{url}/payment_status", params={'order_id': ref}, allow_redirects=False, timeout=30)
+        )))
+        fase_consultas.start()
+        inicio = time.monotonic()
+        resultado_webhooks = disparar(
+            entregas, args.webhooks_concorrencia,
+            lambda s, pid: s.post(f"{url}/mercadopago_webhook", params={'topic': 'payment', 'id': pid}, timeout=30)
+        )
+        relatorio['webhooks'] = resumo_requisicoes(resultado_webhooks)
+        relatorio['webhooks']['entregas_por_s'] = len(entregas) / max(time.monotonic() - inicio, 1e-9)
+
+        # Fase 3: drenagem das filas em segundo plano
+        relatorio['drenagem_webhooks_s'] = aguardar(
+            args.postgres_url, "SELECT count(*) FROM WebhooksRecebidos WHERE status = 'pendente';", args.timeout_drenagem
+        )
+        fase_consultas.join()
+        relatorio['payment_status'] = resumo_requisicoes(resultado_consultas, status_ok=(200, 302))
+        relatorio['drenagem_notificacoes_s'] = aguardar(
+            args.postgres_url, "SELECT count(*) FROM NotificacoesPendentes WHERE status = 'pendente';", args.timeout_drenagem
+        )
+    finally:
+        amostrador.parar()
+        processo.terminate()
+        processo.wait(timeout=30)
+        log.close()
+
+    relatorio['locks'] = {
+        'espera_total_s': amostrador.espera_total_s,
+        'maximo_simultaneo': amostrador.maximo_simultaneo,
+        'amostras': amostrador.amostras,
+    }
+    relatorio['stubs'] = {
+        'mercadopago': dict(estado_mp.chamadas),
+        'notificacoes': estado_notificacoes.estatisticas(),
+    }
+    relatorio['verificacoes'], relatorio['pedidos_por_status'] = verificar_consistencia(args.postgres_url)
+
+    print("\nLatência por rota:")
+    imprimir_latencia('/create_preference', checkout)
+    imprimir_latencia('/mercadopago_webhook', relatorio['webhooks'])
+    imprimir_latencia('/payment_status', relatorio['payment_status'])
+    print(f"\nCheckouts/s: {checkout['checkouts_por_s']:.1f} ({checkout['checkouts_por_s'] / args.workers:.1f} por worker)")
+    print(f"Entregas de webhook/s: {relatorio['webhooks']['entregas_por_s']:.1f}")
+    for nome in ('drenagem_webhooks_s', 'drenagem_notificacoes_s'):
+        valor = relatorio[nome]
+        print(f"{nome}: {'ESGOTOU O TEMPO' if valor is None else f'{valor:.1f}s'}")
+    print(f"Espera por locks no banco: {amostrador.espera_total_s:.2f}s de sessão "
+          f"(máx. {amostrador.maximo_simultaneo} sessões esperando ao mesmo tempo)")
+    print(f"Chamadas ao stub do Mercado Pago: {relatorio['stubs']['mercadopago']}")
+    print(f"Notificações entregues: {relatorio['stubs']['notificacoes']}")
+    print(f"Pedidos por status: {relatorio['pedidos_por_status']}")
+
+    print("\nVerificações de consistência:")
+    falhas = 0
+    for nome, problemas in relatorio['verificacoes'].items():
+        print(f"  {'OK   ' if problemas == 0 else 'FALHA'} {nome}: {problemas}")
+        falhas += problemas != 0
+    if relatorio['drenagem_webhooks_s'] is None or relatorio['drenagem_notificacoes_s'] is None:
+        falhas += 1
+
+    if args.json:
+        with open(args.json, 'w') as arquivo:
+            json.dump(relatorio, arquivo, indent=2, default=str)
+        print(f"\nRelatório gravado em {args.json}")
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,149 @@
+"""Benchmark da inicialização do app: importação, boot do gunicorn e primeiras requisições.
+
+Mede, em processos novos:
+
+    1. importação: tempo de `import app` (TEMPO_IMPORTACAO, ver app.py) em --repeticoes
+       interpretadores e os módulos mais caros segundo `python -X importtime`
+    2. boot: para cada combinação de --preload e aquecimento (WEB_PRELOAD/WEB_AQUECER, ver
+       gunicorn.conf.py), sobe o gunicorn com um worker e mede o tempo até a primeira
+       resposta e a latência da primeira requisição a / e a /tokens_disponiveis, comparada
+       com a mediana das seguintes
+
+A importação roda com o ambiente atual (sem variáveis de e-mail, por exemplo, o app deve
+subir avisando, sem erro). O boot precisa de um banco: as migrações pendentes são aplicadas,
+mas nenhum dado é apagado.
+
+Uso:
+    python benchmark/inicializacao.py --repeticoes 5
+    python benchmark/inicializacao.py --postgres-url postgresql://localhost/sorteio_benchmark --json inicio.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from carga_checkout import resumir  # noqa: E402
+from executar import porta_livre  # noqa: E402
+
+SCRIPT_IMPORTACAO = "import app, json; print(json.dumps({'importacao_s': app.TEMPO_IMPORTACAO}))"
+
+
+def medir_importacao(repeticoes, ambiente):
+    """Tempo de `import app` e do processo inteiro, em interpretadores novos."""
+    importacao, processo = [], []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        saida = subprocess.run([sys.executable, '-c', SCRIPT_IMPORTACAO], cwd=RAIZ, env=ambiente,
+                               capture_output=True, text=True, check=True).stdout
+        processo.append(time.perf_counter() - inicio)
+        importacao.append(json.loads(saida.strip().splitlines()[-1])['importacao_s'])
+    return {'importacao': resumir(importacao), 'processo': resumir(processo)}
+
+
+def modulos_mais_caros(ambiente, quantidade=15):
+    """Módulos de maior tempo acumulado de importação (python -X importtime), em ms."""
+    resultado = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=RAIZ, env=ambiente,
+                               capture_output=True, text=True, check=True)
+    modulos = []
+    for linha in resultado.stderr.splitlines():
+        encontrado = re.match(r'import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(.+)$', linha)
+        if encontrado:
+            modulos.append((int(encontrado.group(1)) / 1000, encontrado.group(2).strip()))
+    return [{'modulo': nome, 'acumulado_ms': ms} for ms, nome in sorted(modulos, reverse=True)[:quantidade]]
+
+
+def medir_boot(ambiente, preload, aquecer, requisicoes, log):
+    """Sobe o gunicorn com um worker e mede a primeira resposta e as primeiras requisições."""
+    porta = porta_livre()
+    ambiente = dict(ambiente, PORT=str(porta), WEB_CONCURRENCY='1', TAREFAS_EMBUTIDAS='false', ADMIN_TOKEN='benchmark',
+                    WEB_PRELOAD=str(preload).lower(), WEB_AQUECER=str(aquecer).lower())
+    url = f"http://127.0.0.1:{porta}"
+    inicio = time.perf_counter()
+    processo = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                                cwd=RAIZ, env=ambiente, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        primeira_resposta = None
+        while time.perf_counter() - inicio < 60:
+            if processo.poll() is not None:
+                raise RuntimeError(f"O gunicorn terminou com código {processo.returncode}; veja {log.name}")
+            try:
+                # /db_pool_stats não usa o banco nem templates: mede só o boot
+                requests.get(f"{url}/db_pool_stats", headers={'Authorization': 'Bearer benchmark'}, timeout=1)
+                primeira_resposta = time.perf_counter() - inicio
+                break
+            except requests.RequestException:
+                time.sleep(0.02)
+        if primeira_resposta is None:
+            raise RuntimeError(f"O app não respondeu em 60s; veja {log.name}")
+
+        rotas = {}
+        with requests.Session() as sessao:
+            for rota in ('/', '/tokens_disponiveis'):
+                latencias = []
+                for _ in range(requisicoes + 1):
+                    t = time.perf_counter()
+                    sessao.get(f"{url}{rota}", timeout=30).raise_for_status()
+                    latencias.append(time.perf_counter() - t)
+                rotas[rota] = {'primeira_ms': latencias[0] * 1000, 'seguintes': resumir(latencias[1:])}
+        return {'preload': preload, 'aquecer': aquecer, 'primeira_resposta_ms': primeira_resposta * 1000, 'rotas': rotas}
+    finally:
+        processo.terminate()
+        processo.wait(10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark da inicialização do app.")
+    parser.add_argument('--postgres-url', default=os.getenv('BENCHMARK_POSTGRES_URL'),
+                        help="Banco para as medições de boot (sem ele, só a importação é medida)")
+    parser.add_argument('--repeticoes', type=int, default=5, help="Interpretadores novos na medição da importação")
+    parser.add_argument('--requisicoes', type=int, default=20, help="Requisições depois da primeira, por rota")
+    parser.add_argument('--worker-class', default='gevent', help="WEB_WORKER_CLASS do gunicorn")
+    parser.add_argument('--json', help="Grava o relatório completo neste arquivo")
+    args = parser.parse_args(argv)
+
+    ambiente = dict(os.environ, WEB_WORKER_CLASS=args.worker_class)
+    relatorio = {
+        'importacao': medir_importacao(args.repeticoes, ambiente),
+        'modulos_mais_caros': modulos_mais_caros(ambiente),
+        'boot': [],
+    }
+    imp = relatorio['importacao']
+    print(f"import app: p50 {imp['importacao']['p50_ms']:.0f} ms, máx {imp['importacao']['max_ms']:.0f} ms "
+          f"(processo inteiro: p50 {imp['processo']['p50_ms']:.0f} ms)")
+    for modulo in relatorio['modulos_mais_caros']:
+        print(f"    {modulo['acumulado_ms']:>8.1f} ms  {modulo['modulo']}")
+
+    if args.postgres_url:
+        import create_tables
+        create_tables.DATABASE_URL = args.postgres_url
+        create_tables.create_tables()
+        ambiente['POSTGRES_URL'] = args.postgres_url
+        with tempfile.NamedTemporaryFile('w', prefix='gunicorn-inicializacao-', suffix='.log', delete=False) as log:
+            for preload in (False, True):
+                for aquecer in (False, True):
+                    boot = medir_boot(ambiente, preload, aquecer, args.requisicoes, log)
+                    relatorio['boot'].append(boot)
+                    rotas = ', '.join(
+                        f"{rota} primeira {dados['primeira_ms']:.0f} ms / p50 {dados['seguintes']['p50_ms']:.1f} ms"
+                        for rota, dados in boot['rotas'].items()
+                    )
+                    print(f"preload={str(preload).lower():<5} aquecer={str(aquecer).lower():<5} "
+                          f"primeira resposta {boot['primeira_resposta_ms']:.0f} ms; {rotas}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
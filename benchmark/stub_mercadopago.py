@@ -0,0 +1,156 @@
+"""Servidor local que imita a API do Mercado Pago, para testes e medições sem a API real.
+
+Uso:
+    python benchmark/stub_mercadopago.py --porta 8081 --latencia 80
+    MP_API_BASE_URL=http://127.0.0.1:8081 MP_ACCESS_TOKEN=TEST-stub gunicorn app:app
+
+Rotas imitadas:
+    POST /checkout/preferences      -> cria uma preferência (id e init_point)
+    GET  /v1/payments/<id>          -> consulta um pagamento registrado
+    GET  /v1/payments/search        -> busca paginada (external_reference, begin_date/end_date, offset, limit)
+Rotas de controle do stub:
+    POST /stub/payments             -> registra um pagamento {"external_reference", "status"}
+    GET  /stub/stats                -> contagem de chamadas por rota
+"""
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime, timezone
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class EstadoStub:
+    def __init__(self, latencia_ms=0):
+        self.latencia = latencia_ms / 1000.0
+        self.lock = threading.Lock()
+        self.pagamentos = {}
+        self.preferencias = {}
+        self.chamadas = Counter()
+        self.proximo_pagamento = 1000000
+        self.criacao = {}  # id do pagamento -> datetime de criação, para a busca por período
+
+    def registrar_pagamento(self, external_reference, status, valor=None):
+        with self.lock:
+            self.proximo_pagamento += 1
+            agora = datetime.now(timezone.utc)
+            pagamento = {
+                "id": self.proximo_pagamento,
+                "status": status,
+                "external_reference": external_reference,
+                "transaction_amount": valor,
+                "date_created": agora.isoformat(timespec="milliseconds"),
+                "date_last_updated": agora.isoformat(timespec="milliseconds"),
+            }
+            self.pagamentos[pagamento["id"]] = pagamento
+            self.criacao[pagamento["id"]] = agora
+            return pagamento
+
+
+def criar_handler(estado):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Mantém conexões keep-alive, como a API real
+
+        def log_message(self, *args):
+            pass
+
+        def _ler_json(self):
+            tamanho = int(self.headers.get("Content-Length") or 0)
+            corpo = self.rfile.read(tamanho) if tamanho else b""
+            return json.loads(corpo) if corpo else {}
+
+        def _responder(self, status, dados):
+            corpo = json.dumps(dados).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def _contar(self, rota):
+            with estado.lock:
+                estado.chamadas[rota] += 1
+            if estado.latencia and not rota.startswith("stub"):
+                time.sleep(estado.latencia)
+
+        def do_POST(self):
+            dados = self._ler_json()
+            if self.path.startswith("/checkout/preferences"):
+                self._contar("preference.create")
+                id_preferencia = f"stub-{uuid.uuid4().hex[:16]}"
+                with estado.lock:
+                    estado.preferencias[id_preferencia] = dados
+                host = self.headers.get("Host", "127.0.0.1")
+                return self._responder(201, {
+                    "id": id_preferencia,
+                    "init_point": f"http://{host}/checkout/{id_preferencia}",
+                    "external_reference": dados.get("external_reference"),
+                })
+            if self.path.startswith("/stub/payments"):
+                self._contar("stub.payments")
+                pagamento = estado.registrar_pagamento(
+                    dados.get("external_reference"), dados.get("status", "approved"), dados.get("transaction_amount")
+                )
+                return self._responder(201, pagamento)
+            self._responder(404, {"message": "not_found"})
+
+        def _buscar(self):
+            filtros = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+            inicio = datetime.fromisoformat(filtros["begin_date"]) if "begin_date" in filtros else None
+            fim = datetime.fromisoformat(filtros["end_date"]) if "end_date" in filtros else None
+            offset = int(filtros.get("offset", 0))
+            limit = min(int(filtros.get("limit", 30)), 1000)
+            with estado.lock:
+                encontrados = [
+                    p for p in estado.pagamentos.values()
+                    if ("external_reference" not in filtros or p["external_reference"] == filtros["external_reference"])
+                    and (inicio is None or estado.criacao[p["id"]] >= inicio)
+                    and (fim is None or estado.criacao[p["id"]] <= fim)
+                ]
+            encontrados.sort(key=lambda p: p["id"])
+            return {
+                "paging": {"total": len(encontrados), "limit": limit, "offset": offset},
+                "results": encontrados[offset:offset + limit],
+            }
+
+        def do_GET(self):
+            if self.path.startswith("/v1/payments/search"):
+                self._contar("payment.search")
+                return self._responder(200, self._buscar())
+            achado = re.match(r"^/v1/payments/(\d+)", self.path)
+            if achado:
+                self._contar("payment.get")
+                with estado.lock:
+                    pagamento = estado.pagamentos.get(int(achado.group(1)))
+                if not pagamento:
+                    return self._responder(404, {"message": "Payment not found", "status": 404})
+                return self._responder(200, pagamento)
+            if self.path.startswith("/stub/stats"):
+                with estado.lock:
+                    return self._responder(200, dict(estado.chamadas))
+            self._responder(404, {"message": "not_found"})
+
+    return Handler
+
+
+def criar_servidor(host="127.0.0.1", porta=8081, latencia_ms=0):
+    """Cria (sem iniciar) o servidor stub. Retorna (servidor, estado)."""
+    estado = EstadoStub(latencia_ms)
+    servidor = ThreadingHTTPServer((host, porta), criar_handler(estado))
+    servidor.daemon_threads = True
+    return servidor, estado
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stub local da API do Mercado Pago.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8081)
+    parser.add_argument("--latencia", type=float, default=0, help="Latência artificial por chamada, em ms")
+    args = parser.parse_args()
+    servidor, _ = criar_servidor(args.host, args.porta, args.latencia)
+    print(f"Stub do Mercado Pago em http://{args.host}:{args.porta} (latência {args.latencia} ms)")
+    servidor.serve_forever()
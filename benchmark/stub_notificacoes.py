@@ -0,0 +1,143 @@
+"""Servidores locais que imitam o SMTP e o webhook do Discord, para testes e medições.
+
+Uso:
+    python benchmark/stub_notificacoes.py --porta-smtp 2525 --porta-discord 8082
+    MAIL_SERVER=127.0.0.1 MAIL_PORT=2525 MAIL_USE_TLS=false \\
+        DISCORD_WEBHOOK_URL=http://127.0.0.1:8082/webhook gunicorn app:app
+
+O SMTP aceita qualquer login (AUTH PLAIN) e descarta as mensagens, só contando-as; o
+Discord responde 204 a qualquer POST. Ambos aceitam uma latência artificial por operação.
+"""
+import json
+import time
+import argparse
+import threading
+import socketserver
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class EstadoNotificacoes:
+    def __init__(self, latencia_smtp_ms=0, latencia_discord_ms=0):
+        self.latencia_smtp = latencia_smtp_ms / 1000.0
+        self.latencia_discord = latencia_discord_ms / 1000.0
+        self.lock = threading.Lock()
+        self.contagem = Counter()
+        self.destinatarios = Counter()
+
+    def contar(self, chave, n=1):
+        with self.lock:
+            self.contagem[chave] += n
+
+    def estatisticas(self):
+        with self.lock:
+            return dict(self.contagem)
+
+
+def criar_handler_smtp(estado):
+    class HandlerSMTP(socketserver.StreamRequestHandler):
+        def _responder(self, linha):
+            self.wfile.write(linha.encode() + b"\r\n")
+            self.wfile.flush()
+
+        def handle(self):
+            estado.contar('smtp.conexoes')
+            self._responder("220 stub-smtp ESMTP")
+            destinatarios = []
+            while True:
+                linha = self.rfile.readline()
+                if not linha:
+                    return
+                comando = linha.decode(errors='replace').strip()
+                verbo = comando.split(' ', 1)[0].upper()
+                if verbo == 'EHLO':
+                    self._responder("250-stub-smtp")
+                    self._responder("250-AUTH PLAIN")
+                    self._responder("250 8BITMIME")
+                elif verbo == 'AUTH':
+                    self._responder("235 2.7.0 Authentication successful")
+                elif verbo == 'RCPT':
+                    destinatarios.append(comando.split(':', 1)[-1].strip(' <>'))
+                    self._responder("250 OK")
+                elif verbo == 'DATA':
+                    self._responder("354 End data with <CR><LF>.<CR><LF>")
+                    while self.rfile.readline().rstrip(b"\r\n") != b".":
+                        pass
+                    if estado.latencia_smtp:
+                        time.sleep(estado.latencia_smtp)
+                    estado.contar('smtp.mensagens')
+                    with estado.lock:
+                        estado.destinatarios.update(destinatarios)
+                    destinatarios = []
+                    self._responder("250 OK: queued")
+                elif verbo == 'NOOP':
+                    estado.contar('smtp.noop')
+                    self._responder("250 OK")
+                elif verbo == 'RSET':
+                    destinatarios = []
+                    self._responder("250 OK")
+                elif verbo == 'QUIT':
+                    self._responder("221 Bye")
+                    return
+                elif verbo in ('HELO', 'MAIL'):
+                    self._responder("250 OK")
+                else:
+                    self._responder("502 Command not implemented")
+
+    return HandlerSMTP
+
+
+def criar_handler_discord(estado):
+    class HandlerDiscord(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            tamanho = int(self.headers.get("Content-Length") or 0)
+            corpo = self.rfile.read(tamanho) if tamanho else b""
+            try:
+                json.loads(corpo or b"{}")
+            except ValueError:
+                self.send_response(400)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if estado.latencia_discord:
+                time.sleep(estado.latencia_discord)
+            estado.contar('discord.mensagens')
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    return HandlerDiscord
+
+
+class _ServidorSMTP(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def criar_servidores(host="127.0.0.1", porta_smtp=2525, porta_discord=8082, latencia_smtp_ms=0, latencia_discord_ms=0):
+    """Cria (sem iniciar) os servidores stub. Retorna (servidor_smtp, servidor_discord, estado)."""
+    estado = EstadoNotificacoes(latencia_smtp_ms, latencia_discord_ms)
+    servidor_smtp = _ServidorSMTP((host, porta_smtp), criar_handler_smtp(estado))
+    servidor_discord = ThreadingHTTPServer((host, porta_discord), criar_handler_discord(estado))
+    servidor_discord.daemon_threads = True
+    return servidor_smtp, servidor_discord, estado
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stubs locais de SMTP e do webhook do Discord.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta-smtp", type=int, default=2525)
+    parser.add_argument("--porta-discord", type=int, default=8082)
+    parser.add_argument("--latencia-smtp", type=float, default=0, help="Latência artificial por mensagem, em ms")
+    parser.add_argument("--latencia-discord", type=float, default=0, help="Latência artificial por POST, em ms")
+    args = parser.parse_args()
+    smtp, discord, _ = criar_servidores(args.host, args.porta_smtp, args.porta_discord,
+                                        args.latencia_smtp, args.latencia_discord)
+    threading.Thread(target=smtp.serve_forever, daemon=True).start()
+    print(f"Stub SMTP em {args.host}:{args.porta_smtp}, stub Discord em http://{args.host}:{args.porta_discord}/webhook")
+    discord.serve_forever()
@@ -0,0 +1,82 @@
+import time
+import threading
+from collections import OrderedDict
+
+from eventos_pedidos import ouvinte_status
+
+# Cache em memória (LRU + TTL) das consultas de /payment_status e /success.
+#
+# Guarda só o que essas páginas usam: status, nome do cliente e, para pedidos aprovados, os
+# números. Estados finais (aprovado/rejeitado/expirado/estornado) ficam em cache sem prazo enquanto a
+# escuta de mudanças de status (eventos_pedidos.py) estiver ativa, porque qualquer mudança
+# posterior chega como aviso e invalida a entrada em todos os processos. Pedidos pendentes,
+# e tudo quando a escuta está fora do ar, expiram após PEDIDOS_CACHE_TTL segundos.
+
+STATUS_FINAIS = ('approved', 'rejected', 'expired', 'refund_pending', 'refunded')
+
+PEDIDOS_CACHE_TTL = 5.0
+PEDIDOS_CACHE_MAX = 10000
+
+
+class CachePedidos:
+    def __init__(self, ttl=PEDIDOS_CACHE_TTL, maximo=PEDIDOS_CACHE_MAX, ouvinte=ouvinte_status):
+        self.ttl = ttl
+        self.maximo = maximo
+        self.ouvinte = ouvinte
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self._geracao = 0  # Incrementada a cada invalidação, para descartar cargas que a atravessaram
+        self.acertos = 0
+        self.falhas = 0
+        ouvinte.assinar(self._ao_mudar_status)
+
+    def _ao_mudar_status(self, order_id, status):
+        if order_id is None:
+            self.limpar()  # Escuta reiniciada: avisos podem ter se perdido
+        else:
+            self.invalidar(order_id)
+
+    def obter(self, order_id, carregar):
+        """Retorna os dados do pedido, chamando `carregar(order_id)` quando não estão em cache."""
+        self.ouvinte.garantir_iniciado()
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(order_id)
+            if entrada is not None and (entrada[1] is None or agora < entrada[1]):
+                self._entradas.move_to_end(order_id)
+                self.acertos += 1
+                return entrada[0]
+            geracao = self._geracao
+        self.falhas += 1
+        dados = carregar(order_id)
+        if dados is None:
+            return None  # Pedido inexistente não vai para o cache
+        sem_prazo = dados.get('status_compra') in STATUS_FINAIS and self.ouvinte.ativo
+        with self._lock:
+            if geracao != self._geracao:
+                # Chegou um aviso durante a carga: o dado pode já estar velho, guarda só com prazo
+                sem_prazo = False
+            self._entradas[order_id] = (dados, None if sem_prazo else time.monotonic() + self.ttl)
+            self._entradas.move_to_end(order_id)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+        return dados
+
+    def invalidar(self, order_id):
+        with self._lock:
+            self._geracao += 1
+            self._entradas.pop(order_id, None)
+
+    def limpar(self):
+        with self._lock:
+            self._geracao += 1
+            self._entradas.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            tamanho = len(self._entradas)
+        return {'entradas': tamanho, 'acertos': self.acertos, 'falhas': self.falhas,
+                'escuta_ativa': self.ouvinte.ativo}
+
+
+cache_pedidos = CachePedidos()
@@ -0,0 +1,196 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+
+from metricas import observar_etapa
+
+# Pool de conexões PostgreSQL por processo (um por worker do gunicorn).
+# As variáveis de ambiente são lidas na primeira utilização, depois do load_dotenv() do app.
+
+# Conexões ociosas há mais tempo que isso passam por um "SELECT 1" antes de serem entregues
+DB_POOL_HEALTHCHECK_IDLE = 30.0
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_vagas = None
+_ultimo_uso = {}
+_stats = {
+    'checkouts': 0,
+    'devolvidas': 0,
+    'descartadas': 0,
+    'healthchecks': 0,
+    'falhas_healthcheck': 0,
+    'timeouts': 0,
+    'espera_total_s': 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def _incrementar(chave, valor=1):
+    with _stats_lock:
+        _stats[chave] += valor
+
+
+def _config_pool():
+    database_url = os.getenv('POSTGRES_URL')
+    minconn = int(os.getenv('DB_POOL_MIN', '1'))
+    maxconn = int(os.getenv('DB_POOL_MAX', '10'))
+    timeout = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+    return database_url, minconn, max(minconn, maxconn), timeout
+
+
+def _obter_pool():
+    """Retorna o pool do processo atual, criando-o na primeira chamada (ou após um fork)."""
+    global _pool, _pool_pid, _vagas
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            database_url, minconn, maxconn, _ = _config_pool()
+            if not database_url:
+                raise RuntimeError("POSTGRES_URL não configurada.")
+            # Conexões herdadas do processo pai não podem ser reutilizadas após o fork
+            _ultimo_uso.clear()
+            _pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, database_url)
+            _vagas = threading.BoundedSemaphore(maxconn)
+            _pool_pid = pid
+            logging.info(f"🗄️ Pool de conexões criado (pid {pid}, min={minconn}, max={maxconn}).")
+    return _pool
+
+
+def _conexao_saudavel(conn):
+    if conn.closed:
+        return False
+    ultimo = _ultimo_uso.get(id(conn))
+    if ultimo is None or time.monotonic() - ultimo < DB_POOL_HEALTHCHECK_IDLE:
+        # Conexão recém-aberta ou usada há pouco: dispensa o round trip
+        return True
+    _incrementar('healthchecks')
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        _incrementar('falhas_healthcheck')
+        return False
+
+
+def obter_conexao():
+    """Retira uma conexão do pool, aguardando uma vaga livre por até DB_POOL_TIMEOUT segundos."""
+    pool = _obter_pool()
+    _, _, maxconn, timeout = _config_pool()
+    inicio = time.monotonic()
+    if not _vagas.acquire(timeout=timeout):
+        _incrementar('timeouts')
+        raise psycopg2.pool.PoolError("Tempo esgotado aguardando conexão livre no pool.")
+    try:
+        # A substituta pode ser outra conexão ociosa igualmente quebrada (ex.: depois de um
+        # restart do banco): no pior caso todas as ociosas são descartadas e a última
+        # tentativa abre uma conexão nova
+        for tentativa in range(maxconn + 1):
+            conn = pool.getconn()
+            if _conexao_saudavel(conn):
+                break
+            _ultimo_uso.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            _incrementar('descartadas')
+            logging.warning(f"⚠️ Conexão do pool inválida descartada (tentativa {tentativa + 1}); abrindo outra conexão.")
+        else:
+            raise psycopg2.OperationalError("Nenhuma conexão saudável com o banco de dados.")
+    except Exception as e:
+        _vagas.release()
+        logging.error(f"❌ Erro ao conectar ao banco de dados: {e}")
+        raise
+    _incrementar('checkouts')
+    espera = time.monotonic() - inicio
+    _incrementar('espera_total_s', espera)
+    observar_etapa('db_conexao', espera)
+    return conn
+
+
+def devolver_conexao(conn):
+    """Devolve a conexão ao pool, descartando-a se estiver quebrada ou com transação aberta."""
+    pool = _obter_pool()
+    descartar = conn.closed != 0
+    if not descartar:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            descartar = True
+    if descartar:
+        _ultimo_uso.pop(id(conn), None)
+        _incrementar('descartadas')
+    else:
+        _ultimo_uso[id(conn)] = time.monotonic()
+    try:
+        pool.putconn(conn, close=descartar)
+    finally:
+        _vagas.release()
+        _incrementar('devolvidas')
+
+
+@contextmanager
+def conexao():
+    """Empresta uma conexão do pool; o chamador controla commit/rollback."""
+    conn = obter_conexao()
+    try:
+        yield conn
+    finally:
+        devolver_conexao(conn)
+
+
+@contextmanager
+def transacao(cursor_factory=psycopg2.extras.DictCursor):
+    """Abre um cursor dentro de uma transação: commit ao sair, rollback em caso de exceção."""
+    with conexao() as conn:
+        cur = conn.cursor(cursor_factory=cursor_factory)
+        try:
+            yield cur
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+def ativar_espera_cooperativa():
+    """Faz o psycopg2 esperar pelo banco via select(), cedendo a vez a outras greenlets.
+
+    Usado nos workers gevent (ver gunicorn.conf.py): com o select() do gevent, uma consulta
+    lenta bloqueia só a requisição que a fez, não o processo inteiro. Não suporta COPY, que
+    só é usado pelos scripts de carga de tokens, fora do servidor web.
+    """
+    psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
+    logging.info(f"🟢 Espera cooperativa do psycopg2 ativada (pid {os.getpid()}).")
+
+
+def estatisticas_pool():
+    """Retorna um dicionário com o estado do pool deste processo, para monitoramento."""
+    database_url, minconn, maxconn, timeout = _config_pool()
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['pid'] = os.getpid()
+    stats['min'] = minconn
+    stats['max'] = maxconn
+    stats['timeout_s'] = timeout
+    if _pool is not None and _pool_pid == os.getpid():
+        stats['em_uso'] = len(_pool._used)
+        stats['ociosas'] = len(_pool._pool)
+    else:
+        stats['em_uso'] = 0
+        stats['ociosas'] = 0
+    stats['espera_media_ms'] = (stats['espera_total_s'] / stats['checkouts'] * 1000) if stats['checkouts'] else 0.0
+    return stats
@@ -0,0 +1,130 @@
+import os
+import time
+import gzip
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+
+from flask import Response, current_app, render_template, request, abort
+
+try:
+    import brotli  # Opcional: sem ele, só a variante gzip é gerada
+except ImportError:
+    brotli = None
+
+# Arquivos estáticos e páginas sem dados do pedido servidos da memória.
+#
+# Os arquivos de static/ são lidos uma vez por processo, com o hash do conteúdo e variantes
+# já comprimidas (brotli, se instalado, e gzip) para os tipos de texto. url_for('static', ...)
+# acrescenta ?v=<hash> à URL: quando a versão pedida é a atual a resposta vale por um ano
+# (immutable); um deploy que muda o arquivo muda a URL. Páginas como a inicial são
+# renderizadas uma vez e servidas com ETag, respondendo 304 a quem já tem a versão atual.
+
+TIPOS_COMPRIMIVEIS = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable'
+CACHE_REVALIDAR = 'public, max-age=60'
+CACHE_SEMPRE_REVALIDAR = 'no-cache'
+TAMANHO_MAX_MEMORIA = 5 * 1024 * 1024
+INICIADO_EM = time.time()  # Last-Modified das páginas renderizadas: o deploy é o que as muda
+
+
+class Recurso:
+    def __init__(self, corpo, tipo, modificado_em):
+        self.versao = hashlib.sha256(corpo).hexdigest()[:16]
+        self.tipo = tipo
+        self.modificado_em = modificado_em
+        self.variantes = {None: corpo}
+        if tipo.startswith(TIPOS_COMPRIMIVEIS) and len(corpo) > 256:
+            comprimido = gzip.compress(corpo, compresslevel=9, mtime=0)
+            if len(comprimido) < len(corpo):
+                self.variantes['gzip'] = comprimido
+            if brotli is not None:
+                comprimido = brotli.compress(corpo, quality=11)
+                if len(comprimido) < len(corpo):
+                    self.variantes['br'] = comprimido
+
+    def resposta(self, cache_control):
+        """Resposta com a melhor variante aceita pelo cliente, já condicional (ETag/Last-Modified)."""
+        codificacao = None
+        for candidata in ('br', 'gzip'):
+            if candidata in self.variantes and request.accept_encodings[candidata]:
+                codificacao = candidata
+                break
+        response = Response(self.variantes[codificacao], content_type=self.tipo)
+        if codificacao:
+            response.headers['Content-Encoding'] = codificacao
+        if len(self.variantes) > 1:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(f"{self.versao}-{codificacao}" if codificacao else self.versao)
+        response.headers['Last-Modified'] = formatdate(self.modificado_em, usegmt=True)
+        response.headers['Cache-Control'] = cache_control
+        return response.make_conditional(request)
+
+
+class AtivosEstaticos:
+    """Serve a pasta static/ da memória, com URLs versionadas pelo conteúdo."""
+
+    def __init__(self, pasta):
+        self.pasta = os.path.abspath(pasta)
+        self._recursos = None
+        self._lock = threading.Lock()
+
+    def _carregar(self):
+        recursos = {}
+        for raiz, _, arquivos in os.walk(self.pasta):
+            for arquivo in arquivos:
+                caminho = os.path.join(raiz, arquivo)
+                if os.path.getsize(caminho) > TAMANHO_MAX_MEMORIA:
+                    continue
+                with open(caminho, 'rb') as f:
+                    corpo = f.read()
+                tipo = mimetypes.guess_type(arquivo)[0] or 'application/octet-stream'
+                if tipo.startswith('text/') or tipo == 'application/javascript':
+                    tipo += '; charset=utf-8'
+                nome = os.path.relpath(caminho, self.pasta).replace(os.sep, '/')
+                recursos[nome] = Recurso(corpo, tipo, os.path.getmtime(caminho))
+        return recursos
+
+    def recursos(self):
+        if self._recursos is None or current_app.debug:
+            with self._lock:
+                if self._recursos is None or current_app.debug:
+                    self._recursos = self._carregar()
+        return self._recursos
+
+    def versao(self, filename):
+        recurso = self.recursos().get(filename)
+        return recurso.versao if recurso else None
+
+    def servir(self, filename):
+        recurso = self.recursos().get(filename)
+        if recurso is None:
+            abort(404)
+        versao = request.args.get('v')
+        return recurso.resposta(CACHE_IMUTAVEL if versao == recurso.versao else CACHE_REVALIDAR)
+
+
+class PaginasEmCache:
+    """Páginas renderizadas uma vez por processo e por contexto (LRU de até `maximo` entradas)."""
+
+    def __init__(self, maximo=64):
+        self.maximo = maximo
+        self._paginas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def servir(self, template, cache_control=CACHE_REVALIDAR, **contexto):
+        chave = (template, tuple(sorted(contexto.items())))
+        with self._lock:
+            recurso = self._paginas.get(chave)
+            if recurso is not None:
+                self._paginas.move_to_end(chave)
+        if recurso is None or current_app.debug:
+            html = render_template(template, **contexto).encode('utf-8')
+            recurso = Recurso(html, 'text/html; charset=utf-8', INICIADO_EM)
+            with self._lock:
+                self._paginas[chave] = recurso
+                while len(self._paginas) > self.maximo:
+                    self._paginas.popitem(last=False)
+        return recurso.resposta(cache_control)
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import queue
+import select
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+# Aviso de mudança de status de pedidos entre processos, via LISTEN/NOTIFY do PostgreSQL.
+#
+# Quem muda o status de um pedido chama notificar_status() dentro da própria transação; o
+# PostgreSQL só entrega o aviso depois do commit (e nunca se houver rollback). Cada processo
+# mantém uma conexão dedicada escutando o canal e repassa os avisos para os assinantes locais
+# (cache de pedidos, clientes aguardando o status, ...).
+
+CANAL_STATUS_PEDIDO = 'pedido_status'
+
+
+def notificar_status(cur, order_id_interno, status):
+    """Agenda, na transação de `cur`, o aviso de que o pedido mudou para `status`."""
+    cur.execute(
+        "SELECT pg_notify(%s, %s);",
+        (CANAL_STATUS_PEDIDO, json.dumps({'order_id': order_id_interno, 'status': status}))
+    )
+
+
+def notificar_status_em_lote(cur, order_ids, status):
+    """Mesmo que notificar_status(), para vários pedidos em um único comando."""
+    if not order_ids:
+        return
+    cur.execute(
+        "SELECT pg_notify(%s, json_build_object('order_id', o, 'status', %s)::text) FROM unnest(%s::text[]) AS o;",
+        (CANAL_STATUS_PEDIDO, status, list(order_ids))
+    )
+
+
+class OuvinteStatusPedidos:
+    """Thread que escuta CANAL_STATUS_PEDIDO e chama os assinantes com (order_id, status).
+
+    Se a conexão cair, os assinantes recebem (None, None) — avisos podem ter sido perdidos e
+    qualquer estado derivado deve ser descartado — e a escuta é refeita com backoff.
+    """
+
+    def __init__(self):
+        self.assinantes = []
+        self.ativo = False  # True enquanto a escuta está funcionando
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def assinar(self, callback):
+        with self._lock:
+            self.assinantes.append(callback)
+
+    def garantir_iniciado(self):
+        """Inicia a thread de escuta uma vez por processo (inclusive após fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.ativo = False
+            threading.Thread(target=self._loop, name="ouvinte-status-pedidos", daemon=True).start()
+
+    def _avisar(self, order_id, status):
+        for callback in list(self.assinantes):
+            try:
+                callback(order_id, status)
+            except Exception as e:
+                logging.error(f"❌ Erro em assinante de status de pedidos: {e}")
+
+    def _loop(self):
+        espera = 1.0
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(os.getenv('POSTGRES_URL'))
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CANAL_STATUS_PEDIDO};")
+                self.ativo = True
+                espera = 1.0
+                logging.info(f"👂 Escutando mudanças de status de pedidos (pid {os.getpid()}).")
+                while True:
+                    if select.select([conn], [], [], 30.0) == ([], [], []):
+                        # Sem avisos: confirma que a conexão continua viva
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT 1;")
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        aviso = conn.notifies.pop(0)
+                        try:
+                            dados = json.loads(aviso.payload)
+                        except ValueError:
+                            continue
+                        self._avisar(dados.get('order_id'), dados.get('status'))
+            except Exception as e:
+                logging.error(f"❌ Escuta de status de pedidos interrompida: {e}")
+            finally:
+                if self.ativo:
+                    self.ativo = False
+                    self._avisar(None, None)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+            time.sleep(espera)
+            espera = min(espera * 2, 60.0)
+
+
+class AssinaturasStatus:
+    """Distribui os avisos do ouvinte para quem está aguardando um pedido específico.
+
+    Cada cliente aguardando recebe uma fila própria; um único aviso do banco chega a todos
+    os clientes daquele pedido neste processo, sem nenhuma consulta por cliente.
+    """
+
+    def __init__(self, ouvinte):
+        self.ouvinte = ouvinte
+        self._filas = {}
+        self._lock = threading.Lock()
+        ouvinte.assinar(self._ao_mudar_status)
+
+    def _ao_mudar_status(self, order_id, status):
+        with self._lock:
+            if order_id is None:
+                filas = [fila for filas_pedido in self._filas.values() for fila in filas_pedido]
+            else:
+                filas = list(self._filas.get(order_id, ()))
+        for fila in filas:
+            fila.put(status)  # None = escuta reiniciada, o estado atual deve ser relido
+
+    @contextmanager
+    def assinar(self, order_id):
+        self.ouvinte.garantir_iniciado()
+        fila = queue.Queue()
+        with self._lock:
+            self._filas.setdefault(order_id, set()).add(fila)
+        try:
+            yield fila
+        finally:
+            with self._lock:
+                filas_pedido = self._filas.get(order_id)
+                if filas_pedido is not None:
+                    filas_pedido.discard(fila)
+                    if not filas_pedido:
+                        del self._filas[order_id]
+
+    def total(self):
+        with self._lock:
+            return sum(len(filas_pedido) for filas_pedido in self._filas.values())
+
+
+ouvinte_status = OuvinteStatusPedidos()
+assinaturas_status = AssinaturasStatus(ouvinte_status)
@@ -0,0 +1,48 @@
+import os
+import multiprocessing
+
+# Configuração do gunicorn (lida automaticamente a partir da raiz do projeto).
+#
+# Por padrão os workers são gevent: cada processo atende até WEB_WORKER_CONNECTIONS
+# requisições ao mesmo tempo, e uma chamada lenta ao Mercado Pago, ao Discord ou ao banco
+# suspende só a requisição que a fez. Com WEB_WORKER_CLASS=sync volta ao modo antigo
+# (uma requisição por worker).
+#
+# Variáveis de ambiente:
+#   WEB_WORKER_CLASS        gevent (padrão) ou sync
+#   WEB_CONCURRENCY         número de processos (padrão: 2 x CPUs + 1, no máximo 4)
+#   WEB_WORKER_CONNECTIONS  requisições simultâneas por processo gevent (padrão: 100)
+#   WEB_TIMEOUT             segundos até um worker travado ser reiniciado (padrão: 30)
+#   DB_POOL_MAX             conexões PostgreSQL por processo (ver db.py); no modo gevent as
+#                           requisições além desse número esperam na fila do pool por até
+#                           DB_POOL_TIMEOUT segundos, então WEB_CONCURRENCY x DB_POOL_MAX
+#                           deve caber no max_connections do banco.
+#   WEB_PRELOAD             true: o app é importado uma vez no master e os workers herdam o
+#                           processo já carregado (boot mais rápido, memória compartilhada
+#                           por copy-on-write); os clientes de rede são criados após o fork.
+#                           Com workers gevent o monkey patch é feito no topo do app.py
+#   WEB_AQUECER             false: não cria pool, SDK e cache de estáticos antes do primeiro
+#                           request de cada worker (padrão: true)
+#   PROXY_SALTOS            proxies confiáveis na frente do app, para o IP do cliente vir de
+#                           X-Forwarded-For (padrão: 1, o roteador do Heroku; 0 = sem proxy).
+#                           Ver app.py: o limite de checkouts por IP depende dele
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gevent')
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_connections = int(os.getenv('WEB_WORKER_CONNECTIONS', '100'))
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+keepalive = 5
+preload_app = os.getenv('WEB_PRELOAD', 'false').lower() == 'true'
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        from db import ativar_espera_cooperativa
+        ativar_espera_cooperativa()
+
+
+def post_worker_init(worker):
+    if os.getenv('WEB_AQUECER', 'true').lower() == 'true':
+        from app import aquecer_processo
+        aquecer_processo()
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime, timezone
+
+from flask import g, has_request_context
+
+# Logs sem bloquear as requisições.
+#
+# Quem chama logging.info() só cria o registro e o coloca numa fila em memória; uma thread
+# do processo (QueueListener) formata e escreve no stderr. Se a fila encher (stderr lento,
+# pico de tráfego), os registros novos são descartados e contados, em vez de a requisição
+# esperar pela escrita. Cada registro sai como uma linha JSON com o request_id da requisição
+# em andamento (cabeçalho X-Request-ID, ver app.py) e os campos passados em `extra`.
+#
+# Logs INFO de um mesmo ponto do código (arquivo e linha) passam no máximo LOG_INFO_POR_SEGUNDO
+# vezes por segundo; o primeiro que passa depois de uma supressão informa quantos foram
+# omitidos. WARNING e acima nunca são amostrados. Mensagens acima de LOG_MENSAGEM_MAX
+# caracteres são cortadas, e resumir_lista() encurta listas grandes (ex.: números de um pedido).
+#
+# Variáveis de ambiente:
+#   LOG_NIVEL             nível mínimo (padrão: INFO)
+#   LOG_FORMATO           json (padrão) ou texto, para leitura no terminal
+#   LOG_INFO_POR_SEGUNDO  registros INFO por segundo de cada ponto do código (0 = sem amostragem; padrão: 20)
+#   LOG_FILA_MAX          registros aguardando escrita antes de começar a descartar (padrão: 10000)
+
+LOG_MENSAGEM_MAX = 2000
+LOG_LISTA_MAX = 10
+
+# Atributos de todo LogRecord; os demais vieram de `extra` e vão para o JSON
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+_handler = None
+_descartados = 0
+
+
+def resumir_lista(itens, maximo=LOG_LISTA_MAX):
+    """'a, b, c' para listas curtas; 'a, b, ... (+N)' além de `maximo` itens."""
+    itens = list(itens)
+    if len(itens) <= maximo:
+        return ', '.join(map(str, itens))
+    return f"{', '.join(map(str, itens[:maximo]))}, ... (+{len(itens) - maximo})"
+
+
+class FiltroAmostragem(logging.Filter):
+    """Limita os registros INFO (e abaixo) de cada ponto do código a `por_segundo` por segundo."""
+
+    def __init__(self, por_segundo):
+        super().__init__()
+        self.por_segundo = por_segundo
+        self._baldes = {}  # (arquivo, linha) -> [fichas, última recarga, suprimidos]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not self.por_segundo:
+            return True
+        chave = (record.pathname, record.lineno)
+        agora = time.monotonic()
+        with self._lock:
+            balde = self._baldes.get(chave)
+            if balde is None:
+                balde = self._baldes[chave] = [float(self.por_segundo), agora, 0]
+            balde[0] = min(self.por_segundo, balde[0] + (agora - balde[1]) * self.por_segundo)
+            balde[1] = agora
+            if balde[0] < 1:
+                balde[2] += 1
+                return False
+            balde[0] -= 1
+            if balde[2]:
+                record.suprimidos = balde[2]
+                balde[2] = 0
+        return True
+
+
+class FiltroContexto(logging.Filter):
+    """Anexa o request_id da requisição atual (roda na thread de quem fez o log)."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+        return True
+
+
+class HandlerFilaSemBloqueio(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        global _descartados
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _descartados += 1
+
+    def prepare(self, record):
+        # Só o necessário na thread de quem fez o log: a mensagem (os argumentos podem mudar
+        # depois) e o traceback; o JSON é montado pelo escritor
+        mensagem = record.getMessage()
+        if len(mensagem) > LOG_MENSAGEM_MAX:
+            mensagem = f"{mensagem[:LOG_MENSAGEM_MAX]}... [{len(mensagem) - LOG_MENSAGEM_MAX} caracteres omitidos]"
+        record.msg = mensagem
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class FormatadorJSON(logging.Formatter):
+    def format(self, record):
+        dados = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'msg': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for chave, valor in vars(record).items():
+            if chave not in _ATRIBUTOS_PADRAO and valor is not None:
+                dados[chave] = valor
+        if record.exc_text:
+            dados['exc'] = record.exc_text
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+def _iniciar_escritor():
+    global _listener
+    saida = logging.StreamHandler(sys.stderr)
+    if os.getenv('LOG_FORMATO', 'json') == 'texto':
+        saida.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    else:
+        saida.setFormatter(FormatadorJSON())
+    _handler.queue = queue.Queue(maxsize=int(os.getenv('LOG_FILA_MAX', '10000')))
+    _listener = logging.handlers.QueueListener(_handler.queue, saida)
+    _listener.start()
+
+
+def _parar_escritor():
+    if _listener is not None:
+        _listener.stop()  # Escreve o que ainda está na fila
+
+
+def configurar_logs():
+    """Troca os handlers do logger raiz pela fila com escritor em segundo plano (uma vez por processo)."""
+    global _handler
+    if _handler is not None:
+        return
+    _handler = HandlerFilaSemBloqueio(None)
+    _handler.addFilter(FiltroAmostragem(float(os.getenv('LOG_INFO_POR_SEGUNDO', '20'))))
+    _handler.addFilter(FiltroContexto())
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(_handler)
+    raiz.setLevel(os.getenv('LOG_NIVEL', 'INFO').upper())
+    _iniciar_escritor()
+    atexit.register(_parar_escritor)
+    # A thread do escritor não sobrevive ao fork (gunicorn com --preload): cada filho cria a sua
+    os.register_at_fork(after_in_child=_iniciar_escritor)
+
+
+def estatisticas_logs():
+    return {
+        'fila': _handler.queue.qsize() if _handler is not None else 0,
+        'descartados': _descartados,
+    }
@@ -0,0 +1,75 @@
+import os
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import mercadopago
+from mercadopago.http import HttpClient
+
+# Cliente do Mercado Pago compartilhado pelo processo.
+#
+# O HttpClient padrão do SDK cria uma requests.Session nova (e um handshake TLS novo) a cada
+# chamada. Aqui uma única Session com pool de conexões keep-alive é reutilizada por todas as
+# threads do worker, com timeouts explícitos de conexão/leitura e retentativas limitadas.
+# MP_API_BASE_URL redireciona as chamadas para um servidor local (ver benchmark/stub_mercadopago.py).
+
+MP_API_BASE_URL_PADRAO = "https://api.mercadopago.com"
+
+
+class HttpClientKeepAlive(HttpClient):
+    """HttpClient do SDK que reaproveita conexões HTTP entre chamadas."""
+
+    def __init__(self, timeout_conexao=3.05, timeout_leitura=15.0, max_retentativas=2,
+                 tamanho_pool=10, base_url=None):
+        self.timeout = (timeout_conexao, timeout_leitura)
+        self.base_url = base_url.rstrip('/') if base_url else None
+        retry = Retry(
+            total=max_retentativas,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET", "PUT", "DELETE"],  # POST (criar preferência) não é idempotente
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho_pool, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, maxretries=None, **kwargs):
+        # O timeout e as retentativas do SDK (60s, 3 tentativas) são substituídos pelos nossos
+        kwargs['timeout'] = self.timeout
+        if self.base_url and url.startswith(MP_API_BASE_URL_PADRAO):
+            url = self.base_url + url[len(MP_API_BASE_URL_PADRAO):]
+        api_result = self.session.request(method, url, **kwargs)
+        return {
+            "status": api_result.status_code,
+            "response": api_result.json()
+        }
+
+
+_sdk = None
+_sdk_pid = None
+_sdk_lock = threading.Lock()
+
+
+def obter_sdk(access_token):
+    """Retorna o SDK do processo atual, criado uma única vez (recriado após fork)."""
+    global _sdk, _sdk_pid
+    pid = os.getpid()
+    if _sdk is not None and _sdk_pid == pid:
+        return _sdk
+    with _sdk_lock:
+        if _sdk is None or _sdk_pid != pid:
+            http_client = HttpClientKeepAlive(
+                timeout_conexao=float(os.getenv('MP_TIMEOUT_CONEXAO', '3.05')),
+                timeout_leitura=float(os.getenv('MP_TIMEOUT_LEITURA', '15')),
+                max_retentativas=int(os.getenv('MP_MAX_RETENTATIVAS', '2')),
+                tamanho_pool=int(os.getenv('MP_POOL_CONEXOES', '10')),
+                base_url=os.getenv('MP_API_BASE_URL'),
+            )
+            _sdk = mercadopago.SDK(access_token, http_client=http_client)
+            _sdk_pid = pid
+            logging.info(f"💳 Cliente Mercado Pago criado (pid {pid}).")
+    return _sdk
@@ -0,0 +1,167 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Métricas em memória (contadores e histogramas) expostas no formato texto do Prometheus.
+#
+# Cada processo (worker do gunicorn, worker.py) tem as suas: o Prometheus deve coletar cada
+# processo separadamente ou agregar as séries pelo rótulo `pid` incluído em /metrics
+# (que, como as rotas /admin/*, exige o ADMIN_TOKEN: use `authorization` no scrape_config).
+# As etapas dos caminhos críticos são medidas com:
+#
+#     with medir('reserva_tokens'):
+#         ...
+#
+# o que registra a duração em sorteio_etapa_segundos{etapa="reserva_tokens"} e, se a etapa
+# terminar com exceção, incrementa sorteio_etapa_erros_total{etapa="reserva_tokens"}.
+
+BUCKETS_PADRAO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _formatar_rotulos(nomes, valores, extras=()):
+    pares = list(zip(nomes, valores)) + list(extras)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + '}'
+
+
+def _formatar_numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = tuple(rotulos.get(r, '') for r in self.rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def exportar(self, fixos=()):
+        linhas = [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} counter"]
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for chave, valor in valores:
+            linhas.append(f"{self.nome}{_formatar_rotulos(self.rotulos, chave, fixos)} {_formatar_numero(valor)}")
+        return linhas
+
+
+class Histograma:
+    def __init__(self, nome, descricao, rotulos=(), buckets=BUCKETS_PADRAO):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # chave -> [contagens por bucket, soma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **rotulos):
+        chave = tuple(rotulos.get(r, '') for r in self.rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def medir(self, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def exportar(self, fixos=()):
+        linhas = [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            series = sorted((chave, [list(s[0]), s[1], s[2]]) for chave, s in self._series.items())
+        for chave, (contagens, soma, total) in series:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets, contagens):
+                acumulado += contagem
+                rotulos = _formatar_rotulos(self.rotulos, chave, list(fixos) + [('le', _formatar_numero(limite))])
+                linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+            rotulos = _formatar_rotulos(self.rotulos, chave, fixos)
+            linhas.append(f"{self.nome}_sum{rotulos} {_formatar_numero(soma)}")
+            linhas.append(f"{self.nome}_count{rotulos} {total}")
+        return linhas
+
+
+class Registro:
+    def __init__(self):
+        self.metricas = []
+        self.coletores = []
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        with self._lock:
+            self.metricas.append(metrica)
+        return metrica
+
+    def registrar_coletor(self, coletor):
+        """Registra uma função chamada a cada coleta, que retorna {nome: (descrição, valor)} de gauges."""
+        with self._lock:
+            self.coletores.append(coletor)
+
+    def exportar(self, rotulos_fixos=None):
+        """Texto de todas as métricas no formato de exposição do Prometheus."""
+        fixos = tuple((rotulos_fixos or {}).items())
+        linhas = []
+        for metrica in list(self.metricas):
+            linhas.extend(metrica.exportar(fixos))
+        for coletor in list(self.coletores):
+            for nome, (descricao, valor) in coletor().items():
+                linhas.append(f"# HELP {nome} {descricao}")
+                linhas.append(f"# TYPE {nome} gauge")
+                linhas.append(f"{nome}{_formatar_rotulos((), (), fixos)} {_formatar_numero(valor)}")
+        return '\n'.join(linhas) + '\n'
+
+
+registro = Registro()
+
+ETAPA_SEGUNDOS = registro.registrar(Histograma(
+    'sorteio_etapa_segundos', 'Duração de cada etapa dos caminhos críticos (checkout, webhook, notificações).', ['etapa']
+))
+ETAPA_ERROS = registro.registrar(Contador(
+    'sorteio_etapa_erros_total', 'Etapas dos caminhos críticos que terminaram com exceção.', ['etapa']
+))
+ADMISSAO_RECUSAS = registro.registrar(Contador(
+    'sorteio_admissao_recusas_total', 'Checkouts recusados pelo controle de admissão, por motivo.', ['motivo']
+))
+REQUISICAO_SEGUNDOS = registro.registrar(Histograma(
+    'sorteio_http_requisicao_segundos', 'Duração das requisições HTTP por rota, método e status.', ['rota', 'metodo', 'status']
+))
+
+
+@contextmanager
+def medir(etapa):
+    """Mede a duração de uma etapa, contando também as que terminam com exceção."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        ETAPA_ERROS.incrementar(etapa=etapa)
+        raise
+    finally:
+        ETAPA_SEGUNDOS.observar(time.perf_counter() - inicio, etapa=etapa)
+
+
+def observar_etapa(etapa, segundos):
+    """Registra a duração de uma etapa medida por quem chama."""
+    ETAPA_SEGUNDOS.observar(segundos, etapa=etapa)
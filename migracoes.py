@@ -0,0 +1,614 @@
+import os
+import sys
+import json
+import argparse
+
+import psycopg2
+from dotenv import load_dotenv
+
+# Migrações versionadas do esquema.
+#
+# Cada migração tem um número de versão e é aplicada uma única vez; as versões aplicadas ficam
+# registradas em SchemaMigracoes. O executor segura um advisory lock durante a execução, então
+# vários processos subindo juntos (ex.: release do Heroku e workers) não aplicam a mesma
+# migração em paralelo. Migrações transacionais rodam inteiras numa transação junto com o seu
+# registro; as marcadas como não transacionais (CREATE INDEX CONCURRENTLY, que não trava
+# escritas na tabela mas não pode rodar dentro de uma transação) rodam em autocommit, passo a
+# passo, e só são registradas ao final.
+#
+# verificar_planos() roda EXPLAIN nas consultas mais frequentes do app e confere que cada uma
+# consegue usar o índice projetado para ela.
+#
+# Uso:
+#     python migracoes.py               # aplica as migrações pendentes
+#     python migracoes.py --status      # lista as versões aplicadas e pendentes
+#     python migracoes.py --verificar   # confere os planos das consultas críticas
+
+load_dotenv()
+
+DATABASE_URL = os.getenv('POSTGRES_URL')
+
+CHAVE_LOCK_MIGRACOES = 7261001  # Chave do pg_advisory_lock, qualquer inteiro fixo do projeto
+
+
+class Migracao:
+    def __init__(self, versao, descricao, passos, transacional=True):
+        self.versao = versao
+        self.descricao = descricao
+        self.passos = passos  # SQL (str) ou função que recebe o cursor
+        self.transacional = transacional
+
+
+def inicializar_contador(cur):
+    # SQL do esquema desta versão (sem rifas), e não reservas.recalcular_contador(), que segue o esquema atual
+    cur.execute("SELECT COUNT(*) FROM ContadorTokens;")
+    if cur.fetchone()[0] == 0:
+        cur.execute("""
+            INSERT INTO ContadorTokens (slot, disponiveis)
+            SELECT s, CASE WHEN s = 0 THEN (SELECT COUNT(id) FROM Tokens WHERE disponivel = TRUE) ELSE 0 END
+            FROM generate_series(0, 15) AS s;
+        """)
+
+
+def indice_concorrente(nome, definicao):
+    """Passo que cria o índice `nome` com CREATE INDEX CONCURRENTLY.
+
+    Um build concorrente interrompido deixa o índice marcado como inválido; ele é removido
+    antes, para que o IF NOT EXISTS não pule a criação.
+    """
+    def criar(cur):
+        cur.execute("""
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND NOT i.indisvalid;
+        """, (nome.lower(),))
+        if cur.fetchone():
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome};")
+        cur.execute(f"CREATE {definicao.replace('INDEX', 'INDEX CONCURRENTLY IF NOT EXISTS ' + nome, 1)};")
+    return criar
+
+def indice_particionado_concorrente(nome, tabela, definicao):
+    """Passo que cria o índice `nome` numa tabela particionada sem travar as escritas.
+
+    CREATE INDEX CONCURRENTLY não funciona na tabela pai: o índice é criado nela com ON ONLY
+    (vazio e inválido), construído concorrentemente em cada partição e anexado; quando a
+    última partição é anexada ele passa a valer. Partições criadas depois o recebem sozinhas.
+    """
+    def criar(cur):
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON ONLY {tabela} {definicao};")
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits h JOIN pg_class c ON c.oid = h.inhrelid
+            WHERE h.inhparent = %s::regclass ORDER BY c.relname;
+        """, (tabela.lower(),))
+        for (particao,) in cur.fetchall():
+            nome_particao = f"{particao}_{nome}"
+            indice_concorrente(nome_particao, f"INDEX ON {particao} {definicao}")(cur)
+            cur.execute("""
+                SELECT 1 FROM pg_inherits h
+                WHERE h.inhrelid = %s::regclass AND h.inhparent = %s::regclass;
+            """, (nome_particao, nome.lower()))
+            if not cur.fetchone():
+                cur.execute(f"ALTER INDEX {nome} ATTACH PARTITION {nome_particao};")
+    return criar
+
+
+MIGRACOES = [
+    Migracao(1, "esquema inicial (equivalente ao create_tables.py anterior às migrações)", [
+        """
+        CREATE TABLE IF NOT EXISTS Tokens (
+            id SERIAL PRIMARY KEY,
+            numero_token VARCHAR(10) UNIQUE NOT NULL,
+            disponivel BOOLEAN DEFAULT TRUE,
+            ordem_alocacao DOUBLE PRECISION NOT NULL DEFAULT random(), -- Posição aleatória usada na reserva (ver reservas.py)
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # Bancos criados antes da reserva por ordem aleatória: cada token existente recebe sua posição
+        "ALTER TABLE Tokens ADD COLUMN IF NOT EXISTS ordem_alocacao DOUBLE PRECISION NOT NULL DEFAULT random();",
+        """
+        CREATE TABLE IF NOT EXISTS Adquiridos (
+            id SERIAL PRIMARY KEY,
+            token_id INTEGER REFERENCES Tokens(id),
+            numero_token_adquirido VARCHAR(10),
+            nome_cliente VARCHAR(255) NOT NULL,
+            email_cliente VARCHAR(255) NOT NULL,
+            cpf_cliente VARCHAR(20),
+            telefone_cliente VARCHAR(50),
+            payment_id_mp VARCHAR(255),      -- ID do pagamento no Mercado Pago
+            order_id_interno VARCHAR(255) UNIQUE, -- Seu 'order_id' / external_reference do MP
+            status_compra VARCHAR(50),       -- ex: 'pending', 'approved', 'rejected'
+            total_pago DECIMAL(10, 2),       -- Valor total pago
+            data_compra TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "ALTER TABLE Adquiridos ADD COLUMN IF NOT EXISTS quantidade INTEGER;",
+        "ALTER TABLE Adquiridos ADD COLUMN IF NOT EXISTS data_criacao_pedido TIMESTAMP DEFAULT CURRENT_TIMESTAMP;",
+        "ALTER TABLE Adquiridos ADD COLUMN IF NOT EXISTS data_ultima_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP;",
+        # Prazo da reserva dos tokens de pedidos pendentes (ver pedidos.py)
+        "ALTER TABLE Adquiridos ADD COLUMN IF NOT EXISTS reservado_ate TIMESTAMP;",
+        # Relação pedido <-> token (ver pedidos.py). A chave primária atende "tokens do pedido Y"
+        # e o UNIQUE em token_id atende "quem detém o token X", além de impedir atribuição dupla
+        """
+        CREATE TABLE IF NOT EXISTS PedidoTokens (
+            adquirido_id INTEGER NOT NULL REFERENCES Adquiridos(id) ON DELETE CASCADE,
+            token_id INTEGER NOT NULL UNIQUE REFERENCES Tokens(id),
+            PRIMARY KEY (adquirido_id, token_id)
+        );
+        """,
+        # Contador de tokens disponíveis, dividido em slots (ver reservas.py)
+        """
+        CREATE TABLE IF NOT EXISTS ContadorTokens (
+            slot SMALLINT PRIMARY KEY,
+            disponiveis BIGINT NOT NULL DEFAULT 0
+        );
+        """,
+        inicializar_contador,
+        # Fila durável de notificações (e-mail/Discord), drenada em segundo plano (ver notificacoes.py)
+        """
+        CREATE TABLE IF NOT EXISTS NotificacoesPendentes (
+            id BIGSERIAL PRIMARY KEY,
+            canal VARCHAR(20) NOT NULL,            -- 'email' ou 'discord'
+            payload JSONB NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pendente', -- 'pendente', 'enviada', 'falhou'
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            erro TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            enviado_em TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_notificacoes_pendentes_fila ON NotificacoesPendentes(canal, proxima_tentativa) WHERE status = 'pendente';",
+        # Registro idempotente das notificações do Mercado Pago (ver processamento_webhook.py)
+        """
+        CREATE TABLE IF NOT EXISTS WebhooksRecebidos (
+            topic VARCHAR(50) NOT NULL,
+            resource_id VARCHAR(255) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pendente', -- 'pendente', 'processado', 'falhou'
+            entregas INTEGER NOT NULL DEFAULT 1,          -- Quantas vezes o Mercado Pago enviou esta notificação
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            order_id_interno VARCHAR(255),
+            status_pagamento VARCHAR(50),                 -- Último status consultado no Mercado Pago
+            ultimo_erro TEXT,
+            recebido_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ultima_entrega TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processado_em TIMESTAMP,
+            PRIMARY KEY (topic, resource_id)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_webhooks_recebidos_fila ON WebhooksRecebidos(proxima_tentativa) WHERE status = 'pendente';",
+        # Apuração do sorteio (ver sorteio.py): compromisso da semente, números vendidos congelados
+        # em posições 0..N-1 (a chave primária é o índice usado para achar cada ganhador) e resultado
+        """
+        CREATE TABLE IF NOT EXISTS Sorteios (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(255) NOT NULL,
+            compromisso_semente CHAR(64) NOT NULL,  -- sha256(semente), publicado antes do sorteio
+            total_bilhetes BIGINT,
+            hash_bilhetes CHAR(64),                 -- sha256 da lista de números congelada
+            semente TEXT,                           -- Revelada na apuração
+            valor_publico TEXT,
+            premios INTEGER,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            realizado_em TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS SorteioBilhetes (
+            sorteio_id INTEGER NOT NULL REFERENCES Sorteios(id) ON DELETE CASCADE,
+            posicao BIGINT NOT NULL,
+            token_id INTEGER NOT NULL REFERENCES Tokens(id),
+            PRIMARY KEY (sorteio_id, posicao)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS SorteioGanhadores (
+            sorteio_id INTEGER NOT NULL REFERENCES Sorteios(id) ON DELETE CASCADE,
+            premio INTEGER NOT NULL,
+            posicao BIGINT NOT NULL,
+            token_id INTEGER NOT NULL REFERENCES Tokens(id),
+            adquirido_id INTEGER NOT NULL REFERENCES Adquiridos(id),
+            PRIMARY KEY (sorteio_id, premio)
+        );
+        """,
+        # Estado compartilhado dos limites de taxa do checkout (ADMISSAO_BACKEND=postgres, ver admissao.py).
+        # UNLOGGED: não passa pelo WAL, e perder o conteúdo num crash só zera os limites
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS LimitesTaxa (
+            chave VARCHAR(100) PRIMARY KEY,
+            tat TIMESTAMPTZ NOT NULL
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tokens_numero_token ON Tokens(numero_token);",
+        "CREATE INDEX IF NOT EXISTS idx_tokens_disponivel ON Tokens(disponivel);",
+        "CREATE INDEX IF NOT EXISTS idx_tokens_ordem_alocacao_disponivel ON Tokens(ordem_alocacao) WHERE disponivel = TRUE;",
+        "CREATE INDEX IF NOT EXISTS idx_adquiridos_token_id ON Adquiridos(token_id);",
+        "CREATE INDEX IF NOT EXISTS idx_adquiridos_email_cliente ON Adquiridos(email_cliente);",
+        "CREATE INDEX IF NOT EXISTS idx_adquiridos_order_id_interno ON Adquiridos(order_id_interno);",
+        "CREATE INDEX IF NOT EXISTS idx_adquiridos_status_compra ON Adquiridos(status_compra);",
+        "CREATE INDEX IF NOT EXISTS idx_adquiridos_reservado_ate ON Adquiridos(reservado_ate) WHERE reservado_ate IS NOT NULL;",
+    ]),
+
+    Migracao(2, "alinha Adquiridos com as colunas usadas pelo app", [
+        # Colunas de texto do modelo anterior a PedidoTokens: lidas por migrar_pedido_tokens.py e
+        # presentes nos bancos de produção, mas ausentes dos criados do zero pelo create_tables.py
+        "ALTER TABLE Adquiridos ADD COLUMN IF NOT EXISTS tokens_ids_db TEXT;",
+        "ALTER TABLE Adquiridos ADD COLUMN IF NOT EXISTS tokens_numeros_db TEXT;",
+        "COMMENT ON COLUMN Adquiridos.tokens_ids_db IS 'Legado: os tokens do pedido ficam em PedidoTokens';",
+        "COMMENT ON COLUMN Adquiridos.tokens_numeros_db IS 'Legado: os tokens do pedido ficam em PedidoTokens';",
+        # Pedidos gravados antes de quantidade existir: a quantidade é a de tokens vinculados
+        """
+        UPDATE Adquiridos a SET quantidade = v.total
+        FROM (SELECT adquirido_id, count(*) AS total FROM PedidoTokens GROUP BY adquirido_id) v
+        WHERE a.id = v.adquirido_id AND a.quantidade IS NULL;
+        """,
+        "ALTER TABLE Adquiridos ALTER COLUMN status_compra SET DEFAULT 'pending';",
+        "UPDATE Adquiridos SET data_criacao_pedido = CURRENT_TIMESTAMP WHERE data_criacao_pedido IS NULL;",
+        "ALTER TABLE Adquiridos ALTER COLUMN data_criacao_pedido SET NOT NULL;",
+    ]),
+
+    # Índices desenhados para as consultas do app (ver CONSULTAS_CRITICAS), criados sem travar
+    # escritas; os antigos saem só depois que os novos existem
+    Migracao(3, "troca índices redundantes por índices parciais e de cobertura", [
+        # /payment_status, /success e SSE leem só estas colunas por order_id_interno: index-only scan.
+        # É UNIQUE, então substitui a constraint UNIQUE original (e o índice duplicado sobre ela)
+        indice_concorrente('idx_adquiridos_order_id_cobertura',
+                           "UNIQUE INDEX ON Adquiridos(order_id_interno) INCLUDE (id, status_compra, nome_cliente)"),
+        # Pedidos pendentes por idade (reconciliação com o Mercado Pago): só os pendentes entram no índice
+        indice_concorrente('idx_adquiridos_pendentes_idade',
+                           "INDEX ON Adquiridos(data_criacao_pedido) WHERE status_compra = 'pending'"),
+        "ALTER TABLE Adquiridos DROP CONSTRAINT IF EXISTS adquiridos_order_id_interno_key;",
+        # Booleano com poucos valores distintos: reserva e contagem usam o índice parcial
+        # idx_tokens_ordem_alocacao_disponivel (ver reservas.py)
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_tokens_disponivel;",
+        # Duplicam a constraint UNIQUE de Tokens.numero_token e o índice de cobertura
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_tokens_numero_token;",
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_adquiridos_order_id_interno;",
+        # Substituído pelo índice parcial de pendentes; os demais status nunca são buscados pelo status
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_adquiridos_status_compra;",
+        # Colunas legadas/sem consulta no app: só custavam escrita a cada pedido
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_adquiridos_token_id;",
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_adquiridos_email_cliente;",
+        "ANALYZE Adquiridos;",
+        "ANALYZE Tokens;",
+    ], transacional=False),
+
+    # Várias rifas (ver rifas.py). Tabelas comuns não podem virar particionadas no lugar: as novas
+    # são criadas ao lado, recebem os dados (todos da rifa 1) e tomam o nome das antigas. Roda numa
+    # transação só, com as tabelas travadas durante a cópia. As colunas legadas token_id e
+    # numero_token_adquirido de Adquiridos, nunca gravadas pelo app, não passam para a nova tabela.
+    Migracao(4, "rifas: Tokens, Adquiridos e PedidoTokens particionadas por rifa", [
+        """
+        CREATE TABLE IF NOT EXISTS Rifas (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(255) NOT NULL,
+            valor_unitario DECIMAL(10, 2) NOT NULL,
+            formato_token VARCHAR(10) NOT NULL DEFAULT 'L999',
+            status VARCHAR(20) NOT NULL DEFAULT 'ativa' CHECK (status IN ('ativa', 'encerrada', 'arquivada')),
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            encerrada_em TIMESTAMP
+        );
+        """,
+        "INSERT INTO Rifas (id, nome, valor_unitario, formato_token) VALUES (1, 'Sorteio do Carro', 10.00, 'L999');",
+        "SELECT setval(pg_get_serial_sequence('rifas', 'id'), 1);",
+        # Os ids continuam vindo das mesmas sequências, então seguem únicos entre as rifas
+        "ALTER SEQUENCE tokens_id_seq OWNED BY NONE;",
+        "ALTER SEQUENCE adquiridos_id_seq OWNED BY NONE;",
+        """
+        CREATE TABLE Tokens_particionada (
+            rifa_id INTEGER NOT NULL,
+            id INTEGER NOT NULL DEFAULT nextval('tokens_id_seq'),
+            numero_token VARCHAR(10) NOT NULL,
+            disponivel BOOLEAN DEFAULT TRUE,
+            ordem_alocacao DOUBLE PRECISION NOT NULL DEFAULT random(),
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) PARTITION BY LIST (rifa_id);
+        """,
+        """
+        CREATE TABLE Adquiridos_particionada (
+            rifa_id INTEGER NOT NULL,
+            id INTEGER NOT NULL DEFAULT nextval('adquiridos_id_seq'),
+            nome_cliente VARCHAR(255) NOT NULL,
+            email_cliente VARCHAR(255) NOT NULL,
+            cpf_cliente VARCHAR(20),
+            telefone_cliente VARCHAR(50),
+            payment_id_mp VARCHAR(255),
+            order_id_interno VARCHAR(255),
+            status_compra VARCHAR(50) DEFAULT 'pending',
+            total_pago DECIMAL(10, 2),
+            quantidade INTEGER,
+            data_compra TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data_criacao_pedido TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            data_ultima_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reservado_ate TIMESTAMP,
+            tokens_ids_db TEXT,
+            tokens_numeros_db TEXT
+        ) PARTITION BY LIST (rifa_id);
+        """,
+        """
+        CREATE TABLE PedidoTokens_particionada (
+            rifa_id INTEGER NOT NULL,
+            adquirido_id INTEGER NOT NULL,
+            token_id INTEGER NOT NULL
+        ) PARTITION BY LIST (rifa_id);
+        """,
+        "CREATE TABLE tokens_rifa_1 PARTITION OF Tokens_particionada FOR VALUES IN (1);",
+        "CREATE TABLE adquiridos_rifa_1 PARTITION OF Adquiridos_particionada FOR VALUES IN (1);",
+        "CREATE TABLE pedidotokens_rifa_1 PARTITION OF PedidoTokens_particionada FOR VALUES IN (1);",
+        """
+        INSERT INTO Tokens_particionada (rifa_id, id, numero_token, disponivel, ordem_alocacao, data_criacao)
+        SELECT 1, id, numero_token, disponivel, ordem_alocacao, data_criacao FROM Tokens;
+        """,
+        """
+        INSERT INTO Adquiridos_particionada (
+            rifa_id, id, nome_cliente, email_cliente, cpf_cliente, telefone_cliente, payment_id_mp,
+            order_id_interno, status_compra, total_pago, quantidade, data_compra, data_criacao_pedido,
+            data_ultima_atualizacao, reservado_ate, tokens_ids_db, tokens_numeros_db
+        )
+        SELECT 1, id, nome_cliente, email_cliente, cpf_cliente, telefone_cliente, payment_id_mp,
+               order_id_interno, status_compra, total_pago, quantidade, data_compra, data_criacao_pedido,
+               data_ultima_atualizacao, reservado_ate, tokens_ids_db, tokens_numeros_db
+        FROM Adquiridos;
+        """,
+        "INSERT INTO PedidoTokens_particionada (rifa_id, adquirido_id, token_id) SELECT 1, adquirido_id, token_id FROM PedidoTokens;",
+        # O sorteio guarda o número de cada bilhete (a verificação não depende mais de Tokens) e a sua rifa
+        "ALTER TABLE SorteioBilhetes ADD COLUMN numero_token VARCHAR(10);",
+        "UPDATE SorteioBilhetes b SET numero_token = t.numero_token FROM Tokens t WHERE t.id = b.token_id;",
+        "ALTER TABLE SorteioBilhetes ALTER COLUMN numero_token SET NOT NULL;",
+        "ALTER TABLE Sorteios ADD COLUMN rifa_id INTEGER REFERENCES Rifas(id);",
+        "UPDATE Sorteios SET rifa_id = 1;",
+        "ALTER TABLE Sorteios ALTER COLUMN rifa_id SET NOT NULL;",
+        # CASCADE remove só as chaves estrangeiras de SorteioBilhetes/SorteioGanhadores para as tabelas antigas
+        "DROP TABLE PedidoTokens;",
+        "DROP TABLE Adquiridos CASCADE;",
+        "DROP TABLE Tokens CASCADE;",
+        "ALTER TABLE Tokens_particionada RENAME TO Tokens;",
+        "ALTER TABLE Adquiridos_particionada RENAME TO Adquiridos;",
+        "ALTER TABLE PedidoTokens_particionada RENAME TO PedidoTokens;",
+        # A chave de partição precisa fazer parte das chaves primárias e únicas. id vem primeiro para
+        # que buscas só pelo id (lotes de vários pedidos) ainda usem o índice de cada partição
+        "ALTER TABLE Tokens ADD PRIMARY KEY (id, rifa_id);",
+        "ALTER TABLE Tokens ADD CONSTRAINT tokens_numero_token_key UNIQUE (rifa_id, numero_token);",
+        "ALTER TABLE Tokens ADD CONSTRAINT tokens_rifa_id_fkey FOREIGN KEY (rifa_id) REFERENCES Rifas(id);",
+        "ALTER TABLE Adquiridos ADD PRIMARY KEY (id, rifa_id);",
+        "ALTER TABLE Adquiridos ADD CONSTRAINT adquiridos_rifa_id_fkey FOREIGN KEY (rifa_id) REFERENCES Rifas(id);",
+        "ALTER TABLE PedidoTokens ADD PRIMARY KEY (adquirido_id, token_id, rifa_id);",
+        "ALTER TABLE PedidoTokens ADD CONSTRAINT pedidotokens_token_id_key UNIQUE (token_id, rifa_id);",
+        """
+        ALTER TABLE PedidoTokens ADD CONSTRAINT pedidotokens_adquirido_id_fkey
+            FOREIGN KEY (adquirido_id, rifa_id) REFERENCES Adquiridos(id, rifa_id) ON DELETE CASCADE;
+        """,
+        """
+        ALTER TABLE PedidoTokens ADD CONSTRAINT pedidotokens_token_id_fkey
+            FOREIGN KEY (token_id, rifa_id) REFERENCES Tokens(id, rifa_id);
+        """,
+        # Os mesmos índices da migração 3, agora por partição; o order_id_interno (que traz a rifa,
+        # ver rifas.rifa_do_pedido) vem antes do rifa_id na chave única
+        "CREATE INDEX idx_tokens_ordem_alocacao_disponivel ON Tokens(ordem_alocacao) WHERE disponivel = TRUE;",
+        "CREATE UNIQUE INDEX idx_adquiridos_order_id_cobertura ON Adquiridos(order_id_interno, rifa_id) INCLUDE (id, status_compra, nome_cliente);",
+        "CREATE INDEX idx_adquiridos_pendentes_idade ON Adquiridos(data_criacao_pedido) WHERE status_compra = 'pending';",
+        "CREATE INDEX idx_adquiridos_reservado_ate ON Adquiridos(reservado_ate) WHERE reservado_ate IS NOT NULL;",
+        # Contador por rifa
+        "ALTER TABLE ContadorTokens ADD COLUMN rifa_id INTEGER NOT NULL DEFAULT 1 REFERENCES Rifas(id);",
+        "ALTER TABLE ContadorTokens ALTER COLUMN rifa_id DROP DEFAULT;",
+        "ALTER TABLE ContadorTokens DROP CONSTRAINT contadortokens_pkey;",
+        "ALTER TABLE ContadorTokens ADD PRIMARY KEY (rifa_id, slot);",
+        "ANALYZE Tokens;",
+        "ANALYZE Adquiridos;",
+        "ANALYZE PedidoTokens;",
+    ]),
+
+    # Relatórios (ver relatorios.py): vendas agregadas por hora, atualizadas de forma incremental
+    # a partir dos pedidos alterados desde a última atualização
+    Migracao(5, "relatórios: VendasPorHora e índices da atualização incremental", [
+        """
+        CREATE TABLE IF NOT EXISTS VendasPorHora (
+            rifa_id INTEGER NOT NULL REFERENCES Rifas(id),
+            hora TIMESTAMP NOT NULL, -- Hora de criação dos pedidos
+            status_compra VARCHAR(50) NOT NULL,
+            pedidos INTEGER NOT NULL,
+            tokens BIGINT NOT NULL,
+            valor DECIMAL(14, 2) NOT NULL,
+            PRIMARY KEY (rifa_id, hora, status_compra)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS RelatoriosAtualizacao (
+            relatorio VARCHAR(50) PRIMARY KEY,
+            atualizado_ate TIMESTAMP NOT NULL, -- Pedidos alterados até aqui já estão nos agregados
+            atualizado_em TIMESTAMP NOT NULL
+        );
+        """,
+        # Pedidos alterados desde a última atualização, só com o índice (as horas a recalcular)
+        indice_particionado_concorrente(
+            'idx_adquiridos_ultima_atualizacao', 'Adquiridos',
+            "(data_ultima_atualizacao) INCLUDE (rifa_id, data_criacao_pedido)"
+        ),
+        # Recontagem de uma hora de pedidos, também só com o índice
+        indice_particionado_concorrente(
+            'idx_adquiridos_criacao_totais', 'Adquiridos',
+            "(data_criacao_pedido) INCLUDE (status_compra, quantidade, total_pago)"
+        ),
+    ], transacional=False),
+
+    # Chave de PedidoTokens com as colunas do filtro de tokens_do_pedido (adquirido_id e rifa_id)
+    # na frente: com token_id no meio, o planejador preferia pedidotokens_token_id_key e filtrava
+    # o adquirido_id. adquirido_id continua primeiro para as buscas de vários pedidos sem a rifa
+    Migracao(6, "PedidoTokens: chave primária (adquirido_id, rifa_id, token_id)", [
+        "ALTER TABLE PedidoTokens DROP CONSTRAINT IF EXISTS pedidotokens_pkey;",
+        "ALTER TABLE PedidoTokens ADD PRIMARY KEY (adquirido_id, rifa_id, token_id);",
+        "ANALYZE PedidoTokens;",
+    ]),
+]
+
+
+def _executar_passo(cur, passo):
+    if callable(passo):
+        passo(cur)
+    else:
+        cur.execute(passo)
+
+
+def versoes_aplicadas(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaMigracoes (
+            versao INTEGER PRIMARY KEY,
+            descricao TEXT NOT NULL,
+            aplicada_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cur.execute("SELECT versao FROM SchemaMigracoes;")
+    return {row[0] for row in cur.fetchall()}
+
+
+def aplicar_migracoes(conn, alvo=None):
+    """Aplica, em ordem, as migrações ainda não registradas (até a versão `alvo`). Retorna as versões aplicadas."""
+    aplicadas = []
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s);", (CHAVE_LOCK_MIGRACOES,))
+        try:
+            ja_aplicadas = versoes_aplicadas(cur)
+            for migracao in MIGRACOES:
+                if migracao.versao in ja_aplicadas or (alvo is not None and migracao.versao > alvo):
+                    continue
+                print(f"Aplicando migração {migracao.versao}: {migracao.descricao}...")
+                if migracao.transacional:
+                    conn.autocommit = False
+                    try:
+                        for passo in migracao.passos:
+                            _executar_passo(cur, passo)
+                        cur.execute("INSERT INTO SchemaMigracoes (versao, descricao) VALUES (%s, %s);",
+                                    (migracao.versao, migracao.descricao))
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    finally:
+                        conn.autocommit = True
+                else:
+                    # Cada passo precisa ser idempotente: se um falhar, a migração roda de novo desde o início
+                    for passo in migracao.passos:
+                        _executar_passo(cur, passo)
+                    cur.execute("INSERT INTO SchemaMigracoes (versao, descricao) VALUES (%s, %s);",
+                                (migracao.versao, migracao.descricao))
+                aplicadas.append(migracao.versao)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (CHAVE_LOCK_MIGRACOES,))
+    return aplicadas
+
+
+# Consultas mais frequentes do app, com parâmetros de exemplo, o índice que cada uma deve usar
+# e a rifa a cuja partição ela deve ficar restrita (None nas que varrem todas as rifas)
+CONSULTAS_CRITICAS = [
+    ("reserva de tokens (reservas.py)",
+     "SELECT id, numero_token FROM Tokens WHERE rifa_id = %s AND disponivel = TRUE ORDER BY ordem_alocacao LIMIT %s;",
+     (1, 20), 'idx_tokens_ordem_alocacao_disponivel', 1),
+    ("contagem de tokens disponíveis (reservas.recalcular_contador)",
+     "SELECT COUNT(id) FROM Tokens WHERE rifa_id = %s AND disponivel = TRUE;",
+     (1,), 'idx_tokens_ordem_alocacao_disponivel', 1),
+    ("consulta do pedido (/payment_status, /success)",
+     "SELECT id, rifa_id, order_id_interno, status_compra, nome_cliente FROM Adquiridos WHERE order_id_interno = %s AND rifa_id = %s;",
+     ('SORTEIO-1-1234567', 1), 'idx_adquiridos_order_id_cobertura', 1),
+    ("tokens do pedido (pedidos.tokens_do_pedido)",
+     "SELECT token_id FROM PedidoTokens WHERE rifa_id = %s AND adquirido_id = %s;",
+     (1, 1), 'pedidotokens_pkey', 1),
+    ("tokens de vários pedidos (pedidos.tokens_dos_pedidos)",
+     "SELECT adquirido_id, token_id FROM PedidoTokens WHERE adquirido_id = ANY(%s);",
+     ([1, 2],), 'pedidotokens_pkey', None),
+    ("pedidos pendentes por idade (reconciliacao.py)",
+     "SELECT id FROM Adquiridos WHERE status_compra = 'pending' AND data_criacao_pedido < CURRENT_TIMESTAMP - make_interval(mins => %s) ORDER BY data_criacao_pedido LIMIT %s;",
+     (15, 1000), 'idx_adquiridos_pendentes_idade', None),
+    ("reservas vencidas (pedidos.liberar_reservas_expiradas)",
+     "SELECT id FROM Adquiridos WHERE reservado_ate < CURRENT_TIMESTAMP AND status_compra IN ('pending', 'rejected') ORDER BY reservado_ate LIMIT %s;",
+     (500,), 'idx_adquiridos_reservado_ate', None),
+    ("fila de notificações (notificacoes.py)",
+     "SELECT id FROM NotificacoesPendentes WHERE status = 'pendente' AND canal = %s AND proxima_tentativa <= CURRENT_TIMESTAMP ORDER BY proxima_tentativa LIMIT %s;",
+     ('email', 50), 'idx_notificacoes_pendentes_fila', None),
+]
+
+
+def _percorrer_plano(no, indices, tabelas):
+    if 'Index Name' in no:
+        indices.add(no['Index Name'])
+    if 'Relation Name' in no:
+        tabelas.add(no['Relation Name'])
+    for filho in no.get('Plans', []):
+        _percorrer_plano(filho, indices, tabelas)
+
+
+def _indices_pais(cur, indices):
+    """Os índices informados mais os índices das tabelas particionadas de que eles fazem parte."""
+    cur.execute("""
+        SELECT pai.relname
+        FROM pg_class filho
+        JOIN pg_inherits h ON h.inhrelid = filho.oid
+        JOIN pg_class pai ON pai.oid = h.inhparent
+        WHERE filho.relname = ANY(%s);
+    """, (list(indices),))
+    return set(indices) | {row[0] for row in cur.fetchall()}
+
+
+def verificar_planos(cur):
+    """EXPLAIN de cada consulta crítica. Retorna [(descrição, índice esperado, índices usados, tabelas lidas, ok)].
+
+    Com enable_seqscan desligado o planejador só recorre à varredura sequencial se nenhum índice
+    servir, então o teste mostra se o índice atende à consulta mesmo num banco pequeno, em que
+    a varredura sequencial seria a escolha natural. Nas consultas de uma rifa, confere também
+    que só a partição dela foi lida por cada tabela.
+    """
+    resultados = []
+    cur.execute("SET LOCAL enable_seqscan = off;")
+    for descricao, sql, parametros, esperado, rifa_id in CONSULTAS_CRITICAS:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, parametros)
+        plano = cur.fetchone()[0]
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+        indices, tabelas = set(), set()
+        _percorrer_plano(plano[0]['Plan'], indices, tabelas)
+        ok = esperado in _indices_pais(cur, indices)
+        if rifa_id is not None:
+            ok = ok and all(tabela.endswith(f"_rifa_{rifa_id}") for tabela in tabelas)
+        resultados.append((descricao, esperado, sorted(indices), sorted(tabelas), ok))
+    return resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aplica as migrações do esquema do banco.")
+    parser.add_argument('--alvo', type=int, default=None, help="Aplica só até esta versão")
+    parser.add_argument('--status', action='store_true', help="Lista as migrações aplicadas e pendentes")
+    parser.add_argument('--verificar', action='store_true', help="Confere se as consultas críticas usam os índices")
+    args = parser.parse_args(argv)
+
+    if not DATABASE_URL:
+        print("Erro: A variável de ambiente POSTGRES_URL não está definida.")
+        return 1
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        if args.status:
+            with conn.cursor() as cur:
+                aplicadas = versoes_aplicadas(cur)
+            conn.commit()
+            for migracao in MIGRACOES:
+                marca = 'aplicada' if migracao.versao in aplicadas else 'PENDENTE'
+                print(f"{migracao.versao:>4}  {marca:<9} {migracao.descricao}")
+            return 0
+        if args.verificar:
+            with conn.cursor() as cur:
+                resultados = verificar_planos(cur)
+            conn.rollback()
+            for descricao, esperado, usados, tabelas, ok in resultados:
+                print(f"{'OK   ' if ok else 'FALHA'} {descricao}: esperado {esperado}, usados {usados or 'nenhum (seq scan)'}, tabelas {tabelas}")
+            return 0 if all(ok for *_, ok in resultados) else 1
+        aplicadas = aplicar_migracoes(conn, args.alvo)
+        print(f"Migrações aplicadas: {aplicadas}" if aplicadas else "Esquema já está atualizado.")
+        return 0
+    except psycopg2.Error as e:
+        print(f"Erro do Psycopg2 ao migrar o esquema: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
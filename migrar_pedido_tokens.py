@@ -0,0 +1,85 @@
+import os
+import psycopg2
+from dotenv import load_dotenv
+
+# Carrega as variáveis de ambiente do arquivo .env
+load_dotenv()
+
+DATABASE_URL = os.getenv('POSTGRES_URL')
+
+def migrar_pedido_tokens():
+    """Copia os tokens gravados como texto (Adquiridos.tokens_ids_db) para a tabela PedidoTokens.
+
+    A conversão é feita em um único INSERT ... SELECT com unnest(string_to_array(...)), sem
+    trazer os pedidos para o Python. Pedidos rejeitados são ignorados (seus tokens foram
+    liberados) e pedidos já migrados não são duplicados, então o script pode ser rodado de novo.
+    As colunas antigas são mantidas como estão.
+    """
+    conn = None
+    cur = None
+    try:
+        if not DATABASE_URL:
+            print("Erro: A variável de ambiente POSTGRES_URL não está definida.")
+            return
+
+        conn = psycopg2.connect(DATABASE_URL)
+        cur = conn.cursor()
+
+        cur.execute("""
+            SELECT COUNT(*) FROM Adquiridos a
+            WHERE a.tokens_ids_db IS NOT NULL AND a.tokens_ids_db <> ''
+              AND a.status_compra <> 'rejected'
+              AND NOT EXISTS (SELECT 1 FROM PedidoTokens pt WHERE pt.adquirido_id = a.id);
+        """)
+        pedidos = cur.fetchone()[0]
+        print(f"{pedidos} pedidos com tokens em texto ainda não migrados.")
+
+        cur.execute("""
+            INSERT INTO PedidoTokens (rifa_id, adquirido_id, token_id)
+            SELECT a.rifa_id, a.id, btrim(token_id)::integer
+            FROM Adquiridos a
+            CROSS JOIN LATERAL unnest(string_to_array(a.tokens_ids_db, ',')) AS token_id
+            WHERE a.tokens_ids_db IS NOT NULL AND a.tokens_ids_db <> ''
+              AND a.status_compra <> 'rejected'
+              AND btrim(token_id) <> ''
+              AND NOT EXISTS (SELECT 1 FROM PedidoTokens pt WHERE pt.adquirido_id = a.id)
+            ORDER BY (a.status_compra = 'approved') DESC, a.id
+            ON CONFLICT (token_id, rifa_id) DO NOTHING;
+        """)
+        vinculados = cur.rowcount
+        print(f"{vinculados} vínculos pedido/token criados.")
+
+        # Tokens que já estavam em outro pedido (atribuição dupla do modelo antigo) ficam de fora
+        cur.execute("""
+            SELECT a.order_id_interno, a.status_compra,
+                   cardinality(string_to_array(a.tokens_ids_db, ',')) AS esperados,
+                   COUNT(pt.token_id) AS migrados
+            FROM Adquiridos a
+            LEFT JOIN PedidoTokens pt ON pt.adquirido_id = a.id
+            WHERE a.tokens_ids_db IS NOT NULL AND a.tokens_ids_db <> '' AND a.status_compra <> 'rejected'
+            GROUP BY a.id
+            HAVING COUNT(pt.token_id) < cardinality(string_to_array(a.tokens_ids_db, ','));
+        """)
+        conflitos = cur.fetchall()
+        for order_id, status, esperados, migrados in conflitos:
+            print(f"Aviso: pedido {order_id} ({status}) tem {esperados} tokens em texto, mas só {migrados} puderam ser vinculados (tokens já atribuídos a outro pedido).")
+
+        conn.commit()
+        print("Migração comitada com sucesso.")
+
+    except psycopg2.Error as e:
+        print(f"Erro do Psycopg2 ao migrar tokens dos pedidos: {e}")
+        if conn:
+            conn.rollback()
+            print("Rollback da transação realizado.")
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+            print("Conexão com o banco de dados fechada.")
+
+if __name__ == '__main__':
+    print("Iniciando migração dos tokens em texto para a tabela PedidoTokens...")
+    migrar_pedido_tokens()
+    print("Migração finalizada.")
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import logging
+import smtplib
+import threading
+from contextlib import ExitStack
+
+import psycopg2.extras
+
+from db import transacao
+
+# Fila durável (outbox) de notificações de saída: e-mails e mensagens do Discord.
+#
+# O webhook grava os trabalhos em NotificacoesPendentes na mesma transação que muda o status
+# do pedido; threads em segundo plano (no próprio worker web ou em um processo separado,
+# `python worker.py`) retiram lotes da fila com FOR UPDATE SKIP LOCKED e os enviam.
+# Cada trabalho retirado recebe um "aluguel": se o processo morrer durante o envio, ele volta
+# a ficar visível quando o aluguel expira. Falhas são reagendadas com backoff exponencial.
+
+CANAL_EMAIL = 'email'
+CANAL_DISCORD = 'discord'
+CANAL_RESUMO_ADMIN = 'resumo_admin'  # Confirmações agregadas em um único e-mail periódico para o admin
+CANAL_ESTORNO = 'estorno'  # Devolução no Mercado Pago de pagamentos aprovados depois do congelamento do sorteio
+
+NOTIFICACOES_LOTE = 20
+NOTIFICACOES_MAX_TENTATIVAS = 8
+NOTIFICACOES_INTERVALO = 2.0      # Espera (s) quando a fila está vazia
+NOTIFICACOES_ALUGUEL = 120        # Segundos que um lote retirado fica invisível para outros consumidores
+NOTIFICACOES_BACKOFF_BASE = 5     # 5s, 10s, 20s, ... até NOTIFICACOES_BACKOFF_MAX
+NOTIFICACOES_BACKOFF_MAX = 1800
+
+# Envios simultâneos por canal (threads consumidoras por processo)
+LIMITES_PADRAO = {CANAL_EMAIL: 2, CANAL_DISCORD: 1, CANAL_RESUMO_ADMIN: 1, CANAL_ESTORNO: 1}
+
+SMTP_OCIOSO_MAX = 60  # Conexão SMTP parada há mais tempo que isso é testada com NOOP antes do próximo lote
+# Erros que indicam conexão SMTP perdida (e não problema da mensagem em si)
+ERROS_CONEXAO_SMTP = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def enfileirar(cur, canal, payload, janela=None):
+    """Grava um trabalho de notificação na transação de `cur`; ele só fica visível após o commit.
+
+    Com `janela` (segundos), o trabalho só vence no próximo múltiplo de `janela`: todos os
+    trabalhos da mesma janela vencem juntos e saem no mesmo lote.
+    """
+    if janela:
+        cur.execute(
+            """
+            INSERT INTO NotificacoesPendentes (canal, payload, proxima_tentativa)
+            VALUES (%s, %s, to_timestamp(ceil(extract(epoch FROM CURRENT_TIMESTAMP) / %s) * %s));
+            """,
+            (canal, json.dumps(payload), janela, janela)
+        )
+    else:
+        cur.execute(
+            "INSERT INTO NotificacoesPendentes (canal, payload) VALUES (%s, %s);",
+            (canal, json.dumps(payload))
+        )
+
+
+def enfileirar_email(cur, assunto, destinatarios, corpo):
+    enfileirar(cur, CANAL_EMAIL, {'assunto': assunto, 'destinatarios': destinatarios, 'corpo': corpo})
+
+
+def enfileirar_discord(cur, mensagem, cor=None):
+    enfileirar(cur, CANAL_DISCORD, {'mensagem': mensagem, 'cor': cor})
+
+
+def enfileirar_resumo_admin(cur, linha, janela):
+    enfileirar(cur, CANAL_RESUMO_ADMIN, {'linha': linha}, janela=janela)
+
+
+def enfileirar_estorno(cur, payment_id_mp, order_id_interno, rifa_id):
+    enfileirar(cur, CANAL_ESTORNO, {'payment_id': str(payment_id_mp), 'order_id': order_id_interno, 'rifa_id': rifa_id})
+
+
+class ConexaoSMTPPersistente:
+    """Reaproveita conexões SMTP do Flask-Mail entre mensagens e entre lotes.
+
+    Cada thread consumidora mantém a sua conexão aberta; se ela cair (ou não responder ao NOOP
+    depois de um tempo ociosa) é reaberta e o envio é repetido uma vez. Deve ser usada dentro
+    de um app context.
+    """
+
+    def __init__(self, mail, ocioso_max=SMTP_OCIOSO_MAX):
+        self.mail = mail
+        self.ocioso_max = ocioso_max
+        self._local = threading.local()
+
+    def _abrir(self):
+        pilha = ExitStack()
+        self._local.conexao = pilha.enter_context(self.mail.connect())
+        self._local.pilha = pilha
+        self._local.ultimo_uso = time.monotonic()
+        logging.info("📧 Conexão SMTP aberta.")
+
+    def fechar(self):
+        pilha = getattr(self._local, 'pilha', None)
+        self._local.pilha = None
+        self._local.conexao = None
+        if pilha:
+            try:
+                pilha.close()
+            except Exception:
+                pass  # A conexão já pode ter sido encerrada pelo servidor
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is not None and time.monotonic() - self._local.ultimo_uso > self.ocioso_max:
+            try:
+                saudavel = not conexao.host or conexao.host.noop()[0] == 250
+            except OSError:
+                saudavel = False
+            if not saudavel:
+                self.fechar()
+                conexao = None
+        if conexao is None:
+            self._abrir()
+        return self._local.conexao
+
+    def enviar_lote(self, mensagens):
+        """Envia as mensagens pela mesma conexão. Retorna None ou o erro de cada mensagem."""
+        resultados = []
+        for mensagem in mensagens:
+            try:
+                try:
+                    self._conexao().send(mensagem)
+                except ERROS_CONEXAO_SMTP:
+                    # Conexão perdida: reabre e tenta de novo uma vez
+                    self.fechar()
+                    self._conexao().send(mensagem)
+                resultados.append(None)
+            except Exception as e:
+                logging.error(f"❌ Erro ao enviar e-mail '{mensagem.subject}': {e}")
+                if isinstance(e, ERROS_CONEXAO_SMTP):
+                    self.fechar()
+                resultados.append(e)
+            self._local.ultimo_uso = time.monotonic()
+        return resultados
+
+
+def _backoff(tentativas):
+    return min(NOTIFICACOES_BACKOFF_BASE * (2 ** (tentativas - 1)), NOTIFICACOES_BACKOFF_MAX)
+
+
+def retirar_lote(canal, tamanho=NOTIFICACOES_LOTE):
+    """Retira até `tamanho` trabalhos vencidos do canal, marcando-os com um aluguel. Retorna [(id, payload, tentativas)]."""
+    with transacao() as cur:
+        cur.execute("""
+            WITH lote AS (
+                SELECT id FROM NotificacoesPendentes
+                WHERE status = 'pendente' AND canal = %s AND proxima_tentativa <= CURRENT_TIMESTAMP
+                ORDER BY proxima_tentativa
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE NotificacoesPendentes n
+            SET tentativas = n.tentativas + 1,
+                proxima_tentativa = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            FROM lote
+            WHERE n.id = lote.id
+            RETURNING n.id, n.payload, n.tentativas;
+        """, (canal, tamanho, NOTIFICACOES_ALUGUEL))
+        return [(row['id'], row['payload'], row['tentativas']) for row in cur.fetchall()]
+
+
+def registrar_resultados(trabalhos, erros):
+    """Marca como enviados os trabalhos sem erro e reagenda (ou desiste de) os que falharam.
+
+    `erros` mapeia id do trabalho -> mensagem de erro.
+    """
+    enviados = [id_trabalho for id_trabalho, _, _ in trabalhos if id_trabalho not in erros]
+    falhas = []
+    for id_trabalho, _, tentativas in trabalhos:
+        if id_trabalho in erros:
+            desistir = tentativas >= NOTIFICACOES_MAX_TENTATIVAS
+            falhas.append((id_trabalho, 'falhou' if desistir else 'pendente', _backoff(tentativas), str(erros[id_trabalho])[:1000]))
+    with transacao() as cur:
+        if enviados:
+            cur.execute(
+                "UPDATE NotificacoesPendentes SET status = 'enviada', enviado_em = CURRENT_TIMESTAMP, erro = NULL WHERE id = ANY(%s);",
+                (enviados,)
+            )
+        if falhas:
+            psycopg2.extras.execute_values(cur, """
+                UPDATE NotificacoesPendentes n
+                SET status = f.status, erro = f.erro,
+                    proxima_tentativa = CURRENT_TIMESTAMP + make_interval(secs => f.espera)
+                FROM (VALUES %s) AS f (id, status, espera, erro)
+                WHERE n.id = f.id;
+            """, falhas, template="(%s, %s, %s::integer, %s)")
+    for id_trabalho, status, espera, erro in falhas:
+        if status == 'falhou':
+            logging.error(f"❌ Notificação {id_trabalho} descartada após {NOTIFICACOES_MAX_TENTATIVAS} tentativas: {erro}")
+        else:
+            logging.warning(f"⚠️ Notificação {id_trabalho} falhou ({erro}); nova tentativa em {espera}s.")
+    return len(enviados), len(falhas)
+
+
+class ConsumidorNotificacoes:
+    """Threads que drenam a fila de notificações, com concorrência limitada por canal.
+
+    `despachantes` mapeia canal -> função que recebe uma lista de payloads e retorna uma
+    lista de mesmo tamanho com None (sucesso) ou a exceção/mensagem de erro de cada envio.
+    """
+
+    def __init__(self, despachantes, limites=None, lote=NOTIFICACOES_LOTE, lotes=None):
+        self.despachantes = despachantes
+        self.limites = limites or LIMITES_PADRAO
+        self.lote = lote
+        self.lotes = lotes or {}  # Tamanho de lote específico por canal
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._threads = []
+
+    def iniciar(self):
+        for canal in self.despachantes:
+            for n in range(max(1, self.limites.get(canal, 1))):
+                thread = threading.Thread(
+                    target=self._loop_canal, args=(canal,),
+                    name=f"notificacoes-{canal}-{n}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logging.info(f"📬 Consumidor de notificações iniciado (pid {os.getpid()}, {len(self._threads)} threads).")
+
+    def acordar(self):
+        """Avisa as threads de que há trabalho novo, sem esperar o próximo intervalo."""
+        self._acordar.set()
+
+    def parar(self, timeout=5.0):
+        self._parar.set()
+        self._acordar.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def processar_lote(self, canal):
+        """Retira, envia e registra um lote do canal. Retorna quantos trabalhos foram retirados."""
+        trabalhos = retirar_lote(canal, self.lotes.get(canal, self.lote))
+        if not trabalhos:
+            return 0
+        try:
+            resultados = self.despachantes[canal]([payload for _, payload, _ in trabalhos])
+        except Exception as e:
+            resultados = [e] * len(trabalhos)
+        erros = {
+            id_trabalho: resultado
+            for (id_trabalho, _, _), resultado in zip(trabalhos, resultados)
+            if resultado is not None
+        }
+        enviados, falhas = registrar_resultados(trabalhos, erros)
+        logging.info(f"📬 Lote de {canal}: {enviados} enviadas, {falhas} com falha.")
+        return len(trabalhos)
+
+    def _loop_canal(self, canal):
+        while not self._parar.is_set():
+            try:
+                retirados = self.processar_lote(canal)
+            except Exception as e:
+                logging.error(f"❌ Erro no consumidor de notificações ({canal}): {e}")
+                retirados = 0
+            if retirados < self.lotes.get(canal, self.lote):
+                self._acordar.wait(NOTIFICACOES_INTERVALO)
+                self._acordar.clear()
+
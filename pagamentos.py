@@ -0,0 +1,260 @@
+import os
+import logging
+
+from db import transacao
+from reservas import reservar_tokens
+from pedidos import vincular_tokens, tokens_do_pedido, marcar_tokens_vendidos, desvincular_tokens
+from notificacoes import enfileirar_email, enfileirar_discord, enfileirar_resumo_admin, enfileirar_estorno
+from eventos_pedidos import notificar_status
+from metricas import medir
+from rifas import carregar_rifa, rifa_em_cache, rifa_do_pedido
+from sorteio import sorteio_congelado
+
+# Aplicação dos pagamentos do Mercado Pago aos pedidos.
+#
+# Usada pelo app (processamento dos webhooks, ver processamento_webhook.py) e pela reconciliação
+# (reconciliacao.py), que roda em processo separado: este módulo não depende do Flask nem cria
+# o app, então importá-lo não inicia consumidores nem lê a configuração do site.
+# As variáveis de ambiente (MP_ACCESS_TOKEN, MAIL_DEFAULT_SENDER, EMAIL_ADMIN_RESUMO_INTERVALO)
+# são lidas na utilização, depois do load_dotenv() de quem importa.
+
+# Pedidos pagos depois do congelamento do sorteio da rifa: estorno solicitado e estorno concluído
+STATUS_ESTORNO = ('refund_pending', 'refunded')
+
+
+def intervalo_resumo_admin():
+    """Segundos de cada e-mail de resumo das confirmações para o admin (0 = um e-mail por pedido)."""
+    return int(os.getenv('EMAIL_ADMIN_RESUMO_INTERVALO', '0'))
+
+
+def get_mp_sdk():
+    """SDK do Mercado Pago do processo, ou None (com erro no log) se MP_ACCESS_TOKEN não estiver configurado."""
+    access_token = os.getenv('MP_ACCESS_TOKEN')
+    if not access_token:
+        logging.error('❌ MP_ACCESS_TOKEN não configurado!')
+        return None
+    try:
+        # Instância única por processo, com sessão HTTP keep-alive e timeouts (ver mercadopago_cliente.py).
+        # Importado aqui para que o SDK só seja carregado pelos processos que falam com o Mercado Pago
+        from mercadopago_cliente import obter_sdk
+        return obter_sdk(access_token)
+    except Exception as e:
+        logging.error(f'❌ Erro ao inicializar Mercado Pago SDK: {e}')
+        return None
+
+
+def enfileirar_avisos_aprovacao(cur, compra, numeros_pedido, payment_id_mp):
+    """Enfileira o e-mail do cliente, o aviso ao admin e o Discord de uma compra aprovada."""
+    nome_rifa = rifa_em_cache(compra['rifa_id'], lambda rifa_id: carregar_rifa(cur, rifa_id))['nome']
+    enfileirar_email(
+        cur,
+        f"Detalhes da sua Compra Confirmada - {nome_rifa}",
+        [compra['email_cliente']],
+        (
+            f"Prezado(a) {compra['nome_cliente']},\n\n"
+            f"Seu pagamento foi CONFIRMADO com sucesso!\nObrigado por participar do nosso sorteio!\n\n"
+            f"Aqui estão os detalhes da sua compra:\n"
+            f"Nome: {compra['nome_cliente']}\n"
+            f"Email: {compra['email_cliente']}\n"
+            f"CPF: {compra['cpf_cliente']}\n"
+            f"Telefone: {compra['telefone_cliente']}\n"
+            f"Quantidade de números da sorte: {compra['quantidade']}\n"
+            f"Seus números da sorte: {numeros_pedido}\n\n"
+            f"Boa sorte!\n"
+        )
+    )
+    corpo_admin = (
+        f"COMPRA CONFIRMADA!\n\n"
+        f"Sorteio: {nome_rifa}\n"
+        f"Cliente: {compra['nome_cliente']}\n"
+        f"Email do Cliente: {compra['email_cliente']}\n"
+        f"CPF: {compra['cpf_cliente']}\n"
+        f"Telefone: {compra['telefone_cliente']}\n"
+        f"Quantidade de números comprados: {compra['quantidade']}\n"
+        f"Tokens Atribuídos: {numeros_pedido}\n"
+        f"Status do Pagamento (MP): APROVADO\n"
+        f"ID do Pagamento (MP): {payment_id_mp}\n"
+    )
+    intervalo = intervalo_resumo_admin()
+    if intervalo:
+        enfileirar_resumo_admin(cur, corpo_admin, intervalo)
+    else:
+        enfileirar_email(
+            cur,
+            f"✅ Compra Confirmada - {nome_rifa} - {compra['nome_cliente']}",
+            [os.getenv('MAIL_DEFAULT_SENDER')],
+            corpo_admin
+        )
+    enfileirar_discord(
+        cur,
+        f"🎉 COMPRA CONFIRMADA! 🎉\nSorteio: **{nome_rifa}**\nCliente: **{compra['nome_cliente']}** ({compra['email_cliente']})\nComprou: **{compra['quantidade']}** números\nTotal: **R${compra['total_pago']:.2f}**\nTokens: `{numeros_pedido}`\nStatus MP: APROVADO\nID Pagamento MP: `{payment_id_mp}`",
+        cor=3066993
+    )
+
+
+def enfileirar_aviso_rejeicao(cur, compra, payment_id_mp):
+    enfileirar_discord(
+        cur,
+        f"💔 PAGAMENTO REJEITADO! 💔\nCliente: **{compra['nome_cliente']}** ({compra['email_cliente']})\nTentou comprar: **{compra['quantidade']}** números\nTotal: **R${compra['total_pago']:.2f}**\nStatus MP: REJEITADO\nID Pagamento MP: `{payment_id_mp}`",
+        cor=15158332
+    )
+
+
+def enfileirar_aviso_estorno(cur, compra, payment_id_mp, esgotado=False):
+    """Avisa o cliente e o admin de um pagamento aprovado que será estornado.
+
+    O motivo é o congelamento do sorteio ou, com `esgotado`, a falta de números para
+    completar um pedido cuja reserva expirou antes da aprovação.
+    """
+    if esgotado:
+        motivo = "depois que a reserva dos números expirou, e não há mais números disponíveis para completá-lo"
+        titulo = "PAGAMENTO SEM NÚMEROS DISPONÍVEIS"
+    else:
+        motivo = "depois que os números do sorteio já haviam sido fechados"
+        titulo = "PAGAMENTO APÓS O CONGELAMENTO DO SORTEIO"
+    enfileirar_email(
+        cur,
+        "Seu pagamento será estornado",
+        [compra['email_cliente']],
+        (
+            f"Prezado(a) {compra['nome_cliente']},\n\n"
+            f"Seu pagamento do pedido {compra['order_id_interno']} foi confirmado {motivo}, "
+            f"então a compra não pôde ser concluída.\n"
+            f"O valor de R${compra['total_pago']:.2f} será devolvido pelo Mercado Pago na mesma forma de pagamento.\n"
+        )
+    )
+    enfileirar_discord(
+        cur,
+        f"↩️ {titulo} ↩️\nCliente: **{compra['nome_cliente']}** ({compra['email_cliente']})\nPedido: `{compra['order_id_interno']}`\nTotal: **R${compra['total_pago']:.2f}**\nEstorno solicitado ao Mercado Pago\nID Pagamento MP: `{payment_id_mp}`",
+        cor=15105570
+    )
+
+
+def despachar_estornos(payloads):
+    """Despachante do canal de estornos da fila de notificações (ver notificacoes.py).
+
+    Devolve no Mercado Pago os pagamentos aprovados que não puderam virar compra (ver
+    aplicar_pagamento) e marca os pedidos como estornados.
+    """
+    sdk = get_mp_sdk()
+    if not sdk:
+        return [RuntimeError("SDK Mercado Pago não configurado.")] * len(payloads)
+    resultados = []
+    for payload in payloads:
+        try:
+            with medir('mp_estornar_pagamento'):
+                resposta = sdk.refund().create(payload['payment_id'])
+            if resposta.get('status') not in (200, 201):
+                raise RuntimeError(f"Mercado Pago respondeu {resposta.get('status')} ao estornar o pagamento {payload['payment_id']}")
+            with transacao() as cur:
+                cur.execute("""
+                    UPDATE Adquiridos SET status_compra = 'refunded', data_ultima_atualizacao = CURRENT_TIMESTAMP
+                    WHERE rifa_id = %s AND order_id_interno = %s AND status_compra = 'refund_pending';
+                """, (payload['rifa_id'], payload['order_id']))
+                notificar_status(cur, payload['order_id'], 'refunded')
+            logging.info(f"↩️ Pagamento {payload['payment_id']} do pedido {payload['order_id']} estornado.")
+            resultados.append(None)
+        except Exception as e:
+            logging.error(f"❌ Erro ao estornar o pagamento {payload['payment_id']} do pedido {payload['order_id']}: {e}")
+            resultados.append(e)
+    return resultados
+
+
+def _completar_reserva(cur, compra):
+    """Garante ao pedido os números que ele pagou, reservando novos se a reserva foi desfeita.
+
+    Retorna False se não houver números disponíveis suficientes; os que foram reservados ficam
+    vinculados ao pedido e são devolvidos junto com os demais por desvincular_tokens().
+    """
+    rifa_id = compra['rifa_id']
+    faltantes = compra['quantidade'] - len(tokens_do_pedido(cur, rifa_id, compra['id']))
+    if faltantes <= 0:
+        return True
+    # A reserva foi desfeita antes da aprovação (rejeição/expiração): completa com novos números aleatórios
+    novos_tokens = reservar_tokens(cur, rifa_id, faltantes)
+    vincular_tokens(cur, rifa_id, compra['id'], [row['id'] for row in novos_tokens])
+    return len(novos_tokens) == faltantes
+
+
+def _solicitar_estorno(cur, compra, payment_id_mp, esgotado=False):
+    """Marca o pedido para estorno, devolve os números dele e agenda o estorno e os avisos."""
+    rifa_id = compra['rifa_id']
+    cur.execute("""
+        UPDATE Adquiridos SET status_compra = 'refund_pending', payment_id_mp = %s, data_ultima_atualizacao = CURRENT_TIMESTAMP
+        WHERE rifa_id = %s AND id = %s;
+    """, (str(payment_id_mp), rifa_id, compra['id']))
+    notificar_status(cur, compra['order_id_interno'], 'refund_pending')
+    desvincular_tokens(cur, rifa_id, compra['id'])
+    enfileirar_estorno(cur, payment_id_mp, compra['order_id_interno'], rifa_id)
+    enfileirar_aviso_estorno(cur, compra, payment_id_mp, esgotado)
+
+
+def aplicar_pagamento(cur, pagamento):
+    """Aplica ao pedido o status de um pagamento do Mercado Pago, na transação de `cur`.
+
+    Usada pelo processamento dos webhooks e pela reconciliação (ver reconciliacao.py).
+    Retorna (order_id_interno, status do pagamento).
+    """
+    payment_status = pagamento.get("status")
+    external_reference = pagamento.get("external_reference")
+    payment_id_mp = pagamento.get("id")
+    cur.execute(
+        "SELECT * FROM Adquiridos WHERE order_id_interno = %s AND rifa_id = %s FOR UPDATE;",
+        (external_reference, rifa_do_pedido(external_reference))
+    )
+    compra = cur.fetchone()
+    if not compra:
+        logging.warning(f"⚠️ Pedido não encontrado para external_reference '{external_reference}' no banco.")
+        return external_reference, payment_status
+    status_anterior = compra['status_compra']
+    rifa_id = compra['rifa_id']
+    if payment_status == 'approved':
+        if status_anterior in STATUS_ESTORNO:
+            logging.info(f"ℹ️ Pagamento APROVADO para Order ID: {external_reference}, mas o estorno já foi solicitado.")
+        elif status_anterior != 'approved' and sorteio_congelado(cur, rifa_id):
+            # Os números vendidos já foram congelados para o sorteio: a compra não pode mais entrar nele
+            logging.warning(f"↩️ Pagamento APROVADO para Order ID: {external_reference} depois do congelamento do sorteio da rifa {rifa_id}. Solicitando estorno.")
+            _solicitar_estorno(cur, compra, payment_id_mp)
+        elif status_anterior != 'approved' and not _completar_reserva(cur, compra):
+            # Não há como entregar todos os números pagos: a compra não é aprovada pela metade
+            logging.error(f"❌ Pagamento APROVADO para Order ID: {external_reference}, mas não há tokens disponíveis para completar a reserva. Solicitando estorno.")
+            _solicitar_estorno(cur, compra, payment_id_mp, esgotado=True)
+        elif status_anterior != 'approved':
+            logging.info(f"✅ Pagamento APROVADO para Order ID: {external_reference}. Processando compra.")
+            # Atualiza status e payment_id_mp
+            cur.execute("""
+                UPDATE Adquiridos SET status_compra = 'approved', payment_id_mp = %s, reservado_ate = NULL, data_ultima_atualizacao = CURRENT_TIMESTAMP
+                WHERE rifa_id = %s AND id = %s;
+            """, (str(payment_id_mp), rifa_id, compra['id']))
+            notificar_status(cur, external_reference, 'approved')
+            # Marca tokens como usados
+            marcar_tokens_vendidos(cur, rifa_id, compra['id'])
+            numeros_pedido = tokens_do_pedido(cur, rifa_id, compra['id'])
+            # E-mails e Discord vão para a fila na mesma transação da mudança de status
+            enfileirar_avisos_aprovacao(cur, compra, ','.join(numeros_pedido), payment_id_mp)
+        else:
+            logging.info(f"ℹ️ Pagamento APROVADO para Order ID: {external_reference}, mas já processado anteriormente.")
+    elif payment_status == 'rejected':
+        if status_anterior != 'rejected':
+            logging.warning(f"❌ Pagamento REJEITADO para Order ID: {external_reference}.")
+            cur.execute("""
+                UPDATE Adquiridos SET status_compra = 'rejected', payment_id_mp = %s, data_ultima_atualizacao = CURRENT_TIMESTAMP
+                WHERE rifa_id = %s AND id = %s;
+            """, (str(payment_id_mp), rifa_id, compra['id']))
+            notificar_status(cur, external_reference, 'rejected')
+            if status_anterior == 'pending':
+                # Devolve os números reservados para venda
+                liberados = desvincular_tokens(cur, rifa_id, compra['id'])
+                logging.info(f"🔓 {liberados} tokens do pedido {external_reference} liberados após rejeição.")
+            enfileirar_aviso_rejeicao(cur, compra, payment_id_mp)
+        else:
+            logging.info(f"ℹ️ Pagamento REJEITADO para Order ID: {external_reference}, mas já processado anteriormente.")
+    elif payment_status == 'pending':
+        if status_anterior != 'pending':
+            cur.execute("""
+                UPDATE Adquiridos SET status_compra = 'pending', payment_id_mp = %s, data_ultima_atualizacao = CURRENT_TIMESTAMP
+                WHERE rifa_id = %s AND id = %s;
+            """, (str(payment_id_mp), rifa_id, compra['id']))
+            notificar_status(cur, external_reference, 'pending')
+            logging.info(f"⏳ Pagamento PENDENTE para Order ID: {external_reference}. Status atualizado.")
+    return external_reference, payment_status
@@ -0,0 +1,176 @@
+import time
+import logging
+import threading
+
+import psycopg2.extras
+
+from db import transacao
+from reservas import liberar_tokens, liberar_tokens_por_rifa, ajustar_contador
+from eventos_pedidos import notificar_status_em_lote
+
+# Relação pedido <-> token (tabela PedidoTokens).
+#
+# Cada token reservado ou vendido tem exatamente uma linha apontando para o pedido (Adquiridos)
+# que o detém; token_id é UNIQUE, então o próprio banco impede que um número seja atribuído
+# a dois pedidos. Quando uma reserva é desfeita a linha é apagada e o token volta a ficar livre.
+#
+# Pedidos pendentes seguram seus tokens até Adquiridos.reservado_ate. Aprovação ou rejeição
+# encerram a reserva (reservado_ate = NULL); o VarredorReservas libera as que vencerem antes.
+#
+# As três tabelas são particionadas por rifa (ver rifas.py); as funções de um pedido recebem
+# o rifa_id dele para que cada consulta toque só a partição da rifa.
+
+
+def vincular_tokens(cur, rifa_id, adquirido_id, token_ids):
+    """Associa os tokens ao pedido com um único INSERT em lote."""
+    if not token_ids:
+        return
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO PedidoTokens (rifa_id, adquirido_id, token_id) VALUES %s;",
+        [(rifa_id, adquirido_id, int(token_id)) for token_id in token_ids],
+        page_size=1000
+    )
+
+
+def tokens_do_pedido(cur, rifa_id, adquirido_id):
+    """Números dos tokens do pedido, em ordem."""
+    cur.execute("""
+        SELECT t.numero_token
+        FROM PedidoTokens pt
+        JOIN Tokens t ON t.rifa_id = pt.rifa_id AND t.id = pt.token_id
+        WHERE pt.rifa_id = %s AND pt.adquirido_id = %s
+        ORDER BY t.numero_token;
+    """, (rifa_id, adquirido_id))
+    return [row[0] for row in cur.fetchall()]
+
+
+def tokens_dos_pedidos(cur, adquirido_ids):
+    """Números de vários pedidos (de qualquer rifa) em uma única consulta: {adquirido_id: [números em ordem]}."""
+    if not adquirido_ids:
+        return {}
+    cur.execute("""
+        SELECT pt.adquirido_id, array_agg(t.numero_token ORDER BY t.numero_token)
+        FROM PedidoTokens pt
+        JOIN Tokens t ON t.rifa_id = pt.rifa_id AND t.id = pt.token_id
+        WHERE pt.adquirido_id = ANY(%s)
+        GROUP BY pt.adquirido_id;
+    """, (list(adquirido_ids),))
+    return {row[0]: list(row[1]) for row in cur.fetchall()}
+
+
+def dono_do_token(cur, rifa_id, numero_token):
+    """Pedido que detém o número informado na rifa (ou None se ele estiver livre)."""
+    cur.execute("""
+        SELECT a.id, a.order_id_interno, a.nome_cliente, a.email_cliente, a.status_compra
+        FROM Tokens t
+        JOIN PedidoTokens pt ON pt.rifa_id = t.rifa_id AND pt.token_id = t.id
+        JOIN Adquiridos a ON a.rifa_id = pt.rifa_id AND a.id = pt.adquirido_id
+        WHERE t.rifa_id = %s AND t.numero_token = %s;
+    """, (rifa_id, numero_token))
+    return cur.fetchone()
+
+
+def marcar_tokens_vendidos(cur, rifa_id, adquirido_id):
+    """Garante todos os tokens do pedido como indisponíveis, em um único UPDATE ... FROM.
+
+    Retorna quantos tokens ainda estavam marcados como disponíveis.
+    """
+    cur.execute("""
+        UPDATE Tokens t SET disponivel = FALSE
+        FROM PedidoTokens pt
+        WHERE t.rifa_id = %s AND pt.rifa_id = %s AND pt.adquirido_id = %s
+          AND pt.token_id = t.id AND t.disponivel = TRUE;
+    """, (rifa_id, rifa_id, adquirido_id))
+    marcados = cur.rowcount
+    ajustar_contador(cur, rifa_id, -marcados)
+    return marcados
+
+
+def desvincular_tokens(cur, rifa_id, adquirido_id):
+    """Desfaz a reserva do pedido: apaga os vínculos e devolve os tokens ao conjunto disponível."""
+    cur.execute("UPDATE Adquiridos SET reservado_ate = NULL WHERE rifa_id = %s AND id = %s;", (rifa_id, adquirido_id))
+    cur.execute("DELETE FROM PedidoTokens WHERE rifa_id = %s AND adquirido_id = %s RETURNING token_id;", (rifa_id, adquirido_id))
+    token_ids = [row[0] for row in cur.fetchall()]
+    return liberar_tokens(cur, rifa_id, token_ids)
+
+
+def liberar_reservas_expiradas(cur, lote=500):
+    """Libera um lote de reservas vencidas (pedidos pendentes/rejeitados com reservado_ate no passado).
+
+    Percorre o índice parcial de Adquiridos.reservado_ate (um por partição), então o custo é
+    proporcional às reservas vencidas e não ao total de pedidos. Retorna (pedidos, tokens liberados).
+    """
+    cur.execute("""
+        WITH vencidos AS (
+            SELECT rifa_id, id FROM Adquiridos
+            WHERE reservado_ate < CURRENT_TIMESTAMP AND status_compra IN ('pending', 'rejected')
+            ORDER BY reservado_ate
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE Adquiridos a
+        SET status_compra = CASE WHEN a.status_compra = 'pending' THEN 'expired' ELSE a.status_compra END,
+            reservado_ate = NULL,
+            data_ultima_atualizacao = CURRENT_TIMESTAMP
+        FROM vencidos
+        WHERE a.rifa_id = vencidos.rifa_id AND a.id = vencidos.id
+        RETURNING a.id, a.order_id_interno, a.status_compra;
+    """, (lote,))
+    vencidos = cur.fetchall()
+    if not vencidos:
+        return 0, 0
+    pedido_ids = [row[0] for row in vencidos]
+    notificar_status_em_lote(cur, [row[1] for row in vencidos if row[2] == 'expired'], 'expired')
+    cur.execute("DELETE FROM PedidoTokens WHERE adquirido_id = ANY(%s) RETURNING rifa_id, token_id;", (pedido_ids,))
+    return len(pedido_ids), liberar_tokens_por_rifa(cur, cur.fetchall())
+
+
+class VarredorReservas:
+    """Thread que libera periodicamente as reservas vencidas, em lotes de uma transação cada."""
+
+    def __init__(self, intervalo=60.0, lote=500):
+        self.intervalo = intervalo
+        self.lote = lote
+        self.ultima_execucao = {'pedidos': 0, 'tokens': 0, 'duracao_ms': 0.0, 'quando': None}
+        self.total = {'execucoes': 0, 'pedidos': 0, 'tokens': 0}
+        self._parar = threading.Event()
+        self._thread = None
+
+    def executar(self):
+        """Libera todas as reservas vencidas no momento. Retorna (pedidos, tokens)."""
+        inicio = time.monotonic()
+        pedidos = tokens = 0
+        while True:
+            with transacao() as cur:
+                pedidos_lote, tokens_lote = liberar_reservas_expiradas(cur, self.lote)
+            pedidos += pedidos_lote
+            tokens += tokens_lote
+            if pedidos_lote < self.lote:
+                break
+        self.ultima_execucao = {
+            'pedidos': pedidos, 'tokens': tokens,
+            'duracao_ms': (time.monotonic() - inicio) * 1000, 'quando': time.time(),
+        }
+        self.total['execucoes'] += 1
+        self.total['pedidos'] += pedidos
+        self.total['tokens'] += tokens
+        if pedidos:
+            logging.info(f"🧹 {pedidos} reservas vencidas liberadas ({tokens} tokens devolvidos).")
+        return pedidos, tokens
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._loop, name="varredor-reservas", daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout=5.0):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.executar()
+            except Exception as e:
+                logging.error(f"❌ Erro ao liberar reservas vencidas: {e}")
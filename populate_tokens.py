@@ -1,15 +1,61 @@
 import os
 import csv
+import time
+import argparse
 import psycopg2
 from dotenv import load_dotenv
+from reservas import ajustar_contador
 
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
 
 DATABASE_URL = os.getenv('POSTGRES_URL')
 
-def populate_tokens_from_csv(caminho_csv='tokens.csv'):
-    """Lê tokens de um arquivo CSV e os insere na tabela Tokens do banco de dados."""
+TAMANHO_LOTE_PADRAO = 50000
+
+def ler_tokens_csv(caminho_csv, pular_linhas=0):
+    """Lê o CSV linha a linha, gerando (número da linha, token). Linhas até `pular_linhas` são ignoradas."""
+    with open(caminho_csv, mode='r', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, None) # Pula o cabeçalho, ex: "Token"
+        if not header or header[0].strip().lower() != 'token':
+            print(f"Aviso: O cabeçalho esperado 'Token' não foi encontrado no CSV. O cabeçalho encontrado foi: {header}")
+            # Continuamos assumindo que a primeira coluna é o token.
+
+        for row_number, row in enumerate(reader, start=2): # start=2 por causa do cabeçalho
+            if row_number <= pular_linhas:
+                continue
+            if row and row[0].strip(): # Garante que a linha e o token não estão vazios
+                yield row_number, row[0].strip()
+            else:
+                print(f"Aviso: Linha {row_number} do CSV está vazia ou token inválido e será ignorada.")
+                yield row_number, None
+
+def em_lotes(linhas, tamanho_lote):
+    """Agrupa (linha, token) em lotes de até `tamanho_lote` linhas. Gera (última linha, tokens)."""
+    tokens = []
+    ultima_linha = None
+    contadas = 0
+    for ultima_linha, token in linhas:
+        contadas += 1
+        if token:
+            tokens.append(token)
+        if contadas >= tamanho_lote:
+            yield ultima_linha, tokens
+            tokens = []
+            contadas = 0
+    if contadas:
+        yield ultima_linha, tokens
+
+def populate_tokens_from_csv(caminho_csv='tokens.csv', tamanho_lote=TAMANHO_LOTE_PADRAO, recomecar=False, rifa_id=1):
+    """Lê tokens de um arquivo CSV e os insere na tabela Tokens do banco de dados, na rifa `rifa_id`.
+
+    O arquivo é lido em streaming e gravado em lotes de `tamanho_lote` linhas, cada um na sua
+    própria transação; a memória usada não depende do tamanho do arquivo. Junto com cada lote
+    é gravado um checkpoint (CargasTokens) com a última linha processada, então uma carga
+    interrompida continua de onde parou ao rodar o script de novo (use recomecar=True para
+    ler o arquivo desde o início).
+    """
     conn = None
     cur = None
     try:
@@ -17,51 +63,75 @@ def populate_tokens_from_csv(caminho_csv='tokens.csv'):
             print("Erro: A variável de ambiente POSTGRES_URL não está definida.")
             return
 
+        if not os.path.exists(caminho_csv):
+            print(f"Erro Crítico: Arquivo CSV '{caminho_csv}' não encontrado.")
+            return
+
         conn = psycopg2.connect(DATABASE_URL)
         cur = conn.cursor()
 
-        tokens_para_inserir = []
-        try:
-            with open(caminho_csv, mode='r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                header = next(reader) # Pula o cabeçalho, ex: "Token"
-                if not header or header[0].strip().lower() != 'token':
-                    print(f"Aviso: O cabeçalho esperado 'Token' não foi encontrado no CSV. O cabeçalho encontrado foi: {header}")
-                    # Decide se quer continuar ou parar. Por agora, vamos continuar assumindo que a primeira coluna é o token.
-                
-                for row_number, row in enumerate(reader, start=2): # start=2 por causa do cabeçalho
-                    if row and row[0].strip(): # Garante que a linha e o token não estão vazios
-                        tokens_para_inserir.append((row[0].strip(),)) # Adiciona como tupla para executemany
-                    else:
-                        print(f"Aviso: Linha {row_number} do CSV está vazia ou token inválido e será ignorada.")
-        
-        except FileNotFoundError:
-            print(f"Erro Crítico: Arquivo CSV '{caminho_csv}' não encontrado.")
-            return
-        except Exception as e_csv:
-            print(f"Erro ao ler o arquivo CSV '{caminho_csv}': {e_csv}")
-            return
+        # Checkpoint identificado pelo caminho e tamanho do arquivo e pela rifa de destino
+        arquivo = f"{os.path.abspath(caminho_csv)}:{os.path.getsize(caminho_csv)}:rifa{rifa_id}"
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS CargasTokens (
+                arquivo TEXT PRIMARY KEY,
+                ultima_linha BIGINT NOT NULL,
+                atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        if recomecar:
+            cur.execute("DELETE FROM CargasTokens WHERE arquivo = %s;", (arquivo,))
+        cur.execute("SELECT ultima_linha FROM CargasTokens WHERE arquivo = %s;", (arquivo,))
+        checkpoint = cur.fetchone()
+        pular_linhas = checkpoint[0] if checkpoint else 0
+        conn.commit()
+        if pular_linhas:
+            print(f"Retomando carga de '{caminho_csv}' após a linha {pular_linhas}.")
+
+        # ON CONFLICT (rifa_id, numero_token) DO NOTHING evita erros se você tentar inserir tokens duplicados
+        # e garante que tokens já existentes não sejam alterados (mantendo seu estado 'disponivel')
+        insert_query = """
+            INSERT INTO Tokens (rifa_id, numero_token, disponivel)
+            SELECT %s, unnest(%s::varchar[]), TRUE
+            ON CONFLICT (rifa_id, numero_token) DO NOTHING;
+        """
 
-        if not tokens_para_inserir:
+        inicio = time.monotonic()
+        lidos = 0
+        inseridos_total = 0
+        for ultima_linha, tokens in em_lotes(ler_tokens_csv(caminho_csv, pular_linhas), tamanho_lote):
+            if tokens:
+                cur.execute(insert_query, (rifa_id, tokens))
+                inseridos = cur.rowcount
+                # Mantém o contador de disponíveis em dia na mesma transação
+                ajustar_contador(cur, rifa_id, inseridos)
+            else:
+                inseridos = 0
+            cur.execute("""
+                INSERT INTO CargasTokens (arquivo, ultima_linha) VALUES (%s, %s)
+                ON CONFLICT (arquivo) DO UPDATE SET ultima_linha = EXCLUDED.ultima_linha, atualizado_em = CURRENT_TIMESTAMP;
+            """, (arquivo, ultima_linha))
+            conn.commit()
+
+            lidos += len(tokens)
+            inseridos_total += inseridos
+            decorrido = time.monotonic() - inicio
+            print(f"  Linha {ultima_linha}: {lidos} tokens lidos, {inseridos_total} novos ({lidos / max(decorrido, 1e-9):,.0f} tokens/s).")
+
+        if not lidos:
             print("Nenhum token válido encontrado no CSV para inserir.")
             return
 
-        # Usar executemany para inserção em lote é mais eficiente
-        # ON CONFLICT (numero_token) DO NOTHING evita erros se você tentar inserir tokens duplicados
-        # e garante que tokens já existentes não sejam alterados (mantendo seu estado 'disponivel')
-        insert_query = "INSERT INTO Tokens (numero_token, disponivel) VALUES (%s, TRUE) ON CONFLICT (numero_token) DO NOTHING"
-        
-        cur.executemany(insert_query, tokens_para_inserir)
-        conn.commit()
-        
-        print(f"{cur.rowcount} novos tokens foram inseridos na tabela 'Tokens' a partir de '{caminho_csv}'.")
-        if cur.rowcount < len(tokens_para_inserir):
-            print(f"{len(tokens_para_inserir) - cur.rowcount} tokens do CSV já existiam no banco de dados e não foram alterados.")
+        decorrido = time.monotonic() - inicio
+        print(f"{inseridos_total} novos tokens foram inseridos na tabela 'Tokens' a partir de '{caminho_csv}' em {decorrido:.1f}s.")
+        if inseridos_total < lidos:
+            print(f"{lidos - inseridos_total} tokens do CSV já existiam no banco de dados e não foram alterados.")
 
     except psycopg2.Error as e_db:
         print(f"Erro do Psycopg2 ao popular tokens: {e_db}")
         if conn:
             conn.rollback()
+            print("Lotes já comitados foram mantidos; rode o script novamente para continuar a carga.")
     except Exception as e_general:
         print(f"Um erro geral ocorreu ao popular tokens: {e_general}")
         if conn:
@@ -74,8 +144,12 @@ def populate_tokens_from_csv(caminho_csv='tokens.csv'):
             print("Conexão com o banco de dados fechada.")
 
 if __name__ == '__main__':
-    print(f"Iniciando script para popular a tabela Tokens a partir do arquivo 'tokens.csv'...")
-    # Certifique-se que o arquivo 'tokens.csv' está na mesma pasta que este script,
-    # ou ajuste o caminho em populate_tokens_from_csv('caminho/correto/para/tokens.csv')
-    populate_tokens_from_csv('tokens.csv') #
-    print("Script para popular tokens finalizado.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Popula a tabela Tokens a partir de um arquivo CSV.")
+    parser.add_argument('caminho_csv', nargs='?', default='tokens.csv')
+    parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO, help="Linhas por transação")
+    parser.add_argument('--recomecar', action='store_true', help="Ignora o checkpoint e lê o arquivo desde o início")
+    parser.add_argument('--rifa', type=int, default=1, help="Rifa que recebe os tokens (ver rifas.py)")
+    args = parser.parse_args()
+    print(f"Iniciando script para popular a tabela Tokens a partir do arquivo '{args.caminho_csv}'...")
+    populate_tokens_from_csv(args.caminho_csv, tamanho_lote=args.lote, recomecar=args.recomecar, rifa_id=args.rifa)
+    print("Script para popular tokens finalizado.")
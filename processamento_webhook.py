@@ -0,0 +1,151 @@
+import os
+import logging
+import threading
+
+from db import transacao
+
+# Ingestão idempotente das notificações do Mercado Pago.
+#
+# O webhook só registra (topic, resource_id) em WebhooksRecebidos e responde 200 na hora.
+# Entregas repetidas do mesmo pagamento caem na mesma linha (ON CONFLICT) e apenas incrementam
+# `entregas`, então uma rajada de retentativas vira um único processamento. Quando o pagamento
+# já tem status terminal registrado, novas entregas nem voltam para a fila: não há consulta
+# à API nem SELECT ... FOR UPDATE em Adquiridos.
+# Threads em segundo plano retiram as linhas pendentes (FOR UPDATE SKIP LOCKED, com aluguel)
+# e chamam a função de processamento do app.
+
+STATUS_TERMINAIS = ('approved', 'rejected', 'cancelled', 'refunded', 'charged_back')
+
+WEBHOOKS_LOTE = 10
+WEBHOOKS_INTERVALO = 1.0
+WEBHOOKS_ALUGUEL = 60
+WEBHOOKS_MAX_TENTATIVAS = 10
+WEBHOOKS_BACKOFF_BASE = 5
+WEBHOOKS_BACKOFF_MAX = 900
+
+
+def registrar_notificacao(cur, topic, resource_id):
+    """Registra uma entrega do webhook. Retorna True se ela gerou trabalho novo na fila."""
+    cur.execute("""
+        INSERT INTO WebhooksRecebidos (topic, resource_id)
+        VALUES (%s, %s)
+        ON CONFLICT (topic, resource_id) DO UPDATE
+        SET entregas = WebhooksRecebidos.entregas + 1,
+            ultima_entrega = CURRENT_TIMESTAMP,
+            status = CASE
+                WHEN WebhooksRecebidos.status_pagamento = ANY(%s) THEN WebhooksRecebidos.status
+                ELSE 'pendente'
+            END,
+            tentativas = CASE
+                WHEN WebhooksRecebidos.status IN ('processado', 'falhou') THEN 0
+                ELSE WebhooksRecebidos.tentativas
+            END
+        RETURNING status, entregas;
+    """, (topic, str(resource_id), list(STATUS_TERMINAIS)))
+    status, entregas = cur.fetchone()
+    if status != 'pendente':
+        logging.info(f"ℹ️ Notificação {topic}/{resource_id} repetida (entrega {entregas}); pagamento já em status final.")
+    return status == 'pendente'
+
+
+def retirar_lote(tamanho=WEBHOOKS_LOTE):
+    """Retira notificações pendentes vencidas, com aluguel. Retorna [(topic, resource_id, entregas, tentativas)]."""
+    with transacao() as cur:
+        cur.execute("""
+            WITH lote AS (
+                SELECT topic, resource_id FROM WebhooksRecebidos
+                WHERE status = 'pendente' AND proxima_tentativa <= CURRENT_TIMESTAMP
+                ORDER BY proxima_tentativa
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE WebhooksRecebidos w
+            SET tentativas = w.tentativas + 1,
+                proxima_tentativa = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            FROM lote
+            WHERE w.topic = lote.topic AND w.resource_id = lote.resource_id
+            RETURNING w.topic, w.resource_id, w.entregas, w.tentativas;
+        """, (tamanho, WEBHOOKS_ALUGUEL))
+        return [tuple(row) for row in cur.fetchall()]
+
+
+def concluir(topic, resource_id, entregas, order_id_interno, status_pagamento):
+    """Marca a notificação como processada. Se chegou outra entrega durante o processamento
+    e o pagamento ainda não está em status final, ela volta para a fila."""
+    with transacao() as cur:
+        cur.execute("""
+            UPDATE WebhooksRecebidos
+            SET order_id_interno = %s, status_pagamento = %s, ultimo_erro = NULL,
+                processado_em = CURRENT_TIMESTAMP,
+                status = CASE WHEN entregas = %s OR %s = ANY(%s) THEN 'processado' ELSE 'pendente' END,
+                proxima_tentativa = CURRENT_TIMESTAMP
+            WHERE topic = %s AND resource_id = %s;
+        """, (order_id_interno, status_pagamento, entregas, status_pagamento, list(STATUS_TERMINAIS), topic, resource_id))
+
+
+def reagendar(topic, resource_id, tentativas, erro):
+    desistir = tentativas >= WEBHOOKS_MAX_TENTATIVAS
+    espera = min(WEBHOOKS_BACKOFF_BASE * (2 ** (tentativas - 1)), WEBHOOKS_BACKOFF_MAX)
+    with transacao() as cur:
+        cur.execute("""
+            UPDATE WebhooksRecebidos
+            SET status = %s, ultimo_erro = %s, proxima_tentativa = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE topic = %s AND resource_id = %s;
+        """, ('falhou' if desistir else 'pendente', str(erro)[:1000], espera, topic, resource_id))
+    if desistir:
+        logging.error(f"❌ Notificação {topic}/{resource_id} descartada após {tentativas} tentativas: {erro}")
+    else:
+        logging.warning(f"⚠️ Falha ao processar notificação {topic}/{resource_id} ({erro}); nova tentativa em {espera}s.")
+
+
+class ConsumidorWebhooks:
+    """Threads que processam as notificações pendentes.
+
+    `processar(topic, resource_id)` deve retornar (order_id_interno, status_pagamento) e
+    lançar exceção em caso de falha (a notificação é reagendada com backoff).
+    """
+
+    def __init__(self, processar, threads=2, lote=WEBHOOKS_LOTE):
+        self.processar = processar
+        self.num_threads = threads
+        self.lote = lote
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._threads = []
+
+    def iniciar(self):
+        for n in range(max(1, self.num_threads)):
+            thread = threading.Thread(target=self._loop, name=f"webhooks-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"🔔 Consumidor de webhooks iniciado (pid {os.getpid()}, {len(self._threads)} threads).")
+
+    def acordar(self):
+        self._acordar.set()
+
+    def parar(self, timeout=5.0):
+        self._parar.set()
+        self._acordar.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def processar_lote(self):
+        trabalhos = retirar_lote(self.lote)
+        for topic, resource_id, entregas, tentativas in trabalhos:
+            try:
+                order_id_interno, status_pagamento = self.processar(topic, resource_id)
+                concluir(topic, resource_id, entregas, order_id_interno, status_pagamento)
+            except Exception as e:
+                reagendar(topic, resource_id, tentativas, e)
+        return len(trabalhos)
+
+    def _loop(self):
+        while not self._parar.is_set():
+            try:
+                retirados = self.processar_lote()
+            except Exception as e:
+                logging.error(f"❌ Erro no consumidor de webhooks: {e}")
+                retirados = 0
+            if retirados < self.lote:
+                self._acordar.wait(WEBHOOKS_INTERVALO)
+                self._acordar.clear()
@@ -0,0 +1,254 @@
+import sys
+import time
+import logging
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from db import transacao
+from reservas import liberar_tokens_por_rifa, ajustar_contador
+from pedidos import tokens_dos_pedidos
+from eventos_pedidos import notificar_status_em_lote
+from sorteio import sorteio_congelado
+from pagamentos import get_mp_sdk, aplicar_pagamento, enfileirar_avisos_aprovacao, enfileirar_aviso_rejeicao
+
+# Reconciliação dos pedidos com o Mercado Pago, para quando um webhook se perde.
+#
+# Em vez de um payment().get() e uma transação por pedido, busca de uma vez todos os
+# pagamentos criados no período dos pedidos em aberto (/v1/payments/search, paginado, em
+# janelas de tempo consultadas em paralelo com concorrência limitada) e aplica as mudanças
+# em lotes: um UPDATE para todas as aprovações do lote, outro para as rejeições, e assim por
+# diante. Casos que precisam de tratamento individual (ex.: pedido já expirado que foi pago,
+# cujos números precisam ser completados, ou pago depois do congelamento do sorteio, que é
+# estornado) passam por aplicar_pagamento(), como nos webhooks.
+#
+# Uso (processo separado, ex.: agendado a cada 15 minutos):
+#     python reconciliacao.py --idade 15 --expirados-horas 48
+#     python reconciliacao.py --repetir 900
+
+STATUS_REJEITADOS = ('rejected', 'cancelled')
+STATUS_EM_ANDAMENTO = ('pending', 'in_process', 'authorized', 'in_mediation')
+
+RECONCILIACAO_PAGINA = 100
+RECONCILIACAO_CONCORRENCIA = 4
+RECONCILIACAO_JANELA_HORAS = 6
+RECONCILIACAO_LOTE = 200
+
+
+def pedidos_para_reconciliar(cur, idade_minutos, expirados_horas, limite):
+    """Pedidos pendentes há mais de `idade_minutos` e expirados nas últimas `expirados_horas` (até `limite` de cada)."""
+    # Um ramo por status, para que os pendentes venham do índice parcial idx_adquiridos_pendentes_idade
+    # (ver migracoes.py), mais antigos primeiro
+    cur.execute("""
+        (SELECT id, order_id_interno, status_compra, data_criacao_pedido::timestamptz AS criado_em
+         FROM Adquiridos
+         WHERE status_compra = 'pending' AND data_criacao_pedido < CURRENT_TIMESTAMP - make_interval(mins => %s)
+         ORDER BY data_criacao_pedido
+         LIMIT %s)
+        UNION ALL
+        (SELECT id, order_id_interno, status_compra, data_criacao_pedido::timestamptz AS criado_em
+         FROM Adquiridos
+         WHERE status_compra = 'expired' AND data_ultima_atualizacao > CURRENT_TIMESTAMP - make_interval(hours => %s)
+         ORDER BY data_ultima_atualizacao DESC
+         LIMIT %s);
+    """, (idade_minutos, limite, expirados_horas, limite))
+    return cur.fetchall()
+
+
+def janelas(inicio, fim, horas):
+    """Divide [inicio, fim] em intervalos consecutivos de até `horas` horas."""
+    passo = timedelta(hours=horas)
+    while inicio < fim:
+        proximo = min(inicio + passo, fim)
+        yield inicio, proximo
+        inicio = proximo
+
+
+def buscar_pagamentos_janela(sdk, inicio, fim, tamanho_pagina=RECONCILIACAO_PAGINA):
+    """Todos os pagamentos criados em [inicio, fim], percorrendo as páginas da busca."""
+    pagamentos = []
+    offset = 0
+    while True:
+        resposta = sdk.payment().search({
+            'range': 'date_created',
+            'begin_date': inicio.isoformat(timespec='milliseconds'),
+            'end_date': fim.isoformat(timespec='milliseconds'),
+            'sort': 'date_created',
+            'criteria': 'asc',
+            'offset': offset,
+            'limit': tamanho_pagina,
+        })
+        if resposta.get('status') != 200:
+            raise RuntimeError(f"Mercado Pago respondeu {resposta.get('status')} à busca de pagamentos ({inicio} a {fim}).")
+        pagina = resposta['response']
+        resultados = pagina.get('results', [])
+        pagamentos.extend(resultados)
+        offset += len(resultados)
+        if not resultados or offset >= pagina.get('paging', {}).get('total', 0):
+            return pagamentos
+
+
+def buscar_pagamentos(sdk, inicio, fim, referencias, concorrencia=RECONCILIACAO_CONCORRENCIA,
+                      janela_horas=RECONCILIACAO_JANELA_HORAS):
+    """Pagamentos dos pedidos em `referencias` criados no período: {external_reference: [pagamentos]}."""
+    por_referencia = {}
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        for pagamentos in executor.map(lambda j: buscar_pagamentos_janela(sdk, *j), list(janelas(inicio, fim, janela_horas))):
+            for pagamento in pagamentos:
+                referencia = pagamento.get('external_reference')
+                if referencia in referencias:
+                    por_referencia.setdefault(referencia, []).append(pagamento)
+    return por_referencia
+
+
+def escolher_pagamento(pagamentos):
+    """O pagamento que decide o status do pedido: um aprovado, senão um rejeitado/cancelado.
+
+    Retorna None enquanto houver pagamento em andamento sem nenhum aprovado (nada a fazer ainda).
+    """
+    aprovados = [p for p in pagamentos if p.get('status') == 'approved']
+    if aprovados:
+        return aprovados[0]
+    if any(p.get('status') in STATUS_EM_ANDAMENTO for p in pagamentos):
+        return None
+    rejeitados = [p for p in pagamentos if p.get('status') in STATUS_REJEITADOS]
+    return rejeitados[-1] if rejeitados else None
+
+
+def aplicar_lote(cur, decisoes):
+    """Aplica as decisões {adquirido_id: pagamento} de um lote. Retorna a contagem por resultado."""
+    ids = sorted(decisoes)
+    # Trava os pedidos do lote em ordem de id (evita deadlock com os webhooks) e relê o status
+    cur.execute("SELECT * FROM Adquiridos WHERE id = ANY(%s) ORDER BY id FOR UPDATE;", (ids,))
+    compras = {row['id']: row for row in cur.fetchall()}
+    cur.execute("SELECT adquirido_id, count(*) FROM PedidoTokens WHERE adquirido_id = ANY(%s) GROUP BY adquirido_id;", (ids,))
+    vinculados = dict(cur.fetchall())
+
+    # Aprovações de rifas com o sorteio já congelado viram estorno, em aplicar_pagamento()
+    rifas_aprovadas = {compras[i]['rifa_id'] for i in compras if decisoes[i].get('status') == 'approved'}
+    congeladas = {rifa_id for rifa_id in sorted(rifas_aprovadas) if sorteio_congelado(cur, rifa_id)}
+
+    aprovar, rejeitar, individuais = [], [], []
+    for adquirido_id in ids:
+        compra, pagamento = compras.get(adquirido_id), decisoes[adquirido_id]
+        if compra is None:
+            continue
+        status = pagamento.get('status')
+        if (compra['status_compra'] == 'pending' and status == 'approved' and compra['rifa_id'] not in congeladas
+                and vinculados.get(adquirido_id, 0) == compra['quantidade']):
+            aprovar.append((compra, pagamento))
+        elif compra['status_compra'] == 'pending' and status in STATUS_REJEITADOS:
+            rejeitar.append((compra, pagamento))
+        elif status == 'approved' and compra['status_compra'] != 'approved':
+            individuais.append(pagamento)
+
+    if aprovar:
+        aprovados_ids = [c['id'] for c, _ in aprovar]
+        cur.execute("""
+            UPDATE Adquiridos a SET status_compra = 'approved', payment_id_mp = v.payment_id,
+                   reservado_ate = NULL, data_ultima_atualizacao = CURRENT_TIMESTAMP
+            FROM unnest(%s::int[], %s::text[]) AS v(id, payment_id)
+            WHERE a.id = v.id;
+        """, (aprovados_ids, [str(p.get('id')) for _, p in aprovar]))
+        cur.execute("""
+            UPDATE Tokens t SET disponivel = FALSE
+            FROM PedidoTokens pt
+            WHERE pt.rifa_id = t.rifa_id AND pt.token_id = t.id AND pt.adquirido_id = ANY(%s) AND t.disponivel = TRUE
+            RETURNING t.rifa_id;
+        """, (aprovados_ids,))
+        for rifa_id, marcados in Counter(row[0] for row in cur.fetchall()).items():
+            ajustar_contador(cur, rifa_id, -marcados)
+        notificar_status_em_lote(cur, [c['order_id_interno'] for c, _ in aprovar], 'approved')
+        numeros = tokens_dos_pedidos(cur, aprovados_ids)
+        for compra, pagamento in aprovar:
+            enfileirar_avisos_aprovacao(cur, compra, ','.join(numeros.get(compra['id'], [])), pagamento.get('id'))
+
+    if rejeitar:
+        rejeitados_ids = [c['id'] for c, _ in rejeitar]
+        cur.execute("""
+            UPDATE Adquiridos a SET status_compra = 'rejected', payment_id_mp = v.payment_id,
+                   reservado_ate = NULL, data_ultima_atualizacao = CURRENT_TIMESTAMP
+            FROM unnest(%s::int[], %s::text[]) AS v(id, payment_id)
+            WHERE a.id = v.id;
+        """, (rejeitados_ids, [str(p.get('id')) for _, p in rejeitar]))
+        cur.execute("DELETE FROM PedidoTokens WHERE adquirido_id = ANY(%s) RETURNING rifa_id, token_id;", (rejeitados_ids,))
+        liberar_tokens_por_rifa(cur, cur.fetchall())
+        notificar_status_em_lote(cur, [c['order_id_interno'] for c, _ in rejeitar], 'rejected')
+        for compra, pagamento in rejeitar:
+            enfileirar_aviso_rejeicao(cur, compra, pagamento.get('id'))
+
+    for pagamento in individuais:
+        aplicar_pagamento(cur, pagamento)
+
+    return {'aprovados': len(aprovar), 'rejeitados': len(rejeitar), 'individuais': len(individuais)}
+
+
+def reconciliar(idade_minutos=15, expirados_horas=48, limite=20000, lote=RECONCILIACAO_LOTE,
+                concorrencia=RECONCILIACAO_CONCORRENCIA, janela_horas=RECONCILIACAO_JANELA_HORAS):
+    """Executa uma rodada de reconciliação. Retorna um resumo com as contagens."""
+    inicio_execucao = time.monotonic()
+    with transacao() as cur:
+        pedidos = pedidos_para_reconciliar(cur, idade_minutos, expirados_horas, limite)
+    resumo = {'pedidos': len(pedidos), 'com_pagamento': 0, 'aprovados': 0, 'rejeitados': 0, 'individuais': 0}
+    if not pedidos:
+        return resumo
+
+    sdk = get_mp_sdk()
+    if not sdk:
+        raise RuntimeError("SDK Mercado Pago não configurado.")
+    # Margem para diferença de relógio entre o banco e o Mercado Pago
+    inicio = min(p['criado_em'] for p in pedidos) - timedelta(minutes=5)
+    fim = datetime.now(timezone.utc)
+    ids_por_referencia = {p['order_id_interno']: p['id'] for p in pedidos}
+    pagamentos = buscar_pagamentos(sdk, inicio, fim, ids_por_referencia, concorrencia, janela_horas)
+    resumo['com_pagamento'] = len(pagamentos)
+
+    decisoes = {}
+    for referencia, pagamentos_pedido in pagamentos.items():
+        pagamento = escolher_pagamento(pagamentos_pedido)
+        if pagamento:
+            decisoes[ids_por_referencia[referencia]] = pagamento
+    ids = sorted(decisoes)
+    for i in range(0, len(ids), lote):
+        with transacao() as cur:
+            contagem = aplicar_lote(cur, {adquirido_id: decisoes[adquirido_id] for adquirido_id in ids[i:i + lote]})
+        for chave, valor in contagem.items():
+            resumo[chave] += valor
+
+    resumo['duracao_s'] = round(time.monotonic() - inicio_execucao, 2)
+    logging.info(f"🔄 Reconciliação: {resumo}")
+    return resumo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcilia pedidos em aberto com os pagamentos do Mercado Pago.")
+    parser.add_argument('--idade', type=int, default=15, help="Minutos para um pedido pendente ser verificado")
+    parser.add_argument('--expirados-horas', type=int, default=48, help="Também verifica pedidos expirados nesse período")
+    parser.add_argument('--limite', type=int, default=20000, help="Máximo de pedidos pendentes (e de expirados) por rodada")
+    parser.add_argument('--lote', type=int, default=RECONCILIACAO_LOTE, help="Pedidos por transação")
+    parser.add_argument('--concorrencia', type=int, default=RECONCILIACAO_CONCORRENCIA, help="Buscas simultâneas no Mercado Pago")
+    parser.add_argument('--janela-horas', type=int, default=RECONCILIACAO_JANELA_HORAS, help="Tamanho de cada janela de busca")
+    parser.add_argument('--repetir', type=float, default=0, help="Repete a cada N segundos (0 = uma rodada só)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    from logs import configurar_logs
+    load_dotenv()
+    configurar_logs()
+
+    while True:
+        try:
+            resumo = reconciliar(args.idade, args.expirados_horas, args.limite, args.lote, args.concorrencia, args.janela_horas)
+            print(f"Reconciliação concluída: {resumo}")
+        except Exception as e:
+            logging.error(f"❌ Erro na reconciliação: {e}")
+            if not args.repetir:
+                return 1
+        if not args.repetir:
+            return 0
+        time.sleep(args.repetir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
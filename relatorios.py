@@ -0,0 +1,302 @@
+import io
+import os
+import csv
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from db import transacao
+
+# Relatórios de vendas.
+#
+# Exportação: pedidos ou números vendidos de uma rifa em CSV ou JSONL, lidos por um cursor do
+# lado do servidor (itersize linhas por ida ao banco) e entregues em pedaços de EXPORTACAO_LOTE
+# linhas. A memória usada não depende do tamanho da rifa, e os números vêm de PedidoTokens,
+# sem interpretar as strings de tokens_numeros_db.
+#
+# Agregados: VendasPorHora guarda, por rifa, hora de criação do pedido e status, a quantidade
+# de pedidos, de números e o valor. Cada atualização só recalcula as horas que têm pedidos
+# alterados desde a anterior (pelo índice de data_ultima_atualizacao, ver migracoes.py), então o
+# painel lê poucas linhas já somadas em vez de percorrer Adquiridos. As linhas de uma rifa
+# arquivada continuam na tabela depois que as partições dela saem de Adquiridos.
+#
+# Uso:
+#     python relatorios.py exportar --rifa 1 --tipo numeros --formato csv --saida vendidos.csv
+#     python relatorios.py atualizar [--completo]
+
+EXPORTACAO_LOTE = 2000
+CHAVE_LOCK_RELATORIOS = 7261002  # pg_try_advisory_xact_lock: um atualizador por vez entre os processos
+RELATORIO_VENDAS = 'vendas_por_hora'
+
+# Pedidos são gravados em transações curtas, mas com data_ultima_atualizacao = início da transação;
+# a margem cobre os que começaram antes da última atualização e só foram confirmados depois dela
+MARGEM_ATUALIZACAO = timedelta(minutes=5)
+
+EXPORTACOES = {
+    'pedidos': (
+        ('id', 'order_id', 'status', 'nome', 'email', 'telefone', 'quantidade', 'total_pago',
+         'payment_id_mp', 'criado_em', 'atualizado_em', 'numeros'),
+        """
+        SELECT a.id, a.order_id_interno, a.status_compra, a.nome_cliente, a.email_cliente, a.telefone_cliente,
+               a.quantidade, a.total_pago, a.payment_id_mp, a.data_criacao_pedido, a.data_ultima_atualizacao,
+               (SELECT string_agg(t.numero_token, ' ' ORDER BY t.numero_token)
+                FROM PedidoTokens pt JOIN Tokens t ON t.rifa_id = pt.rifa_id AND t.id = pt.token_id
+                WHERE pt.rifa_id = a.rifa_id AND pt.adquirido_id = a.id)
+        FROM Adquiridos a
+        WHERE a.rifa_id = %(rifa_id)s AND (%(status)s IS NULL OR a.status_compra = %(status)s)
+        ORDER BY a.id;
+        """,
+    ),
+    'numeros': (
+        ('numero', 'order_id', 'status', 'nome', 'email', 'criado_em'),
+        """
+        SELECT t.numero_token, a.order_id_interno, a.status_compra, a.nome_cliente, a.email_cliente, a.data_criacao_pedido
+        FROM PedidoTokens pt
+        JOIN Adquiridos a ON a.rifa_id = pt.rifa_id AND a.id = pt.adquirido_id
+        JOIN Tokens t ON t.rifa_id = pt.rifa_id AND t.id = pt.token_id
+        WHERE pt.rifa_id = %(rifa_id)s AND a.status_compra = COALESCE(%(status)s, 'approved')
+        ORDER BY t.numero_token;
+        """,
+    ),
+}
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def _valor_json(valor):
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+
+def _em_csv(cur, colunas):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(colunas)
+    for n, linha in enumerate(cur, 1):
+        escritor.writerow(linha)
+        if n % EXPORTACAO_LOTE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _em_jsonl(cur, colunas):
+    pedaco = []
+    for linha in cur:
+        pedaco.append(json.dumps(dict(zip(colunas, linha)), default=_valor_json, ensure_ascii=False))
+        if len(pedaco) == EXPORTACAO_LOTE:
+            yield '\n'.join(pedaco) + '\n'
+            pedaco = []
+    if pedaco:
+        yield '\n'.join(pedaco) + '\n'
+
+
+def exportar(conn, rifa_id, tipo, formato, status=None):
+    """Gera a exportação `tipo` da rifa no `formato` pedido, em pedaços de texto.
+
+    Usa um cursor nomeado (do lado do servidor) na transação corrente de `conn`, que fica
+    ocupada até o gerador terminar; o chamador encerra a transação depois.
+    """
+    colunas, sql = EXPORTACOES[tipo]
+    cur = conn.cursor(name=f"exportacao_{tipo}")
+    cur.itersize = EXPORTACAO_LOTE
+    try:
+        cur.execute(sql, {'rifa_id': rifa_id, 'status': status})
+        yield from (_em_csv if formato == 'csv' else _em_jsonl)(cur, colunas)
+    finally:
+        cur.close()
+
+
+def atualizar_vendas_por_hora(cur, completo=False):
+    """Recalcula as horas de VendasPorHora com pedidos alterados desde a última atualização.
+
+    Sem atualização anterior (ou com `completo`), refaz as linhas de todas as rifas não
+    arquivadas. Retorna a quantidade de horas recalculadas, ou None se outro processo já
+    estiver atualizando.
+    """
+    cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (CHAVE_LOCK_RELATORIOS,))
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute("SELECT atualizado_ate FROM RelatoriosAtualizacao WHERE relatorio = %s;", (RELATORIO_VENDAS,))
+    linha = cur.fetchone()
+
+    if completo or not linha:
+        cur.execute("DELETE FROM VendasPorHora WHERE rifa_id IN (SELECT id FROM Rifas WHERE status <> 'arquivada');")
+        cur.execute("""
+            INSERT INTO VendasPorHora (rifa_id, hora, status_compra, pedidos, tokens, valor)
+            SELECT rifa_id, date_trunc('hour', data_criacao_pedido), COALESCE(status_compra, 'pending'),
+                   count(*), COALESCE(sum(quantidade), 0), COALESCE(sum(total_pago), 0)
+            FROM Adquiridos
+            GROUP BY 1, 2, 3;
+        """)
+        cur.execute("SELECT count(DISTINCT (rifa_id, hora)) FROM VendasPorHora;")
+        horas = cur.fetchone()[0]
+    else:
+        cur.execute("""
+            SELECT DISTINCT rifa_id, date_trunc('hour', data_criacao_pedido)
+            FROM Adquiridos
+            WHERE data_ultima_atualizacao > %s;
+        """, (linha[0] - MARGEM_ATUALIZACAO,))
+        alteradas = cur.fetchall()
+        horas = len(alteradas)
+        if alteradas:
+            rifas = [row[0] for row in alteradas]
+            inicios = [row[1] for row in alteradas]
+            cur.execute("""
+                DELETE FROM VendasPorHora v
+                USING unnest(%s::int[], %s::timestamp[]) AS h(rifa_id, hora)
+                WHERE v.rifa_id = h.rifa_id AND v.hora = h.hora;
+            """, (rifas, inicios))
+            # Uma busca por hora no índice de data_criacao_pedido da partição da rifa
+            cur.execute("""
+                INSERT INTO VendasPorHora (rifa_id, hora, status_compra, pedidos, tokens, valor)
+                SELECT h.rifa_id, h.hora, COALESCE(a.status_compra, 'pending'),
+                       count(*), COALESCE(sum(a.quantidade), 0), COALESCE(sum(a.total_pago), 0)
+                FROM unnest(%s::int[], %s::timestamp[]) AS h(rifa_id, hora)
+                JOIN Adquiridos a ON a.rifa_id = h.rifa_id
+                                 AND a.data_criacao_pedido >= h.hora
+                                 AND a.data_criacao_pedido < h.hora + interval '1 hour'
+                GROUP BY 1, 2, 3;
+            """, (rifas, inicios))
+
+    cur.execute("""
+        INSERT INTO RelatoriosAtualizacao (relatorio, atualizado_ate, atualizado_em)
+        VALUES (%s, CURRENT_TIMESTAMP, clock_timestamp())
+        ON CONFLICT (relatorio) DO UPDATE
+        SET atualizado_ate = EXCLUDED.atualizado_ate, atualizado_em = EXCLUDED.atualizado_em;
+    """, (RELATORIO_VENDAS,))
+    return horas
+
+
+def resumo_vendas(cur, rifa_id, horas=48):
+    """Totais da rifa por status e a série por hora das últimas `horas`, lidos de VendasPorHora."""
+    cur.execute("SELECT atualizado_ate FROM RelatoriosAtualizacao WHERE relatorio = %s;", (RELATORIO_VENDAS,))
+    linha = cur.fetchone()
+    cur.execute("""
+        SELECT status_compra, sum(pedidos), sum(tokens), sum(valor)
+        FROM VendasPorHora WHERE rifa_id = %s
+        GROUP BY status_compra;
+    """, (rifa_id,))
+    por_status = {
+        status: {'pedidos': int(pedidos), 'tokens': int(tokens), 'valor': str(valor)}
+        for status, pedidos, tokens, valor in cur.fetchall()
+    }
+    cur.execute("""
+        SELECT hora, status_compra, pedidos, tokens, valor
+        FROM VendasPorHora
+        WHERE rifa_id = %s AND hora >= date_trunc('hour', CURRENT_TIMESTAMP - make_interval(hours => %s))
+        ORDER BY hora, status_compra;
+    """, (rifa_id, horas))
+    por_hora = [
+        {'hora': hora.isoformat(), 'status': status, 'pedidos': pedidos, 'tokens': tokens, 'valor': str(valor)}
+        for hora, status, pedidos, tokens, valor in cur.fetchall()
+    ]
+    aprovados = por_status.get('approved', {'tokens': 0, 'valor': '0'})
+    return {
+        'rifa_id': rifa_id,
+        'atualizado_ate': linha[0].isoformat() if linha else None,
+        'vendidos': aprovados['tokens'],
+        'receita': aprovados['valor'],
+        'por_status': por_status,
+        'por_hora': por_hora,
+    }
+
+
+class AtualizadorRelatorios:
+    """Thread que atualiza VendasPorHora periodicamente."""
+
+    def __init__(self, intervalo=60.0):
+        self.intervalo = intervalo
+        self.ultima_execucao = {'horas': 0, 'duracao_ms': 0.0, 'quando': None}
+        self._parar = threading.Event()
+        self._thread = None
+
+    def executar(self):
+        inicio = time.monotonic()
+        with transacao() as cur:
+            horas = atualizar_vendas_por_hora(cur)
+        if horas is not None:
+            self.ultima_execucao = {'horas': horas, 'duracao_ms': (time.monotonic() - inicio) * 1000, 'quando': time.time()}
+        return horas
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._loop, name="atualizador-relatorios", daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout=5.0):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.executar()
+            except Exception as e:
+                logging.error(f"❌ Erro ao atualizar os relatórios de vendas: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Relatórios de vendas.")
+    comandos = parser.add_subparsers(dest='comando', required=True)
+    p_exportar = comandos.add_parser('exportar', help="Exporta pedidos ou números vendidos de uma rifa")
+    p_exportar.add_argument('--rifa', type=int, default=1)
+    p_exportar.add_argument('--tipo', choices=sorted(EXPORTACOES), default='pedidos')
+    p_exportar.add_argument('--formato', choices=sorted(FORMATOS), default='csv')
+    p_exportar.add_argument('--status', default=None, help="Só pedidos com esse status (números: 'approved' por padrão)")
+    p_exportar.add_argument('--saida', default=None, help="Arquivo de saída (padrão: saída padrão)")
+    p_atualizar = comandos.add_parser('atualizar', help="Atualiza VendasPorHora")
+    p_atualizar.add_argument('--completo', action='store_true', help="Refaz os agregados de todas as rifas não arquivadas")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    database_url = os.getenv('POSTGRES_URL')
+    if not database_url:
+        print("Erro: A variável de ambiente POSTGRES_URL não está definida.")
+        return 1
+
+    conn = psycopg2.connect(database_url)
+    try:
+        if args.comando == 'exportar':
+            saida = open(args.saida, 'w', encoding='utf-8', newline='') if args.saida else sys.stdout
+            try:
+                for pedaco in exportar(conn, args.rifa, args.tipo, args.formato, args.status):
+                    saida.write(pedaco)
+            finally:
+                if args.saida:
+                    saida.close()
+            conn.rollback()
+        else:
+            with conn.cursor() as cur:
+                horas = atualizar_vendas_por_hora(cur, completo=args.completo)
+            conn.commit()
+            if horas is None:
+                print("Outra atualização está em andamento.")
+                return 1
+            print(f"VendasPorHora atualizada: {horas} horas recalculadas.")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Erro: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import time
+import random
+import threading
+
+# Motor de reserva de tokens.
+#
+# Cada token recebe um valor aleatório em Tokens.ordem_alocacao, o que equivale a uma
+# permutação embaralhada dos tokens disponíveis. Para reservar N tokens, a compra trava as
+# JANELA_FATOR x N primeiras posições livres da permutação (índice parcial de disponíveis,
+# FOR UPDATE SKIP LOCKED) e escolhe N delas com uma chave aleatória nova por linha
+# (ORDER BY random()). O custo é proporcional a N, e não ao total de tokens, e compradores
+# simultâneos nunca esperam pelos mesmos registros nem recebem tokens repetidos.
+#
+# A leitura sempre começa do início da permutação, e não de um ponto sorteado: num ponto de
+# partida sorteado, a chance de cada token dependeria do espaço vazio (tokens vendidos) antes
+# dele. O começo de uma permutação aleatória é um subconjunto aleatório uniforme dos
+# disponíveis, e o sorteio dentro da janela é uniforme, então todo token disponível tem a
+# mesma chance de ser atribuído, como no antigo ORDER BY RANDOM(). Um token devolvido volta
+# com uma posição sorteada entre a primeira posição livre e o fim, como os demais.
+#
+# A quantidade de tokens disponíveis fica em ContadorTokens, atualizada na mesma transação
+# de cada reserva/liberação. O contador é dividido em CONTADOR_SLOTS linhas e cada transação
+# ajusta uma linha sorteada, para que compras simultâneas não disputem o lock de uma única linha;
+# o total é a soma dos slots (CONTADOR_SLOTS linhas, sem tocar em Tokens).
+#
+# Tokens é particionada por rifa (ver rifas.py): todas as consultas filtram rifa_id, então
+# reserva, liberação e contagem só tocam a partição da rifa do pedido.
+
+CONTADOR_SLOTS = 16
+CONTADOR_CACHE_TTL = 5.0
+JANELA_FATOR = 2
+
+_cache_contador = {}  # rifa_id -> (valor, expira_em)
+_cache_lock = threading.Lock()
+
+_SQL_RESERVAR = """
+    WITH janela AS (
+        SELECT id FROM Tokens
+        WHERE rifa_id = %(rifa_id)s AND disponivel = TRUE
+        ORDER BY ordem_alocacao
+        LIMIT %(janela)s
+        FOR UPDATE SKIP LOCKED
+    ), escolhidos AS (
+        SELECT id FROM janela ORDER BY random() LIMIT %(quantidade)s
+    )
+    UPDATE Tokens t SET disponivel = FALSE
+    FROM escolhidos e
+    WHERE t.rifa_id = %(rifa_id)s AND t.id = e.id
+    RETURNING t.id, t.numero_token;
+"""
+
+_SQL_AMOSTRAR = """
+    SELECT id, numero_token FROM (
+        SELECT id, numero_token FROM Tokens
+        WHERE rifa_id = %(rifa_id)s AND disponivel = TRUE
+        ORDER BY ordem_alocacao
+        LIMIT %(janela)s
+    ) janela
+    ORDER BY random()
+    LIMIT %(quantidade)s;
+"""
+
+
+def _escolher(cur, sql, rifa_id, quantidade):
+    cur.execute(sql, {'rifa_id': rifa_id, 'janela': quantidade * JANELA_FATOR, 'quantidade': quantidade})
+    return cur.fetchall()
+
+
+def reservar_tokens(cur, rifa_id, quantidade):
+    """Marca `quantidade` tokens aleatórios como indisponíveis na transação de `cur` e os retorna.
+
+    Pode retornar menos tokens que o pedido se não houver disponíveis suficientes
+    (ou se os restantes estiverem travados por outra compra); cabe ao chamador desfazer.
+    """
+    tokens = _escolher(cur, _SQL_RESERVAR, rifa_id, quantidade)
+    ajustar_contador(cur, rifa_id, -len(tokens))
+    return tokens
+
+
+def amostrar_tokens_disponiveis(cur, rifa_id, quantidade):
+    """Retorna até `quantidade` tokens disponíveis aleatórios da rifa, sem reservá-los."""
+    return _escolher(cur, _SQL_AMOSTRAR, rifa_id, quantidade)
+
+
+def liberar_tokens(cur, rifa_id, token_ids):
+    """Devolve tokens reservados ao conjunto disponível, com nova posição aleatória na ordem de alocação."""
+    if not token_ids:
+        return 0
+    # A nova posição é sorteada depois da primeira posição livre: com random() em [0, 1) o
+    # token devolvido cairia quase sempre no começo da permutação e seria revendido primeiro
+    cur.execute("""
+        WITH inicio AS (
+            SELECT COALESCE(min(ordem_alocacao), 0) AS valor FROM Tokens WHERE rifa_id = %s AND disponivel = TRUE
+        )
+        UPDATE Tokens SET disponivel = TRUE, ordem_alocacao = inicio.valor + random() * (1 - inicio.valor)
+        FROM inicio
+        WHERE rifa_id = %s AND id = ANY(%s) AND disponivel = FALSE;
+    """, (rifa_id, rifa_id, [int(token_id) for token_id in token_ids]))
+    liberados = cur.rowcount
+    ajustar_contador(cur, rifa_id, liberados)
+    return liberados
+
+
+def liberar_tokens_por_rifa(cur, linhas):
+    """liberar_tokens() para pares (rifa_id, token_id) de várias rifas, um UPDATE por rifa."""
+    por_rifa = {}
+    for rifa_id, token_id in linhas:
+        por_rifa.setdefault(rifa_id, []).append(token_id)
+    return sum(liberar_tokens(cur, rifa_id, token_ids) for rifa_id, token_ids in sorted(por_rifa.items()))
+
+
+def ajustar_contador(cur, rifa_id, delta):
+    """Soma `delta` ao contador de tokens disponíveis da rifa, dentro da transação de `cur`."""
+    if not delta:
+        return
+    cur.execute(
+        "UPDATE ContadorTokens SET disponiveis = disponiveis + %s WHERE rifa_id = %s AND slot = %s;",
+        (delta, rifa_id, random.randrange(CONTADOR_SLOTS))
+    )
+    invalidar_cache_contador(rifa_id)
+
+
+def ler_contador(cur, rifa_id):
+    """Lê o total de tokens disponíveis da rifa a partir dos slots do contador."""
+    cur.execute("SELECT COALESCE(SUM(disponiveis), 0) FROM ContadorTokens WHERE rifa_id = %s;", (rifa_id,))
+    return int(cur.fetchone()[0])
+
+
+def recalcular_contador(cur, rifa_id):
+    """Reconstrói o contador da rifa a partir de Tokens (uso administrativo: criação de rifas e cargas)."""
+    cur.execute("LOCK TABLE ContadorTokens IN EXCLUSIVE MODE;")
+    cur.execute("SELECT COUNT(id) FROM Tokens WHERE rifa_id = %s AND disponivel = TRUE;", (rifa_id,))
+    total = cur.fetchone()[0]
+    cur.execute("DELETE FROM ContadorTokens WHERE rifa_id = %s;", (rifa_id,))
+    cur.execute(
+        "INSERT INTO ContadorTokens (rifa_id, slot, disponiveis) SELECT %s, s, CASE WHEN s = 0 THEN %s ELSE 0 END FROM generate_series(0, %s) AS s;",
+        (rifa_id, total, CONTADOR_SLOTS - 1)
+    )
+    invalidar_cache_contador(rifa_id)
+    return total
+
+
+def invalidar_cache_contador(rifa_id):
+    with _cache_lock:
+        _cache_contador.pop(rifa_id, None)
+
+
+def contador_em_cache(rifa_id, carregar):
+    """Retorna o total de disponíveis da rifa guardado em memória por até CONTADOR_CACHE_TTL segundos.
+
+    `carregar(rifa_id)` é chamada para buscar o valor no banco quando o cache expira.
+    """
+    agora = time.monotonic()
+    with _cache_lock:
+        valor, expira_em = _cache_contador.get(rifa_id, (None, 0.0))
+        if valor is not None and agora < expira_em:
+            return valor
+    valor = carregar(rifa_id)
+    with _cache_lock:
+        _cache_contador[rifa_id] = (valor, time.monotonic() + CONTADOR_CACHE_TTL)
+    return valor
@@ -0,0 +1,203 @@
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+from decimal import Decimal
+
+import psycopg2
+
+from reservas import recalcular_contador
+
+# Rifas (vários sorteios ao mesmo tempo).
+#
+# Cada rifa tem seu preço, seu formato de número e seu status ('ativa': vendendo;
+# 'encerrada': vendas fechadas, pronta para o sorteio; 'arquivada': fora das tabelas ativas).
+# Tokens, Adquiridos e PedidoTokens são particionadas por lista em rifa_id, com uma partição
+# por rifa criada junto com ela. Como as consultas do app sempre informam a rifa, o Postgres
+# só abre a partição dela: a reserva, a contagem e o sorteio de uma rifa grande não percorrem
+# nem travam os índices das outras. Arquivar uma rifa encerrada é só desanexar as suas
+# partições (DETACH PARTITION, sem copiar dados) e movê-las para o esquema de arquivo.
+#
+# O rifa_id também faz parte do order_id_interno (SORTEIO-<rifa>-<número>), então consultas
+# feitas só com o order_id (retorno do Mercado Pago, webhooks) também chegam à partição certa.
+#
+# Uso:
+#     python rifas.py criar --nome "Sorteio da Moto" --valor 5 --formato L9999 --tokens 100000
+#     python rifas.py listar
+#     python rifas.py encerrar --rifa 2
+#     python rifas.py arquivar --rifa 2
+
+RIFA_LEGADA = 1  # Rifa que recebeu os dados de antes das partições (pedidos SORTEIO-<número>)
+ESQUEMA_ARQUIVO = 'arquivo'
+RIFAS_CACHE_TTL = 30.0
+
+# Na ordem de criação; para desanexar, a ordem inversa (quem referencia sai antes)
+TABELAS_PARTICIONADAS = ('Tokens', 'Adquiridos', 'PedidoTokens')
+
+_padrao_order_id = re.compile(r'^SORTEIO-(\d+)-\d+$')
+
+_cache_rifas = {}  # rifa_id -> (rifa, expira_em)
+_cache_lock = threading.Lock()
+
+
+def novo_order_id(rifa_id):
+    return f"SORTEIO-{rifa_id}-{random.randint(1000000, 9999999)}"
+
+
+def rifa_do_pedido(order_id):
+    """Rifa de um order_id_interno; os pedidos de antes das rifas (SORTEIO-<número>) são da RIFA_LEGADA."""
+    encontrado = _padrao_order_id.match(order_id or '')
+    return int(encontrado.group(1)) if encontrado else RIFA_LEGADA
+
+
+def nome_particao(tabela, rifa_id):
+    return f"{tabela.lower()}_rifa_{int(rifa_id)}"
+
+
+def carregar_rifa(cur, rifa_id):
+    cur.execute("SELECT id, nome, valor_unitario, formato_token, status FROM Rifas WHERE id = %s;", (rifa_id,))
+    linha = cur.fetchone()
+    return dict(zip(('id', 'nome', 'valor_unitario', 'formato_token', 'status'), linha)) if linha else None
+
+
+def rifa_em_cache(rifa_id, carregar):
+    """Dados da rifa guardados em memória por até RIFAS_CACHE_TTL segundos (None se ela não existir).
+
+    `carregar(rifa_id)` é chamada para buscar a rifa no banco quando o cache expira.
+    """
+    agora = time.monotonic()
+    with _cache_lock:
+        rifa, expira_em = _cache_rifas.get(rifa_id, (None, 0.0))
+        if agora < expira_em:
+            return rifa
+    rifa = carregar(rifa_id)
+    with _cache_lock:
+        _cache_rifas[rifa_id] = (rifa, time.monotonic() + RIFAS_CACHE_TTL)
+    return rifa
+
+
+def criar_rifa(cur, nome, valor_unitario, formato_token):
+    """Registra a rifa e cria suas partições e o seu contador. Retorna o id."""
+    cur.execute(
+        "INSERT INTO Rifas (nome, valor_unitario, formato_token) VALUES (%s, %s, %s) RETURNING id;",
+        (nome, Decimal(str(valor_unitario)), formato_token)
+    )
+    rifa_id = cur.fetchone()[0]
+    for tabela in TABELAS_PARTICIONADAS:
+        cur.execute(f"CREATE TABLE {nome_particao(tabela, rifa_id)} PARTITION OF {tabela} FOR VALUES IN ({int(rifa_id)});")
+    recalcular_contador(cur, rifa_id)
+    return rifa_id
+
+
+def encerrar_rifa(cur, rifa_id):
+    """Fecha as vendas. Pedidos pendentes continuam podendo ser aprovados até a sua reserva vencer."""
+    cur.execute(
+        "UPDATE Rifas SET status = 'encerrada', encerrada_em = CURRENT_TIMESTAMP WHERE id = %s AND status = 'ativa';",
+        (rifa_id,)
+    )
+    return cur.rowcount == 1
+
+
+def arquivar_rifa(cur, rifa_id, esquema=ESQUEMA_ARQUIVO):
+    """Desanexa as partições de uma rifa encerrada e as move para `esquema`.
+
+    As tabelas continuam consultáveis (ex.: arquivo.adquiridos_rifa_2), mas deixam de pesar nos
+    índices, no VACUUM e no planejamento das consultas das rifas ativas.
+    """
+    cur.execute("SELECT status FROM Rifas WHERE id = %s FOR UPDATE;", (rifa_id,))
+    linha = cur.fetchone()
+    if not linha or linha[0] != 'encerrada':
+        raise ValueError(f"Só rifas encerradas podem ser arquivadas (rifa {rifa_id}: {linha[0] if linha else 'não encontrada'}).")
+    cur.execute(
+        "SELECT count(*) FROM Adquiridos WHERE rifa_id = %s AND status_compra = 'pending' AND reservado_ate IS NOT NULL;",
+        (rifa_id,)
+    )
+    if cur.fetchone()[0]:
+        raise ValueError(f"A rifa {rifa_id} ainda tem pedidos pendentes com números reservados.")
+
+    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {esquema};")
+    for tabela in reversed(TABELAS_PARTICIONADAS):
+        particao = nome_particao(tabela, rifa_id)
+        cur.execute(f"ALTER TABLE {tabela} DETACH PARTITION {particao};")
+        # A partição desanexada leva consigo as chaves estrangeiras para as tabelas ativas;
+        # sem removê-las a partição referenciada seguinte não poderia ser desanexada
+        cur.execute("""
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f';
+        """, (particao,))
+        for (restricao,) in cur.fetchall():
+            cur.execute(f'ALTER TABLE {particao} DROP CONSTRAINT "{restricao}";')
+        cur.execute(f"ALTER TABLE {particao} SET SCHEMA {esquema};")
+    cur.execute("DELETE FROM ContadorTokens WHERE rifa_id = %s;", (rifa_id,))
+    cur.execute("UPDATE Rifas SET status = 'arquivada' WHERE id = %s;", (rifa_id,))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Administração das rifas.")
+    comandos = parser.add_subparsers(dest='comando', required=True)
+    p_criar = comandos.add_parser('criar', help="Cria uma rifa com suas partições e, opcionalmente, gera os números")
+    p_criar.add_argument('--nome', required=True)
+    p_criar.add_argument('--valor', type=Decimal, required=True, help="Preço de cada número, em reais")
+    p_criar.add_argument('--formato', default='L999', help="Formato dos números ('L' = letra, '9' = dígito)")
+    p_criar.add_argument('--tokens', type=int, default=0, help="Quantidade de números a gerar e carregar")
+    p_criar.add_argument('--semente', default=None, help="Semente da geração dos números")
+    comandos.add_parser('listar', help="Lista as rifas com o total de números disponíveis")
+    p_encerrar = comandos.add_parser('encerrar', help="Fecha as vendas da rifa")
+    p_encerrar.add_argument('--rifa', type=int, required=True)
+    p_arquivar = comandos.add_parser('arquivar', help="Desanexa as partições de uma rifa encerrada")
+    p_arquivar.add_argument('--rifa', type=int, required=True)
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    database_url = os.getenv('POSTGRES_URL')
+    if not database_url:
+        print("Erro: A variável de ambiente POSTGRES_URL não está definida.")
+        return 1
+
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cur:
+            if args.comando == 'criar':
+                from tokens import gerar_tokens_stream, carregar_tokens_no_banco, tamanho_espaco
+                tamanho_espaco(args.formato)  # Valida o formato antes de criar a rifa
+                rifa_id = criar_rifa(cur, args.nome, args.valor, args.formato)
+                conn.commit()
+                print(f"Rifa {rifa_id} criada ({args.nome}, R${args.valor:.2f} por número).")
+                if args.tokens:
+                    enviados, inseridos = carregar_tokens_no_banco(
+                        conn, gerar_tokens_stream(args.tokens, args.formato, args.semente), rifa_id=rifa_id
+                    )
+                    print(f"{inseridos} números carregados na rifa {rifa_id}.")
+            elif args.comando == 'listar':
+                cur.execute("""
+                    SELECT r.id, r.nome, r.valor_unitario, r.formato_token, r.status,
+                           (SELECT COALESCE(SUM(c.disponiveis), 0) FROM ContadorTokens c WHERE c.rifa_id = r.id)
+                    FROM Rifas r ORDER BY r.id;
+                """)
+                for rifa_id, nome, valor, formato, status, disponiveis in cur.fetchall():
+                    print(f"{rifa_id:>4}  {status:<10} R${valor:>8.2f}  {formato:<10} {disponiveis:>10} disponíveis  {nome}")
+            elif args.comando == 'encerrar':
+                if not encerrar_rifa(cur, args.rifa):
+                    print(f"Rifa {args.rifa} não encontrada ou não está ativa.")
+                    return 1
+                conn.commit()
+                print(f"Vendas da rifa {args.rifa} encerradas.")
+            else:
+                arquivar_rifa(cur, args.rifa)
+                conn.commit()
+                print(f"Rifa {args.rifa} arquivada no esquema '{ESQUEMA_ARQUIVO}'.")
+    except (ValueError, psycopg2.Error) as e:
+        conn.rollback()
+        print(f"Erro: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+import os
+import sys
+import hmac
+import hashlib
+import argparse
+
+import psycopg2
+import psycopg2.extras
+
+# Apuração do sorteio.
+#
+# 1. preparar: antes do sorteio o organizador escolhe uma semente secreta e publica só o seu
+#    compromisso, sha256(semente). Na mesma hora os números vendidos (pedidos aprovados) são
+#    congelados em SorteioBilhetes, numerados de 0 a N-1 pela ordem do número, e o hash
+#    dessa lista também é publicado. O número fica gravado no bilhete, então a verificação
+#    continua possível depois que a rifa é arquivada.
+# 2. realizar: a semente é revelada (opcionalmente combinada com um valor público definido
+#    depois do compromisso, ex.: o resultado de uma extração da Loteria Federal). A posição
+#    de cada prêmio sai de HMAC-SHA256(semente, "premio:tentativa"), sem reposição; cada
+#    ganhador é lido pela chave primária de SorteioBilhetes e o comprador pelo índice único
+#    de PedidoTokens, então o custo não depende da quantidade de números vendidos.
+#    Cada sorteio é de uma rifa (ver rifas.py) e só lê as partições dela.
+# 3. verificar: qualquer pessoa com a semente, o valor público e a lista publicada refaz as
+#    contas e obtém os mesmos ganhadores.
+
+
+def compromisso_da_semente(semente):
+    """Hash que é publicado antes do sorteio; a semente só é revelada na apuração."""
+    return hashlib.sha256(semente.encode('utf-8')).hexdigest()
+
+
+def _chave(semente, valor_publico):
+    return hashlib.sha256(f"{semente}|{valor_publico or ''}".encode('utf-8')).digest()
+
+
+def sortear_posicoes(semente, total, premios, valor_publico=None):
+    """Posições (0 a total-1) sorteadas para cada prêmio, distintas e reproduzíveis.
+
+    Amostragem por rejeição sobre os 256 bits do HMAC, para que todas as posições tenham
+    exatamente a mesma probabilidade.
+    """
+    if total <= 0:
+        raise ValueError("Não há números vendidos para sortear.")
+    if premios > total:
+        raise ValueError(f"Há {total} números vendidos para {premios} prêmios.")
+    chave = _chave(semente, valor_publico)
+    limite = (1 << 256) - (1 << 256) % total
+    posicoes = []
+    escolhidas = set()
+    for premio in range(1, premios + 1):
+        tentativa = 0
+        while True:
+            digest = hmac.new(chave, f"{premio}:{tentativa}".encode(), hashlib.sha256).digest()
+            valor = int.from_bytes(digest, 'big')
+            tentativa += 1
+            if valor >= limite:
+                continue
+            posicao = valor % total
+            if posicao not in escolhidas:
+                break
+        escolhidas.add(posicao)
+        posicoes.append(posicao)
+    return posicoes
+
+
+def _resumo_bilhetes(cur, sorteio_id):
+    """Quantidade de bilhetes congelados e sha256 da lista de números, um por linha, na ordem das posições."""
+    cur.execute("""
+        SELECT count(*), encode(sha256(convert_to(COALESCE(string_agg(b.numero_token, E'\\n' ORDER BY b.posicao), ''), 'UTF8')), 'hex')
+        FROM SorteioBilhetes b
+        WHERE b.sorteio_id = %s;
+    """, (sorteio_id,))
+    return cur.fetchone()
+
+
+def preparar_sorteio(cur, rifa_id, nome, compromisso):
+    """Registra o sorteio da rifa com o compromisso da semente e congela os números vendidos.
+
+    A rifa precisa estar encerrada (sem vendas novas) e sem reservas em aberto: um pedido ainda
+    no prazo de pagamento que fosse aprovado depois do congelamento ficaria fora do sorteio.
+    Aprovações que chegam depois disso são estornadas (ver sorteio_congelado). Retorna
+    (sorteio_id, total de bilhetes, hash da lista de bilhetes).
+    """
+    cur.execute("SELECT status FROM Rifas WHERE id = %s FOR UPDATE;", (rifa_id,))
+    linha = cur.fetchone()
+    if not linha or linha[0] != 'encerrada':
+        raise ValueError(f"A rifa {rifa_id} precisa estar encerrada para o sorteio ({linha[0] if linha else 'não encontrada'}).")
+    cur.execute(
+        "SELECT count(*) FROM Adquiridos WHERE rifa_id = %s AND status_compra IN ('pending', 'rejected') AND reservado_ate IS NOT NULL;",
+        (rifa_id,)
+    )
+    em_aberto = cur.fetchone()[0]
+    if em_aberto:
+        raise ValueError(f"A rifa {rifa_id} ainda tem {em_aberto} pedido(s) com reserva em aberto; aguarde o pagamento ou a expiração.")
+    cur.execute(
+        "INSERT INTO Sorteios (rifa_id, nome, compromisso_semente) VALUES (%s, %s, %s) RETURNING id;",
+        (rifa_id, nome, compromisso)
+    )
+    sorteio_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO SorteioBilhetes (sorteio_id, posicao, token_id, numero_token)
+        SELECT %s, row_number() OVER (ORDER BY t.numero_token) - 1, t.id, t.numero_token
+        FROM PedidoTokens pt
+        JOIN Adquiridos a ON a.rifa_id = pt.rifa_id AND a.id = pt.adquirido_id
+        JOIN Tokens t ON t.rifa_id = pt.rifa_id AND t.id = pt.token_id
+        WHERE pt.rifa_id = %s AND a.status_compra = 'approved';
+    """, (sorteio_id, rifa_id))
+    total, hash_bilhetes = _resumo_bilhetes(cur, sorteio_id)
+    cur.execute(
+        "UPDATE Sorteios SET total_bilhetes = %s, hash_bilhetes = %s WHERE id = %s;",
+        (total, hash_bilhetes, sorteio_id)
+    )
+    return sorteio_id, total, hash_bilhetes
+
+
+def sorteio_congelado(cur, rifa_id):
+    """Diz se os números vendidos da rifa já foram congelados para o sorteio.
+
+    Trava a rifa com FOR SHARE até o fim da transação de `cur`: uma aprovação que consulta
+    aqui antes de marcar os tokens vendidos espera um preparar_sorteio em andamento (que trava
+    a rifa com FOR UPDATE), e vice-versa, então nenhuma aprovação fica fora da lista congelada.
+    """
+    cur.execute("SELECT 1 FROM Rifas WHERE id = %s FOR SHARE;", (rifa_id,))
+    cur.execute("SELECT EXISTS (SELECT 1 FROM Sorteios WHERE rifa_id = %s);", (rifa_id,))
+    return cur.fetchone()[0]
+
+
+def _ganhadores_das_posicoes(cur, sorteio_id, rifa_id, posicoes):
+    cur.execute("""
+        SELECT p.premio, b.posicao, b.token_id, b.numero_token,
+               a.id AS adquirido_id, a.order_id_interno, a.nome_cliente, a.email_cliente
+        FROM unnest(%s::int[], %s::bigint[]) AS p(premio, posicao)
+        JOIN SorteioBilhetes b ON b.sorteio_id = %s AND b.posicao = p.posicao
+        JOIN PedidoTokens pt ON pt.rifa_id = %s AND pt.token_id = b.token_id
+        JOIN Adquiridos a ON a.rifa_id = pt.rifa_id AND a.id = pt.adquirido_id
+        ORDER BY p.premio;
+    """, (list(range(1, len(posicoes) + 1)), posicoes, sorteio_id, rifa_id))
+    return cur.fetchall()
+
+
+def realizar_sorteio(cur, sorteio_id, semente, premios=1, valor_publico=None):
+    """Revela a semente, sorteia `premios` ganhadores sem reposição e os grava. Retorna os ganhadores."""
+    cur.execute("SELECT * FROM Sorteios WHERE id = %s FOR UPDATE;", (sorteio_id,))
+    sorteio = cur.fetchone()
+    if not sorteio:
+        raise ValueError(f"Sorteio {sorteio_id} não encontrado.")
+    if sorteio['realizado_em'] is not None:
+        raise ValueError(f"Sorteio {sorteio_id} já foi realizado em {sorteio['realizado_em']}.")
+    if not hmac.compare_digest(compromisso_da_semente(semente), sorteio['compromisso_semente']):
+        raise ValueError("A semente informada não corresponde ao compromisso publicado.")
+
+    posicoes = sortear_posicoes(semente, sorteio['total_bilhetes'], premios, valor_publico)
+    ganhadores = _ganhadores_das_posicoes(cur, sorteio_id, sorteio['rifa_id'], posicoes)
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO SorteioGanhadores (sorteio_id, premio, posicao, token_id, adquirido_id) VALUES %s;
+    """, [(sorteio_id, g['premio'], g['posicao'], g['token_id'], g['adquirido_id']) for g in ganhadores])
+    cur.execute("""
+        UPDATE Sorteios SET semente = %s, valor_publico = %s, premios = %s, realizado_em = CURRENT_TIMESTAMP
+        WHERE id = %s;
+    """, (semente, valor_publico, premios, sorteio_id))
+    return ganhadores
+
+
+def verificar_sorteio(cur, sorteio_id):
+    """Refaz a apuração a partir dos dados gravados. Retorna (ok, lista de divergências)."""
+    cur.execute("SELECT * FROM Sorteios WHERE id = %s;", (sorteio_id,))
+    sorteio = cur.fetchone()
+    if not sorteio or sorteio['realizado_em'] is None:
+        return False, [f"Sorteio {sorteio_id} não encontrado ou ainda não realizado."]
+    divergencias = []
+    if compromisso_da_semente(sorteio['semente']) != sorteio['compromisso_semente']:
+        divergencias.append("A semente revelada não corresponde ao compromisso.")
+    total, hash_bilhetes = _resumo_bilhetes(cur, sorteio_id)
+    if (total, hash_bilhetes) != (sorteio['total_bilhetes'], sorteio['hash_bilhetes']):
+        divergencias.append("A lista de bilhetes não corresponde ao hash publicado.")
+    esperadas = sortear_posicoes(sorteio['semente'], total, sorteio['premios'], sorteio['valor_publico'])
+    cur.execute("SELECT posicao FROM SorteioGanhadores WHERE sorteio_id = %s ORDER BY premio;", (sorteio_id,))
+    gravadas = [row[0] for row in cur.fetchall()]
+    if gravadas != esperadas:
+        divergencias.append(f"Posições gravadas {gravadas} diferem das recalculadas {esperadas}.")
+    return not divergencias, divergencias
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apuração verificável do sorteio.")
+    comandos = parser.add_subparsers(dest='comando', required=True)
+    p_preparar = comandos.add_parser('preparar', help="Registra o compromisso e congela os números vendidos")
+    p_preparar.add_argument('--nome', required=True)
+    p_preparar.add_argument('--rifa', type=int, default=1, help="Rifa (encerrada) cujos números vendidos entram no sorteio")
+    grupo = p_preparar.add_mutually_exclusive_group(required=True)
+    grupo.add_argument('--compromisso', help="sha256 da semente, em hexadecimal")
+    grupo.add_argument('--semente', help="Calcula o compromisso a partir da semente (que não é gravada)")
+    p_realizar = comandos.add_parser('realizar', help="Revela a semente e sorteia os ganhadores")
+    p_realizar.add_argument('--sorteio', type=int, required=True)
+    p_realizar.add_argument('--semente', required=True)
+    p_realizar.add_argument('--premios', type=int, default=1)
+    p_realizar.add_argument('--valor-publico', default=None, help="Valor público combinado à semente (ex.: resultado da Loteria Federal)")
+    p_verificar = comandos.add_parser('verificar', help="Refaz a apuração e compara com o resultado gravado")
+    p_verificar.add_argument('--sorteio', type=int, required=True)
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    database_url = os.getenv('POSTGRES_URL')
+    if not database_url:
+        print("Erro: A variável de ambiente POSTGRES_URL não está definida.")
+        return 1
+
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            if args.comando == 'preparar':
+                compromisso = args.compromisso or compromisso_da_semente(args.semente)
+                sorteio_id, total, hash_bilhetes = preparar_sorteio(cur, args.rifa, args.nome, compromisso)
+                conn.commit()
+                print(f"Sorteio {sorteio_id} preparado com {total} números vendidos.")
+                print(f"Publique: compromisso da semente = {compromisso}")
+                print(f"          hash da lista de números = {hash_bilhetes}")
+            elif args.comando == 'realizar':
+                ganhadores = realizar_sorteio(cur, args.sorteio, args.semente, args.premios, args.valor_publico)
+                conn.commit()
+                for g in ganhadores:
+                    print(f"{g['premio']}º prêmio: número {g['numero_token']} (posição {g['posicao']}) - "
+                          f"{g['nome_cliente']} <{g['email_cliente']}>, pedido {g['order_id_interno']}")
+            else:
+                ok, divergencias = verificar_sorteio(cur, args.sorteio)
+                conn.rollback()
+                print("Apuração confere." if ok else "Apuração NÃO confere:\n  " + "\n  ".join(divergencias))
+                return 0 if ok else 1
+    except (ValueError, psycopg2.Error) as e:
+        conn.rollback()
+        print(f"Erro: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,9 +8,31 @@ document.addEventListener('DOMContentLoaded', function() {
     const valorTotalSpan = document.getElementById('valorTotal');
     const confirmarDadosBtn = document.getElementById('confirmarDados');
     const formMessage = document.getElementById('formMessage'); // Elemento para mensagens de feedback
+    const tokensRestantesEl = document.getElementById('tokensRestantes');
 
     let quantidade = 1;
-    const valorUnitario = 10.00;
+    const rifaId = parseInt(document.body.dataset.rifaId, 10);
+    const valorUnitario = parseFloat(document.body.dataset.valorUnitario);
+    let limiteQuantidade = 2500;
+
+    // Consulta o contador leve de números disponíveis (não toca na tabela de tokens)
+    function atualizarTokensRestantes() {
+        fetch(`/tokens_disponiveis?rifa_id=${rifaId}`)
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) return;
+                tokensRestantesEl.textContent = data.disponiveis > 0
+                    ? `${data.disponiveis} números restantes`
+                    : 'Todos os números foram vendidos!';
+                tokensRestantesEl.classList.remove('hidden');
+                limiteQuantidade = Math.max(1, Math.min(2500, data.disponiveis));
+                if (quantidade > limiteQuantidade) {
+                    quantidade = limiteQuantidade;
+                    atualizarValor();
+                }
+            })
+            .catch(() => {}); // Sem o contador a página continua funcionando normalmente
+    }
 
     function atualizarValor() {
         valorTotalSpan.textContent = `R$${(quantidade * valorUnitario).toFixed(2)}`;
@@ -55,7 +77,7 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     increaseBtn.addEventListener('click', function() {
-        if (quantidade < 2500) {
+        if (quantidade < limiteQuantidade) {
             quantidade++;
             atualizarValor();
         }
@@ -69,7 +91,7 @@ document.addEventListener('DOMContentLoaded', function() {
     quantitySpan.addEventListener('blur', function() {
         let valor = parseInt(quantitySpan.textContent.replace(/\D/g, ''));
         if (isNaN(valor) || valor < 1) valor = 1;
-        if (valor > 2500) valor = 2500;
+        if (valor > limiteQuantidade) valor = limiteQuantidade;
         quantidade = valor;
         atualizarValor();
     });
@@ -124,7 +146,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 email: email,
                 cpf: cpf,
                 phone: telefone,
-                quantity: quantidade
+                quantity: quantidade,
+                rifa_id: rifaId
             }),
         })
         .then(response => response.json())
@@ -144,4 +167,6 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     atualizarValor();
+    atualizarTokensRestantes();
+    setInterval(atualizarTokensRestantes, 15000);
 });
\ No newline at end of file
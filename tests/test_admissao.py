@@ -0,0 +1,69 @@
+"""Limites de taxa do checkout (admissao.py).
+
+Os testes do backend em memória rodam sempre; os do BackendPostgres usam o banco de
+TEST_POSTGRES_URL (que recebe as migrações).
+
+    TEST_POSTGRES_URL=postgresql://localhost/sorteio_teste python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+import uuid
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+TEST_POSTGRES_URL = os.getenv('TEST_POSTGRES_URL')
+
+
+@unittest.skipUnless(psycopg2, "instale o psycopg2")
+class LimitesMemoriaTest(unittest.TestCase):
+    def _backend(self):
+        from admissao import BackendMemoria
+        return BackendMemoria()
+
+    def _controle(self):
+        from admissao import ControleAdmissao, LimiteTaxa
+        return ControleAdmissao([LimiteTaxa('ip', 1, 1), LimiteTaxa('cpf', 1, 1)], backend=self._backend())
+
+    def test_recusa_pelo_cpf_nao_gasta_a_ficha_do_ip(self):
+        controle = self._controle()
+        ip, cpf = uuid.uuid4().hex, uuid.uuid4().hex
+        self.assertEqual(controle.verificar(ip=ip, cpf=cpf), (None, 0.0))
+        outro_ip = uuid.uuid4().hex
+        motivo, espera = controle.verificar(ip=outro_ip, cpf=cpf)
+        self.assertEqual(motivo, 'cpf')
+        self.assertGreater(espera, 0)
+        # A ficha do segundo IP continua lá
+        self.assertEqual(controle.verificar(ip=outro_ip, cpf=uuid.uuid4().hex), (None, 0.0))
+        self.assertEqual(controle.verificar(ip=ip)[0], 'ip')
+
+    def test_chaves_vazias_ou_desconhecidas_sao_ignoradas(self):
+        controle = self._controle()
+        self.assertEqual(controle.verificar(ip=None, cpf='', email='x@example.com'), (None, 0.0))
+
+
+@unittest.skipUnless(psycopg2 and TEST_POSTGRES_URL, "defina TEST_POSTGRES_URL (e instale o psycopg2)")
+class LimitesPostgresTest(LimitesMemoriaTest):
+    @classmethod
+    def setUpClass(cls):
+        from migracoes import aplicar_migracoes
+        os.environ['POSTGRES_URL'] = TEST_POSTGRES_URL  # BackendPostgres usa o pool de db.py
+        conn = psycopg2.connect(TEST_POSTGRES_URL)
+        try:
+            aplicar_migracoes(conn)
+        finally:
+            conn.close()
+
+    def _backend(self):
+        from admissao import BackendPostgres
+        return BackendPostgres()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+"""Pagamentos aprovados que não podem virar compra e são estornados (pagamentos.py, sorteio.py).
+
+Como em test_reservas.py, roda contra o PostgreSQL de TEST_POSTGRES_URL (que recebe as
+migrações); cada teste cria a sua própria rifa.
+
+    TEST_POSTGRES_URL=postgresql://localhost/sorteio_teste python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+try:
+    import psycopg2
+    import psycopg2.extras
+except ImportError:
+    psycopg2 = None
+
+TEST_POSTGRES_URL = os.getenv('TEST_POSTGRES_URL')
+
+
+@unittest.skipUnless(psycopg2, "instale o psycopg2")
+class SortearPosicoesTest(unittest.TestCase):
+    def test_sem_numeros_vendidos_e_erro_claro(self):
+        from sorteio import sortear_posicoes
+        with self.assertRaises(ValueError):
+            sortear_posicoes('semente', 0, 1)
+
+
+class _SdkEstorno:
+    """Responde ao refund().create() como o Mercado Pago, guardando os pagamentos estornados."""
+
+    def __init__(self, status=201):
+        self.status = status
+        self.estornados = []
+
+    def refund(self):
+        return self
+
+    def create(self, payment_id):
+        self.estornados.append(payment_id)
+        return {'status': self.status, 'response': {'payment_id': payment_id}}
+
+
+@unittest.skipUnless(psycopg2 and TEST_POSTGRES_URL, "defina TEST_POSTGRES_URL (e instale o psycopg2)")
+class EstornoAposCongelamentoTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from migracoes import aplicar_migracoes
+        os.environ['POSTGRES_URL'] = TEST_POSTGRES_URL  # despachar_estornos() usa o pool de db.py
+        conn = psycopg2.connect(TEST_POSTGRES_URL)
+        try:
+            aplicar_migracoes(conn)
+        finally:
+            conn.close()
+
+    def setUp(self):
+        self.conn = psycopg2.connect(TEST_POSTGRES_URL)
+        self.addCleanup(self.conn.close)
+
+    def _cursor(self):
+        return self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+    def _pedido(self, cur, rifa_id, status, quantidade=2, reservado_minutos=None):
+        from rifas import novo_order_id
+        order_id = novo_order_id(rifa_id)
+        cur.execute("""
+            INSERT INTO Adquiridos (rifa_id, nome_cliente, email_cliente, cpf_cliente, telefone_cliente, order_id_interno,
+                                    status_compra, total_pago, quantidade, reservado_ate)
+            VALUES (%s, 'Cliente Teste', 'cliente@example.com', '00000000000', '0', %s, %s, %s, %s,
+                    CURRENT_TIMESTAMP + make_interval(mins => %s))
+            RETURNING id;
+        """, (rifa_id, order_id, status, 10 * quantidade, quantidade, reservado_minutos))
+        return cur.fetchone()[0], order_id
+
+    def _rifa_com_venda(self, cur):
+        """Rifa encerrada com um pedido aprovado de 2 números; retorna o id."""
+        from rifas import criar_rifa, encerrar_rifa
+        from reservas import reservar_tokens, recalcular_contador
+        from pedidos import vincular_tokens
+        rifa_id = criar_rifa(cur, 'Rifa de teste', 10, 'L999')
+        cur.execute("""
+            INSERT INTO Tokens (rifa_id, numero_token)
+            SELECT %s, 'T' || lpad(g::text, 3, '0') FROM generate_series(1, 20) AS g;
+        """, (rifa_id,))
+        recalcular_contador(cur, rifa_id)
+        adquirido_id, _ = self._pedido(cur, rifa_id, 'approved')
+        vincular_tokens(cur, rifa_id, adquirido_id, [row['id'] for row in reservar_tokens(cur, rifa_id, 2)])
+        encerrar_rifa(cur, rifa_id)
+        return rifa_id
+
+    def _status(self, cur, order_id):
+        cur.execute("SELECT status_compra FROM Adquiridos WHERE order_id_interno = %s;", (order_id,))
+        return cur.fetchone()[0]
+
+    def _estornos(self, cur, order_id):
+        cur.execute("SELECT payload FROM NotificacoesPendentes WHERE canal = 'estorno' AND payload->>'order_id' = %s;", (order_id,))
+        return [row[0] for row in cur.fetchall()]
+
+    def test_preparar_recusa_reservas_em_aberto(self):
+        from sorteio import preparar_sorteio, compromisso_da_semente
+        with self._cursor() as cur:
+            rifa_id = self._rifa_com_venda(cur)
+            self._pedido(cur, rifa_id, 'pending', reservado_minutos=30)
+            with self.assertRaises(ValueError):
+                preparar_sorteio(cur, rifa_id, 'Teste', compromisso_da_semente('semente'))
+        self.conn.rollback()
+
+    def test_aprovacao_depois_do_congelamento_vira_estorno(self):
+        from sorteio import preparar_sorteio, compromisso_da_semente
+        from pagamentos import aplicar_pagamento, despachar_estornos
+        with self._cursor() as cur:
+            rifa_id = self._rifa_com_venda(cur)
+            # Pedido que expirou antes do congelamento e foi pago depois
+            _, order_id = self._pedido(cur, rifa_id, 'expired')
+            sorteio_id, total, _ = preparar_sorteio(cur, rifa_id, 'Teste', compromisso_da_semente('semente'))
+        self.conn.commit()
+        self.assertEqual(total, 2)
+
+        pagamento = {'id': 987654, 'status': 'approved', 'external_reference': order_id}
+        for _ in range(2):  # Webhook repetido: um único estorno
+            with self._cursor() as cur:
+                aplicar_pagamento(cur, pagamento)
+            self.conn.commit()
+
+        with self._cursor() as cur:
+            self.assertEqual(self._status(cur, order_id), 'refund_pending')
+            cur.execute("SELECT count(*) FROM PedidoTokens pt JOIN Adquiridos a ON a.id = pt.adquirido_id "
+                        "WHERE a.order_id_interno = %s;", (order_id,))
+            self.assertEqual(cur.fetchone()[0], 0)
+            cur.execute("SELECT count(*) FROM SorteioBilhetes WHERE sorteio_id = %s;", (sorteio_id,))
+            self.assertEqual(cur.fetchone()[0], 2)
+            estornos = self._estornos(cur, order_id)
+        self.conn.commit()
+        self.assertEqual(len(estornos), 1)
+
+        sdk = _SdkEstorno()
+        with mock.patch('pagamentos.get_mp_sdk', return_value=sdk):
+            self.assertEqual(despachar_estornos(estornos), [None])
+        self.assertEqual(sdk.estornados, ['987654'])
+        with self._cursor() as cur:
+            self.assertEqual(self._status(cur, order_id), 'refunded')
+        self.conn.commit()
+
+    def test_aprovacao_sem_numeros_para_completar_vira_estorno(self):
+        from pagamentos import aplicar_pagamento
+        with self._cursor() as cur:
+            rifa_id = self._rifa_com_venda(cur)
+            # Reserva expirada de 19 números quando só restam 18
+            _, order_id = self._pedido(cur, rifa_id, 'expired', quantidade=19)
+            aplicar_pagamento(cur, {'id': 555, 'status': 'approved', 'external_reference': order_id})
+            self.assertEqual(self._status(cur, order_id), 'refund_pending')
+            cur.execute("SELECT count(*) FROM Tokens WHERE rifa_id = %s AND disponivel = TRUE;", (rifa_id,))
+            self.assertEqual(cur.fetchone()[0], 18)
+            cur.execute("SELECT count(*) FROM PedidoTokens pt JOIN Adquiridos a ON a.id = pt.adquirido_id "
+                        "WHERE a.order_id_interno = %s;", (order_id,))
+            self.assertEqual(cur.fetchone()[0], 0)
+            self.assertEqual(len(self._estornos(cur, order_id)), 1)
+        self.conn.rollback()
+
+    def test_estorno_recusado_pelo_mercado_pago_fica_pendente(self):
+        from pagamentos import despachar_estornos
+        with self._cursor() as cur:
+            rifa_id = self._rifa_com_venda(cur)
+            _, order_id = self._pedido(cur, rifa_id, 'refund_pending')
+        self.conn.commit()
+        payload = {'payment_id': '1', 'order_id': order_id, 'rifa_id': rifa_id}
+        with mock.patch('pagamentos.get_mp_sdk', return_value=_SdkEstorno(status=400)):
+            resultado = despachar_estornos([payload])
+        self.assertIsInstance(resultado[0], Exception)  # A fila reagenda o trabalho
+        with self._cursor() as cur:
+            self.assertEqual(self._status(cur, order_id), 'refund_pending')
+        self.conn.commit()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Reservas simultâneas de tokens (reservas.py) contra um PostgreSQL de verdade.
+
+O banco indicado em TEST_POSTGRES_URL recebe as migrações e tem Tokens, Adquiridos e
+PedidoTokens APAGADAS: use um banco só para os testes.
+
+    TEST_POSTGRES_URL=postgresql://localhost/sorteio_teste python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import unittest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+TEST_POSTGRES_URL = os.getenv('TEST_POSTGRES_URL')
+RIFA = 1
+TOTAL_TOKENS = 20000
+
+
+@unittest.skipUnless(psycopg2 and TEST_POSTGRES_URL, "defina TEST_POSTGRES_URL (e instale o psycopg2)")
+class ReservasSimultaneasTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from migracoes import aplicar_migracoes
+        conn = psycopg2.connect(TEST_POSTGRES_URL)
+        try:
+            aplicar_migracoes(conn)
+        finally:
+            conn.close()
+
+    def setUp(self):
+        from reservas import recalcular_contador
+        conn = psycopg2.connect(TEST_POSTGRES_URL)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("TRUNCATE PedidoTokens, Adquiridos, Tokens CASCADE;")
+                cur.execute("""
+                    INSERT INTO Tokens (rifa_id, numero_token)
+                    SELECT %s, 'T' || lpad(g::text, 6, '0') FROM generate_series(1, %s) AS g;
+                """, (RIFA, TOTAL_TOKENS))
+                recalcular_contador(cur, RIFA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _comprar_em_paralelo(self, compradores, quantidade, commit=True):
+        """Cada comprador reserva `quantidade` tokens na sua conexão, todos ao mesmo tempo."""
+        from reservas import reservar_tokens
+        largada = threading.Barrier(compradores)
+        resultados = [None] * compradores
+        erros = []
+
+        def comprar(indice):
+            conn = psycopg2.connect(TEST_POSTGRES_URL)
+            try:
+                with conn.cursor() as cur:
+                    largada.wait()
+                    resultados[indice] = [row[0] for row in reservar_tokens(cur, RIFA, quantidade)]
+                    # Segura os locks por um instante, para que as outras compras precisem pulá-los
+                    cur.execute("SELECT pg_sleep(0.05);")
+                if commit:
+                    conn.commit()
+                else:
+                    conn.rollback()
+            except Exception as e:
+                erros.append(e)
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=comprar, args=(i,)) for i in range(compradores)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(erros, [])
+        return resultados
+
+    def _contagem(self):
+        from reservas import ler_contador
+        conn = psycopg2.connect(TEST_POSTGRES_URL)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM Tokens WHERE rifa_id = %s AND disponivel;", (RIFA,))
+                return cur.fetchone()[0], ler_contador(cur, RIFA)
+        finally:
+            conn.close()
+
+    def test_compradores_simultaneos_nao_recebem_tokens_repetidos(self):
+        compradores, quantidade = 20, 500
+        resultados = self._comprar_em_paralelo(compradores, quantidade)
+        todos = [token for tokens in resultados for token in tokens]
+        self.assertTrue(all(len(tokens) == quantidade for tokens in resultados))
+        self.assertEqual(len(todos), len(set(todos)))
+        disponiveis, contador = self._contagem()
+        self.assertEqual(disponiveis, TOTAL_TOKENS - compradores * quantidade)
+        self.assertEqual(contador, disponiveis)
+
+    def test_rollback_devolve_os_tokens(self):
+        self._comprar_em_paralelo(10, 100, commit=False)
+        self.assertEqual(self._contagem(), (TOTAL_TOKENS, TOTAL_TOKENS))
+
+
+if __name__ == '__main__':
+    unittest.main()
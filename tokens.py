@@ -1,28 +1,285 @@
+import io
+import os
+import csv
+import sys
+import time
 import random
 import string
-import csv
+import argparse
+from math import exp, log
+
+# Geração dos números da sorte.
+#
+# O formato é descrito por um padrão: 'L' = letra de A a Z, '9' = dígito de 0 a 9
+# (o padrão original do sorteio é 'L999': letra + 3 dígitos, 26.000 combinações).
+# Cada combinação corresponde a um índice do espaço de códigos, decodificado em base mista.
+# Para sortear N códigos distintos usamos amostragem sequencial (Vitter, Algoritmo D): em vez
+# de visitar cada índice do espaço, sorteia o tamanho do salto até o próximo índice escolhido,
+# então o custo é proporcional a N e não ao tamanho do espaço (formatos esparsos como
+# L99999999, com 2,6 bilhões de códigos, geram milhões de tokens em segundos). Os índices saem
+# em ordem crescente, sem conjunto em memória; o resultado é uma amostra uniforme exata e,
+# com a mesma semente, a saída é sempre a mesma (re-execuções são idempotentes).
+
+FORMATO_PADRAO = 'L999'
+ALFABETOS = {'L': string.ascii_uppercase, '9': string.digits}
+TAMANHO_MAX_TOKEN = 10  # Tokens.numero_token é VARCHAR(10)
+ALFA_INVERSO = 13  # Parâmetro do Algoritmo D (ver indices_amostrados)
+
+
+def _alfabetos_do_formato(formato):
+    if not formato or len(formato) > TAMANHO_MAX_TOKEN:
+        raise ValueError(f"Formato deve ter de 1 a {TAMANHO_MAX_TOKEN} posições: {formato!r}")
+    try:
+        return [ALFABETOS[posicao] for posicao in formato]
+    except KeyError as e:
+        raise ValueError(f"Posição inválida no formato {formato!r}: {e.args[0]!r} (use 'L' ou '9')")
+
+
+def tamanho_espaco(formato=FORMATO_PADRAO):
+    """Quantidade de códigos distintos possíveis no formato."""
+    total = 1
+    for alfabeto in _alfabetos_do_formato(formato):
+        total *= len(alfabeto)
+    return total
+
+
+def codigo_do_indice(indice, alfabetos):
+    """Converte um índice do espaço de códigos no token correspondente."""
+    caracteres = []
+    for alfabeto in reversed(alfabetos):
+        indice, resto = divmod(indice, len(alfabeto))
+        caracteres.append(alfabeto[resto])
+    return ''.join(reversed(caracteres))
+
+
+def _amostra_algoritmo_a(n, total, rng, atual):
+    """Algoritmo A de Vitter: percorre os saltos um a um (usado quando sobra pouco espaço por código)."""
+    top = total - n
+    restante = float(total)
+    while n >= 2:
+        v = rng.random()
+        salto = 0
+        quociente = top / restante
+        while quociente > v:
+            salto += 1
+            top -= 1
+            restante -= 1
+            quociente = quociente * top / restante
+        atual += salto + 1
+        yield atual
+        restante -= 1
+        n -= 1
+    atual += int(restante * rng.random()) + 1
+    yield atual
+
+
+def indices_amostrados(n, total, rng):
+    """Índices distintos e crescentes de uma amostra uniforme de `n` entre `total` (Algoritmo D de Vitter).
+
+    Sorteia direto o salto até o próximo índice escolhido, então o custo esperado é O(n),
+    e não O(total). Quando o espaço restante fica menor que ALFA_INVERSO x n, termina com o
+    Algoritmo A, cujo custo é proporcional ao espaço restante (aí, no máximo 13 x n).
+    """
+    if n <= 0:
+        return
+    atual = -1
+    n_real = float(n)
+    total_real = float(total)
+    n_inv = 1.0 / n_real
+    v_linha = exp(log(rng.random()) * n_inv)
+    qu1 = total - n + 1
+    qu1_real = float(qu1)
+    limiar = ALFA_INVERSO * n
+    while n > 1 and limiar < total:
+        n_menos1_inv = 1.0 / (n_real - 1.0)
+        while True:
+            while True:
+                x = total_real * (1.0 - v_linha)
+                salto = int(x)
+                if salto < qu1:
+                    break
+                v_linha = exp(log(rng.random()) * n_inv)
+            u = rng.random()
+            y1 = exp(log(u * total_real / qu1_real) * n_menos1_inv)
+            v_linha = y1 * (1.0 - x / total_real) * (qu1_real / (qu1_real - salto))
+            if v_linha <= 1.0:
+                break
+            y2 = 1.0
+            top = total_real - 1.0
+            if n - 1 > salto:
+                bottom = total_real - n_real
+                limite = total - salto
+            else:
+                bottom = total_real - salto - 1.0
+                limite = qu1
+            t = total - 1
+            while t >= limite:
+                y2 = y2 * top / bottom
+                top -= 1.0
+                bottom -= 1.0
+                t -= 1
+            if total_real / (total_real - x) >= y1 * exp(log(y2) * n_menos1_inv):
+                v_linha = exp(log(rng.random()) * n_menos1_inv)
+                break
+            v_linha = exp(log(rng.random()) * n_inv)
+        atual += salto + 1
+        yield atual
+        total = total - salto - 1
+        total_real = total_real - salto - 1.0
+        n -= 1
+        n_real -= 1.0
+        n_inv = n_menos1_inv
+        qu1 -= salto
+        qu1_real -= salto
+        limiar -= ALFA_INVERSO
+    if n > 1:
+        yield from _amostra_algoritmo_a(n, total, rng, atual)
+    else:
+        yield atual + int(total * v_linha) + 1
+
+
+def gerar_tokens_stream(quantidade, formato=FORMATO_PADRAO, semente=None):
+    """Gera `quantidade` tokens distintos e uniformemente sorteados, um a um, sem guardá-los."""
+    alfabetos = _alfabetos_do_formato(formato)
+    total = tamanho_espaco(formato)
+    if quantidade > total:
+        raise ValueError(f"O formato {formato!r} só tem {total} combinações; pedidos {quantidade}.")
+    rng = random.Random(semente if semente is not None else formato)
+    for indice in indices_amostrados(quantidade, total, rng):
+        yield codigo_do_indice(indice, alfabetos)
+
+
+def gerar_tokens(quantidade, formato=FORMATO_PADRAO, semente=None):
+    return list(gerar_tokens_stream(quantidade, formato, semente))
+
+
+class _LinhasComoArquivo(io.RawIOBase):
+    """Expõe um gerador de tokens como arquivo de texto para o COPY FROM STDIN, sem materializá-lo."""
+
+    def __init__(self, tokens, progresso=None):
+        self._tokens = tokens
+        self._buffer = bytearray()
+        self._posicao = 0
+        self._progresso = progresso
+        self.linhas = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        # Bytes já entregues ficam no início do buffer até ele ser reaproveitado por inteiro
+        if self._posicao == len(self._buffer):
+            del self._buffer[:]
+            self._posicao = 0
+        while len(self._buffer) - self._posicao < len(destino):
+            bloco = []
+            for token in self._tokens:
+                bloco.append(token)
+                if len(bloco) >= 10000:
+                    break
+            if not bloco:
+                break
+            self.linhas += len(bloco)
+            if self._posicao:
+                del self._buffer[:self._posicao]
+                self._posicao = 0
+            self._buffer += ('\n'.join(bloco) + '\n').encode()
+            if self._progresso:
+                self._progresso(self.linhas)
+        n = min(len(destino), len(self._buffer) - self._posicao)
+        destino[:n] = memoryview(self._buffer)[self._posicao:self._posicao + n]
+        self._posicao += n
+        return n
+
+
+def carregar_tokens_no_banco(conn, tokens, progresso=None, rifa_id=1):
+    """Envia os tokens da rifa ao banco via COPY FROM STDIN e insere os que ainda não existem.
+
+    O COPY vai para uma tabela temporária; o INSERT ... ON CONFLICT DO NOTHING final torna a
+    carga idempotente (tokens já existentes não são duplicados nem alterados). O contador de
+    disponíveis é atualizado na mesma transação. Retorna (linhas enviadas, tokens novos).
+    """
+    from reservas import ajustar_contador
+
+    fluxo = _LinhasComoArquivo(iter(tokens), progresso)
+    with conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE tokens_carga (numero_token VARCHAR(10)) ON COMMIT DROP;")
+        cur.copy_expert("COPY tokens_carga (numero_token) FROM STDIN", io.BufferedReader(fluxo, 1 << 20))
+        cur.execute("""
+            INSERT INTO Tokens (rifa_id, numero_token, disponivel)
+            SELECT DISTINCT %s, numero_token, TRUE FROM tokens_carga
+            ON CONFLICT (rifa_id, numero_token) DO NOTHING;
+        """, (rifa_id,))
+        inseridos = cur.rowcount
+        ajustar_contador(cur, rifa_id, inseridos)
+    conn.commit()
+    return fluxo.linhas, inseridos
+
+
+def _relatorio_progresso(inicio):
+    proximo = [100000]
 
+    def progresso(linhas):
+        if linhas >= proximo[0]:
+            decorrido = time.monotonic() - inicio
+            print(f"  {linhas} tokens enviados ({linhas / decorrido:,.0f} linhas/s)")
+            proximo[0] = linhas + 100000
+    return progresso
 
-def gerar_tokens(quantidade):
-    tokens = set()
 
-    while len(tokens) < quantidade:
-        letra = random.choice(string.ascii_uppercase)  # Letra de A a Z
-        numeros = f"{random.randint(0, 999):03d}"       # Número com 3 dígitos
-        token = f"{letra}{numeros}"
-        tokens.add(token)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera números da sorte e os grava em CSV ou direto no banco.")
+    parser.add_argument('--quantidade', type=int, default=2500)
+    parser.add_argument('--formato', default=FORMATO_PADRAO, help="'L' = letra, '9' = dígito (padrão: L999)")
+    parser.add_argument('--semente', default=None, help="Semente do sorteio (padrão: o próprio formato)")
+    parser.add_argument('--csv', default='tokens.csv', help="Arquivo de saída quando --banco não é usado")
+    parser.add_argument('--banco', action='store_true', help="Carrega direto na tabela Tokens (POSTGRES_URL) via COPY")
+    parser.add_argument('--rifa', type=int, default=1, help="Rifa que recebe os tokens com --banco (ver rifas.py)")
+    args = parser.parse_args(argv)
 
-    return list(tokens)
+    try:
+        espaco = tamanho_espaco(args.formato)
+        if args.quantidade > espaco:
+            raise ValueError(f"O formato {args.formato!r} só tem {espaco} combinações; pedidos {args.quantidade}.")
+    except ValueError as e:
+        print(f"Erro: {e}")
+        return 1
+    tokens = gerar_tokens_stream(args.quantidade, args.formato, args.semente)
+    inicio = time.monotonic()
 
+    if args.banco:
+        import psycopg2
+        from dotenv import load_dotenv
 
-# Gerar 2500 tokens
-tokens = gerar_tokens(2500)
+        load_dotenv()
+        database_url = os.getenv('POSTGRES_URL')
+        if not database_url:
+            print("Erro: A variável de ambiente POSTGRES_URL não está definida.")
+            return 1
+        conn = psycopg2.connect(database_url)
+        try:
+            enviados, inseridos = carregar_tokens_no_banco(conn, tokens, _relatorio_progresso(inicio), rifa_id=args.rifa)
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Erro do Psycopg2 ao carregar tokens: {e}")
+            return 1
+        finally:
+            conn.close()
+        decorrido = time.monotonic() - inicio
+        print(f"{enviados} tokens enviados em {decorrido:.1f}s ({enviados / max(decorrido, 1e-9):,.0f} linhas/s); "
+              f"{inseridos} novos, {enviados - inseridos} já existiam.")
+    else:
+        with open(args.csv, "w", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["Token"])  # Cabeçalho da coluna
+            escritos = 0
+            for token in tokens:
+                writer.writerow([token])
+                escritos += 1
+        decorrido = time.monotonic() - inicio
+        print(f"{escritos} tokens salvos com sucesso em '{args.csv}' ({escritos / max(decorrido, 1e-9):,.0f} linhas/s).")
+    return 0
 
-# Salvar em um arquivo CSV
-with open("tokens.csv", "w", newline="") as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(["Token"])  # Cabeçalho da coluna
-    for token in tokens:
-        writer.writerow([token])
 
-print("Tokens salvos com sucesso em 'tokens.csv'.")
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import time
+import logging
+
+from app import iniciar_consumidores
+
+# Processo dedicado às tarefas em segundo plano (fila de notificações e processamento dos
+# webhooks do Mercado Pago). Os workers web não rodam essas tarefas, a menos que
+# TAREFAS_EMBUTIDAS=true (ver app.py e Procfile).
+
+if __name__ == '__main__':
+    consumidores = iniciar_consumidores()
+    logging.info("🛠️ Worker de tarefas em segundo plano iniciado.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        for consumidor in consumidores:
+            consumidor.parar()